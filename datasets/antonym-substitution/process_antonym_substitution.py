@@ -23,6 +23,17 @@ arg_parser.add_argument("-o", "--output", type=str, default=None,
                             f"'{DEFAULT_OUTPUT_DIR}'.")
 arg_parser.add_argument("-f", "--force", action="store_true",
                         help="overwrite data in the output directory")
+arg_parser.add_argument("--profile", action="store_true",
+                        help="also profile the run with cProfile")
+arg_parser.add_argument("--shards", type=int, default=1,
+                        help="number of shards to split the dataset into, "
+                             "written as\n'<name>_<i>.tsv'. Shards already "
+                             "written with the same input\nand arguments are "
+                             "skipped, unless -f is given. Duplicates\nare "
+                             "only removed within each shard. Defaults to 1.")
+arg_parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes the shards are processed "
+                             "in. Defaults\nto 1.")
 
 
 class SemAntoNegDatasetProcessor(BaseDatasetProcessor):
@@ -37,8 +48,10 @@ class SemAntoNegDatasetProcessor(BaseDatasetProcessor):
         output_dir: str,
         **kwargs
     ) -> pd.DataFrame:
-        with open(Path(dataset), "r", encoding="utf-8") as f:
-            sem_anto_neg = [json.loads(line) for line in f if line.strip()]
+        with self.profiler.stage("read") as stage:
+            with open(Path(dataset), "r", encoding="utf-8") as f:
+                sem_anto_neg = [json.loads(line) for line in f if line.strip()]
+            stage.rows += len(sem_anto_neg)
         sem_anto_neg = [
             {
                 "premise": sample["input"],
@@ -48,6 +61,9 @@ class SemAntoNegDatasetProcessor(BaseDatasetProcessor):
             for sample in sem_anto_neg
             for i, sentence in enumerate(sample["sentences"])
         ]
+        # Only within the shard, if sharded. Duplicates in different shards
+        # are removed when produce_negation_dataset.py merges the shards in
+        # order, which keeps the first occurrence.
         return pd.DataFrame(sem_anto_neg).drop_duplicates()
 
 
@@ -61,7 +77,11 @@ def main(args: argparse.ArgumentParser):
             sys.exit()
 
     sem_anto_neg_processor = SemAntoNegDatasetProcessor(dataset_name="SemAntoNeg")
-    sem_anto_neg_processor.process(args.dataset, output_dir=output_dir)
+    sem_anto_neg_processor.process(args.dataset, output_dir=output_dir,
+                                   profile=args.profile,
+                                   num_shards=args.shards,
+                                   num_workers=args.workers,
+                                   force=args.force)
 
 
 if __name__ == "__main__":
@@ -6,12 +6,13 @@ import sys
 import argparse
 from pathlib import Path
 
-import numpy as np
 import pandas as pd
 
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))  # root dir
 from src.base_dataset_processor import BaseDatasetProcessor, DEFAULT_OUTPUT_DIR
-from utils.jaccard_index import jaccard_similarity
+from utils.filters import (at_least, at_most, equals, JACCARD_THRESHOLD,
+                           MAX_LENGTH_DIFFERENCE)
+from utils.jaccard_index import pair_features
 
 arg_parser = argparse.ArgumentParser(
     description=("Process the GLUE Diagnostic Dataset for negations.")
@@ -24,6 +25,30 @@ arg_parser.add_argument("-o", "--output", type=str, default=None,
                             f"'{DEFAULT_OUTPUT_DIR}'.")
 arg_parser.add_argument("-f", "--force", action="store_true",
                         help="overwrite data in the output directory")
+arg_parser.add_argument("--profile", action="store_true",
+                        help="also profile the run with cProfile")
+arg_parser.add_argument("--shards", type=int, default=1,
+                        help="number of shards to split the dataset into, "
+                             "written as\n'<name>_<i>.tsv'. Shards already "
+                             "written with the same input\nand arguments are "
+                             "skipped, unless -f is given. Defaults\nto 1.")
+arg_parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes the shards are processed "
+                             "in. Defaults\nto 1.")
+arg_parser.add_argument("--features", action="store_true",
+                        help="also write the features of every candidate "
+                             "pair, to re-tune\nthe thresholds with "
+                             "'tune_thresholds.py'")
+arg_parser.add_argument("-j", "--jaccard-threshold", type=float,
+                        default=JACCARD_THRESHOLD,
+                        help="minimum Jaccard index between premise and "
+                             "hypothesis. Defaults\nto "
+                            f"{JACCARD_THRESHOLD}.")
+arg_parser.add_argument("-l", "--max-length-diff", type=int,
+                        default=MAX_LENGTH_DIFFERENCE,
+                        help="maximum difference in words between premise and "
+                             "hypothesis.\nDefaults to "
+                            f"{MAX_LENGTH_DIFFERENCE}.")
 
 
 class GlueDiagnosticDatasetProcessor(BaseDatasetProcessor):
@@ -32,29 +57,66 @@ class GlueDiagnosticDatasetProcessor(BaseDatasetProcessor):
     See `README.md`.
     """
 
+    header_lines = 1
+
     def _process(
         self,
         dataset: str,
         output_dir: str,
+        jaccard_threshold: float = JACCARD_THRESHOLD,
+        max_length_diff: int = MAX_LENGTH_DIFFERENCE,
         **kwargs
     ) -> pd.DataFrame:
-        glue = pd.read_csv(Path(dataset), sep="\t")
-        glue = glue.loc[glue["Label"] == "contradiction"]
-
-        jaccard = np.frompyfunc(jaccard_similarity, 2, 1)
-        glue["Jaccard Index"] = jaccard(glue["Premise"], glue["Hypothesis"])
-        glue = glue.loc[glue["Jaccard Index"] >= 0.55]
-
-        length = np.frompyfunc(
-            lambda a, b: abs(len(a.split())-len(b.split())), 2, 1
-        )
-        glue["Length Diff"] = length(glue["Premise"], glue["Hypothesis"])
-        glue = glue.loc[glue["Length Diff"] <= 3]
+        with self.profiler.stage("read") as stage:
+            glue = pd.read_csv(Path(dataset), sep="\t")
+            stage.rows += len(glue)
+        glue = self._apply_filters(glue, [equals("Label", "contradiction")])
         glue = glue[["Premise", "Hypothesis"]]
         glue.rename(columns={"Premise": "sentence",
                              "Hypothesis": "negated"},
                     inplace=True)
-        return glue
+        return self._clean_up_entries(glue, jaccard_threshold,
+                                      max_length_diff)
+
+    def _clean_up_entries(
+        self,
+        dataset: pd.DataFrame,
+        jaccard_threshold: float = JACCARD_THRESHOLD,
+        max_length_diff: int = MAX_LENGTH_DIFFERENCE
+    ) -> pd.DataFrame:
+        """Remove the pairs that are not similar enough.
+
+        These are:
+
+           - Pairs in which the sentence and its negation have a Jaccard
+             index below :paramref:`jaccard_threshold`.
+           - Pairs in which the sentence and its negation differ in length by
+             more than :paramref:`max_length_diff` words.
+
+        Args:
+            dataset (:obj:`pd.DataFrame`):
+                The contradiction pairs, with the columns "sentence" and
+                "negated".
+            jaccard_threshold (:obj:`float`, defaults to ``0.55``):
+                The minimum Jaccard index between both sentences.
+            max_length_diff (:obj:`int`, defaults to ``3``):
+                The maximum difference in words between both sentences.
+
+        Returns:
+            :obj:`pd.DataFrame`: The dataset with the dissimilar pairs
+            removed.
+        """
+        jaccard, length_diff = pair_features(dataset["sentence"].tolist(),
+                                             dataset["negated"].tolist())
+        return self._apply_feature_filters(dataset, pd.DataFrame(
+            {"jaccard": jaccard, "length_diff": length_diff},
+            index=dataset.index
+        ), [
+            at_most("length_diff", max_length_diff,
+                    f"length difference ≤ {max_length_diff}"),
+            at_least("jaccard", jaccard_threshold,
+                     f"Jaccard index ≥ {jaccard_threshold}"),
+        ])
 
 
 def main(args: argparse.ArgumentParser):
@@ -68,7 +130,17 @@ def main(args: argparse.ArgumentParser):
 
     glue_diagnostic_processor = GlueDiagnosticDatasetProcessor(
         dataset_name="GLUE Diagnostic")
-    glue_diagnostic_processor.process(args.dataset, output_dir=output_dir)
+    glue_diagnostic_processor.process(
+        args.dataset,
+        output_dir=output_dir,
+        jaccard_threshold=args.jaccard_threshold,
+        max_length_diff=args.max_length_diff,
+        features=args.features,
+        profile=args.profile,
+        num_shards=args.shards,
+        num_workers=args.workers,
+        force=args.force
+    )
 
 
 if __name__ == "__main__":
@@ -10,6 +10,7 @@ import pandas as pd
 
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))  # root dir
 from src.base_dataset_processor import BaseDatasetProcessor, DEFAULT_OUTPUT_DIR
+from utils.filters import equals
 
 arg_parser = argparse.ArgumentParser(
     description=("Process the NaN-NLI Dataset for negations.")
@@ -22,6 +23,16 @@ arg_parser.add_argument("-o", "--output", type=str, default=None,
                             f"'{DEFAULT_OUTPUT_DIR}'.")
 arg_parser.add_argument("-f", "--force", action="store_true",
                         help="overwrite data in the output directory")
+arg_parser.add_argument("--profile", action="store_true",
+                        help="also profile the run with cProfile")
+arg_parser.add_argument("--shards", type=int, default=1,
+                        help="number of shards to split the dataset into, "
+                             "written as\n'<name>_<i>.tsv'. Shards already "
+                             "written with the same input\nand arguments are "
+                             "skipped, unless -f is given. Defaults\nto 1.")
+arg_parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes the shards are processed "
+                             "in. Defaults\nto 1.")
 
 
 class NanNliDatasetProcessor(BaseDatasetProcessor):
@@ -30,14 +41,19 @@ class NanNliDatasetProcessor(BaseDatasetProcessor):
     See `README.md`.
     """
 
+    header_lines = 1
+
     def _process(
         self,
         dataset: str,
         output_dir: str,
         **kwargs
     ) -> pd.DataFrame:
-        nan_nli = pd.read_csv(Path(dataset), sep=",")
-        nan_nli = nan_nli.loc[nan_nli["label"] == "contradiction"]
+        with self.profiler.stage("read") as stage:
+            nan_nli = pd.read_csv(Path(dataset), sep=",")
+            stage.rows += len(nan_nli)
+        nan_nli = self._apply_filters(nan_nli,
+                                      [equals("label", "contradiction")])
         nan_nli = nan_nli[["premise", "hypothesis"]]
         nan_nli.rename(columns={"premise": "sentence",
                                 "hypothesis": "negated"},
@@ -55,7 +71,11 @@ def main(args: argparse.ArgumentParser):
             sys.exit()
 
     nan_nli_processor = NanNliDatasetProcessor(dataset_name="NaN-NLI")
-    nan_nli_processor.process(args.dataset, output_dir=output_dir)
+    nan_nli_processor.process(args.dataset, output_dir=output_dir,
+                              profile=args.profile,
+                              num_shards=args.shards,
+                              num_workers=args.workers,
+                              force=args.force)
 
 
 if __name__ == "__main__":
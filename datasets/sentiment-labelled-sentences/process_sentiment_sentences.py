@@ -5,13 +5,15 @@
 import sys
 import argparse
 from pathlib import Path
-from typing import Optional
+from typing import List, Optional
 
 import pandas as pd
-from negate import Negator
 
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))  # root dir
 from src.base_dataset_processor import BaseDatasetProcessor, DEFAULT_OUTPUT_DIR
+from utils.filters import at_most, contains, MAX_WORDS
+from utils.inference_client import DEFAULT_ADDRESS, InferenceClient
+from utils.negation import NegationResult, negate_sentences
 
 arg_parser = argparse.ArgumentParser(
     description=("Process the Sentiment Labelled Sentences Dataset for "
@@ -26,17 +28,50 @@ arg_parser.add_argument("-o", "--output", type=str, default=None,
                             f"'{DEFAULT_OUTPUT_DIR}'.")
 arg_parser.add_argument("-f", "--force", action="store_true",
                         help="overwrite data in the output directory")
+arg_parser.add_argument("--profile", action="store_true",
+                        help="also profile the run with cProfile")
+arg_parser.add_argument("--shards", type=int, default=1,
+                        help="number of shards to split the dataset into, "
+                             "written as\n'<name>_<i>.tsv'. Shards already "
+                             "written with the same input\nand arguments are "
+                             "skipped, unless -f is given. Defaults\nto 1.")
+arg_parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes the shards are processed "
+                             "in. Defaults\nto 1.")
+arg_parser.add_argument("--features", action="store_true",
+                        help="also write the features of every candidate "
+                             "pair, to re-tune\nthe thresholds with "
+                             "'tune_thresholds.py'")
+arg_parser.add_argument("-b", "--batch-size", type=int, default=64,
+                        help="number of sentences handed to a negation process "
+                             "at a time.\nDefaults to 64.")
+arg_parser.add_argument("-p", "--n-process", type=int, default=1,
+                        help="number of processes used for negation. Defaults "
+                             "to 1.")
+arg_parser.add_argument("--service", type=str, default=DEFAULT_ADDRESS,
+                        help="address of the inference service to negate "
+                             "with, if one is\nrunning. Defaults to "
+                            f"'{DEFAULT_ADDRESS}'.")
+arg_parser.add_argument("--no-service", action="store_true",
+                        help="always load the negator in this process")
+arg_parser.add_argument("-w", "--max-words", type=int, default=MAX_WORDS,
+                        help="maximum number of words per sentence. Defaults "
+                            f"to {MAX_WORDS}.")
 
 
 class SentimentSentsDatasetProcessor(BaseDatasetProcessor):
     """Sentiment Labelled Sentences dataset processor.
 
     See `README.md`.
+
+    Attributes:
+        skipped (:obj:`List[NegationResult]`):
+            The sentences that could not be negated in the last run.
     """
 
     def __init__(self, dataset_name: str):
         super().__init__(dataset_name)
-        self.negator = Negator(fail_on_unsupported=True)
+        self.skipped: List[NegationResult] = []
         # We want to keep only the sentences that contain any of these words.
         self.target_words = [
             "not",
@@ -65,30 +100,46 @@ class SentimentSentsDatasetProcessor(BaseDatasetProcessor):
             "would", "wouldn't"
         ]
 
-    def _negate_sentence(self, sentence: str) -> Optional[str]:
-        try:
-            return self.negator.negate_sentence(sentence)
-        except RuntimeError:
-            print(f"  ⏩ Skipping unsupported sentence: '{sentence}'.")
-            return None
-
     def _process(
         self,
         dataset: str,
         output_dir: str,
+        batch_size: int = 64,
+        n_process: int = 1,
+        max_words_per_sentence: int = MAX_WORDS,
+        service: Optional[str] = DEFAULT_ADDRESS,
         **kwargs
     ) -> pd.DataFrame:
-        sent_dataset = pd.read_csv(Path(dataset), sep="\t", header=None,
-                                   usecols=[0], names=["premise"])
-        sent_dataset = sent_dataset.loc[
-            sent_dataset["premise"].str.contains("|".join(self.target_words))
-        ]
-        sent_dataset = sent_dataset[
-            sent_dataset["premise"].str.split().str.len().le(33)
-        ]
-        sent_dataset["hypothesis"] = sent_dataset["premise"].apply(
-            self._negate_sentence
+        with self.profiler.stage("read") as stage:
+            sent_dataset = pd.read_csv(Path(dataset), sep="\t", header=None,
+                                       usecols=[0], names=["premise"])
+            stage.rows += len(sent_dataset)
+        sent_dataset = self._apply_filters(sent_dataset, [
+            contains("premise", "|".join(self.target_words)),
+        ])
+        sent_dataset = self._apply_feature_filters(
+            sent_dataset,
+            pd.DataFrame({"words": sent_dataset["premise"].str.split()
+                                                       .str.len()},
+                         index=sent_dataset.index),
+            [at_most("words", max_words_per_sentence,
+                     f"premise ≤ {max_words_per_sentence} words")]
         )
+        with self.profiler.stage("negate", rows=len(sent_dataset),
+                                 sentences=len(sent_dataset)):
+            client = InferenceClient.connect(service)
+            if client is not None:
+                print(f"  🔌 Negating with the service at {service}.")
+                results = [NegationResult(*result) for result in
+                           client.negate(sent_dataset["premise"].tolist())]
+            else:
+                results = negate_sentences(sent_dataset["premise"],
+                                           n_process=n_process,
+                                           chunk_size=batch_size)
+        sent_dataset["hypothesis"] = [result.negated for result in results]
+        self.skipped = [result for result in results if result.error]
+        if self.skipped:
+            print(f"  ⏩ Skipped {len(self.skipped)} unsupported sentences.")
         sent_dataset.dropna(inplace=True)  # remove unsupported sentences
         return sent_dataset
 
@@ -104,7 +155,16 @@ def main(args: argparse.ArgumentParser):
 
     sents_processor = SentimentSentsDatasetProcessor(
         dataset_name="Sentiment-Labelled-Sentences")
-    sents_processor.process(args.dataset, output_dir=output_dir)
+    sents_processor.process(args.dataset, output_dir=output_dir,
+                            batch_size=args.batch_size,
+                            n_process=args.n_process,
+                            max_words_per_sentence=args.max_words,
+                            service=None if args.no_service else args.service,
+                            features=args.features,
+                            profile=args.profile,
+                            num_shards=args.shards,
+                            num_workers=args.workers,
+                            force=args.force)
 
 
 if __name__ == "__main__":
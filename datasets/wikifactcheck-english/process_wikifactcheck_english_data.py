@@ -6,17 +6,26 @@ import sys
 import json
 import argparse
 from pathlib import Path
-from typing import Dict, List
+from typing import TYPE_CHECKING, Iterator, List, Optional, Sequence
 
-import spacy
 import pandas as pd
 from tqdm import tqdm
 
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))  # root dir
 from src.base_dataset_processor import BaseDatasetProcessor, DEFAULT_OUTPUT_DIR
-from utils.jaccard_index import jaccard_similarity
+from utils.filters import (Filter, at_least, at_most, non_empty,
+                           JACCARD_THRESHOLD, MAX_LENGTH_DIFFERENCE)
+from utils.inference_client import DEFAULT_ADDRESS, InferenceClient
+from utils.jaccard_index import pair_features
+from utils.named_entities import (EntityRecognitionPool, entities_match,
+                                  load_ner_pipeline, unmatched_entities)
 from utils.text_processing import add_final_punctuation
 
+if TYPE_CHECKING:
+    from spacy.language import Language
+
+CHUNK_SIZE: int = 10_000  # claims
+
 arg_parser = argparse.ArgumentParser(
     description=("Process the NaN-NLI Dataset for negations.")
 )
@@ -28,6 +37,46 @@ arg_parser.add_argument("-o", "--output", type=str, default=None,
                             f"'{DEFAULT_OUTPUT_DIR}'.")
 arg_parser.add_argument("-f", "--force", action="store_true",
                         help="overwrite data in the output directory")
+arg_parser.add_argument("--profile", action="store_true",
+                        help="also profile the run with cProfile")
+arg_parser.add_argument("--shards", type=int, default=1,
+                        help="number of shards to split the dataset into, "
+                             "written as\n'<name>_<i>.tsv'. Shards already "
+                             "written with the same input\nand arguments are "
+                             "skipped, unless -f is given. Defaults\nto 1.")
+arg_parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes the shards are processed "
+                             "in. Defaults\nto 1.")
+arg_parser.add_argument("--features", action="store_true",
+                        help="also write the features of every candidate "
+                             "pair, to re-tune\nthe thresholds with "
+                             "'tune_thresholds.py'")
+arg_parser.add_argument("-b", "--batch-size", type=int, default=256,
+                        help="number of sentences per spaCy batch. Defaults "
+                             "to 256.")
+arg_parser.add_argument("-p", "--n-process", type=int, default=1,
+                        help="number of processes used for named entity "
+                             "recognition. Defaults to 1.")
+arg_parser.add_argument("-c", "--chunk-size", type=int, default=CHUNK_SIZE,
+                        help="number of claims read, filtered and written at "
+                             "a time.\nDefaults to "
+                            f"{CHUNK_SIZE}.")
+arg_parser.add_argument("--service", type=str, default=DEFAULT_ADDRESS,
+                        help="address of the inference service to recognize "
+                             "named\nentities with, if one is running. "
+                            f"Defaults to '{DEFAULT_ADDRESS}'.")
+arg_parser.add_argument("--no-service", action="store_true",
+                        help="always load the spaCy pipeline in this process")
+arg_parser.add_argument("-j", "--jaccard-threshold", type=float,
+                        default=JACCARD_THRESHOLD,
+                        help="minimum Jaccard index between claim and refuted "
+                             "claim.\nDefaults to "
+                            f"{JACCARD_THRESHOLD}.")
+arg_parser.add_argument("-l", "--max-length-diff", type=int,
+                        default=MAX_LENGTH_DIFFERENCE,
+                        help="maximum difference in words between claim and "
+                             "refuted claim.\nDefaults to "
+                            f"{MAX_LENGTH_DIFFERENCE}.")
 
 
 class WikiFactCheckEnglishDatasetProcessor(BaseDatasetProcessor):
@@ -36,82 +85,156 @@ class WikiFactCheckEnglishDatasetProcessor(BaseDatasetProcessor):
     See `README.md`.
     """
 
+    output_columns = ["sentence", "negated"]
+
     def _process(
         self,
         dataset: str,
         output_dir: str,
+        chunk_size: int = CHUNK_SIZE,
+        service: Optional[str] = DEFAULT_ADDRESS,
+        batch_size: int = 256,
+        n_process: int = 1,
         **kwargs
-    ) -> pd.DataFrame:
-        with open(Path(dataset), "r") as f:
-            wikifactcheck = [
-                {
-                    "sentence": add_final_punctuation(
-                        json.loads(line).pop("claim")
-                    ),
-                    "negated": add_final_punctuation(
-                        json.loads(line).pop("refuted", None)
+    ) -> Iterator[pd.DataFrame]:
+        """Read, clean up and yield the dataset in chunks of claims."""
+        # The spaCy pipeline, or the processes running it, are loaded once
+        # and shared by all chunks, unless a running service already has it
+        # loaded.
+        nlp = None
+        pool = None
+        client = InferenceClient.connect(service)
+        if client is not None:
+            print(f"  🔌 Recognizing named entities with the service at "
+                  f"{service}.")
+        elif n_process > 1:
+            with self.profiler.stage("load model"):
+                pool = EntityRecognitionPool(n_process, batch_size=batch_size)
+        else:
+            with self.profiler.stage("load model"):
+                nlp = load_ner_pipeline()
+        try:
+            with open(Path(dataset), "r") as f:
+                while True:
+                    chunk = []
+                    with self.profiler.stage("read") as stage:
+                        for line in f:
+                            entry = json.loads(line)
+                            chunk.append((
+                                add_final_punctuation(entry["claim"]),
+                                add_final_punctuation(
+                                    entry.get("refuted", None))
+                            ))
+                            if len(chunk) == chunk_size:
+                                break
+                        stage.rows += len(chunk)
+                    if not chunk:
+                        return
+                    yield self._clean_up_entries(
+                        pd.DataFrame.from_records(
+                            chunk, columns=self.output_columns),
+                        nlp=nlp,
+                        pool=pool,
+                        client=client,
+                        batch_size=batch_size,
+                        **kwargs
                     )
-                }
-                for line in f
-            ]
-        return pd.DataFrame.from_records(
-            self._clean_up_entries(wikifactcheck)
-        )
+        finally:
+            if pool is not None:
+                pool.close()
 
     def _clean_up_entries(
         self,
-        dataset: List[Dict[str, str]]
-    ) -> List[Dict[str, str]]:
+        dataset: pd.DataFrame,
+        nlp: Optional["Language"] = None,
+        pool: Optional[EntityRecognitionPool] = None,
+        client: Optional[InferenceClient] = None,
+        batch_size: int = 256,
+        jaccard_threshold: float = JACCARD_THRESHOLD,
+        max_length_diff: int = MAX_LENGTH_DIFFERENCE
+    ) -> pd.DataFrame:
         """Remove invalid entries.
 
         These are:
 
            - Entries with the "negated" field set to :obj:`None`.
            - Entries in which the "claim" and "refuted" fields have a Jaccard
-             index below 0.55.
+             index below :paramref:`jaccard_threshold`.
            - Entries in which the "claim" and "refuted" fields differ in length
-             by 4 or more words.
+             by more than :paramref:`max_length_diff` words.
            - Entries in which the field "claim" contains named entities that
              don't appear in the field "refuted" or vice versa.
 
+        The named entity check is by far the most expensive one, so it only
+        runs on the entries that survive the other filters, unless the
+        features of every entry are being recorded.
+
         Args:
-            dataset (:obj:`List[Dict[str, str]]`):
+            dataset (:obj:`pd.DataFrame`):
                 The parsed dataset.
+            nlp (:obj:`spacy.language.Language`, `optional`):
+                The pipeline used for named entity recognition. If not given,
+                it is loaded.
+            pool (:obj:`EntityRecognitionPool`, `optional`):
+                The processes to use instead of :paramref:`nlp`.
+            client (:obj:`InferenceClient`, `optional`):
+                The inference service to use instead of :paramref:`nlp`.
+            batch_size (:obj:`int`, defaults to ``256``):
+                The number of sentences per spaCy batch.
+            jaccard_threshold (:obj:`float`, defaults to ``0.55``):
+                The minimum Jaccard index between both fields.
+            max_length_diff (:obj:`int`, defaults to ``3``):
+                The maximum difference in words between both fields.
 
         Returns:
-            :obj:`List[Dict[str, str]]`: The dataset dictionary with the invalid
-            entries removed.
+            :obj:`pd.DataFrame`: The dataset with the invalid entries removed.
         """
-        def unmatched_entities_exist(sentence: str, negated: str) -> bool:
-            """Determine whether there are NE in :param:`sentence` not in :param:`negated` or vice versa.
-
-            Args:
-                sentence (:obj:`str`):
-                    A sentence.
-                negated (:obj:`str`):
-                    The negated version of :param:`sentence`.
-
-            Returns:
-                :obj:`bool`: Whether there are NE in :param:`sentence` not in
-                :param:`negated` or vice versa.
-            """
-            nlp = spacy.load("en_core_web_md")
-            doc_sentence, doc_negated = nlp(sentence), nlp(negated)
-
-            ents_sentence = [ent_s.text for ent_s in doc_sentence.ents]
-            ents_negated = [ent_n.text for ent_n in doc_negated.ents]
-            
-            if len(ents_sentence) == len(ents_negated):
-                s_not_in_n = any(ent_s not in ents_negated for ent_s in ents_sentence)
-                n_not_in_s = any(ent_n not in ents_sentence for ent_n in ents_negated)
-                return s_not_in_n or n_not_in_s
-            return True
-
-        return [e for e in tqdm(dataset)
-                if e["negated"]
-                and abs(len(e["sentence"].split()) - len(e["negated"].split())) <= 3
-                and jaccard_similarity(e["sentence"], e["negated"]) >= 0.55
-                and not unmatched_entities_exist(e["sentence"], e["negated"])]
+        def all_entities_match(sentences: List[str],
+                               negated: List[str]) -> List[bool]:
+            with self.profiler.stage("NER", rows=len(sentences),
+                                     sentences=2 * len(sentences)):
+                if client is not None:
+                    entities = client.entities(sentences + negated)
+                    return [entities_match(ents_a, ents_b)
+                            for ents_a, ents_b in zip(
+                                entities[:len(sentences)],
+                                entities[len(sentences):])]
+                if pool is not None:
+                    unmatched = pool.unmatched_entities(zip(sentences,
+                                                            negated))
+                else:
+                    unmatched = unmatched_entities(
+                        tqdm(list(zip(sentences, negated))),
+                        nlp or load_ner_pipeline(),
+                        batch_size=batch_size
+                    )
+                return [not unmatched_ents for unmatched_ents in unmatched]
+
+        def entities_filter(df: pd.DataFrame) -> Sequence[bool]:
+            if "entities_match" in df:
+                return df["entities_match"]
+            # Only the pairs that passed the cheaper filters.
+            return all_entities_match(df["sentence"].tolist(),
+                                      df["negated"].tolist())
+
+        dataset = self._apply_filters(dataset, [non_empty("negated")])
+        sentences = dataset["sentence"].tolist()
+        negated = dataset["negated"].tolist()
+        jaccard, length_diff = pair_features(sentences, negated)
+        features = pd.DataFrame({"jaccard": jaccard,
+                                 "length_diff": length_diff},
+                                index=dataset.index)
+        if self.record_features:
+            features["entities_match"] = (all_entities_match(sentences,
+                                                             negated)
+                                          if sentences else [])
+        return self._apply_feature_filters(dataset, features, [
+            at_most("length_diff", max_length_diff,
+                    f"length difference ≤ {max_length_diff}"),
+            at_least("jaccard", jaccard_threshold,
+                     f"Jaccard index ≥ {jaccard_threshold}"),
+            Filter("named entities match", entities_filter, 100.),
+        ])
 
 
 def main(args: argparse.ArgumentParser):
@@ -125,7 +248,19 @@ def main(args: argparse.ArgumentParser):
 
     wikifactcheck_processor = WikiFactCheckEnglishDatasetProcessor(
         dataset_name="WikiFactCheck-English")
-    wikifactcheck_processor.process(args.dataset, output_dir=output_dir)
+    wikifactcheck_processor.process(args.dataset, output_dir=output_dir,
+                                    chunk_size=args.chunk_size,
+                                    service=(None if args.no_service
+                                             else args.service),
+                                    batch_size=args.batch_size,
+                                    n_process=args.n_process,
+                                    jaccard_threshold=args.jaccard_threshold,
+                                    max_length_diff=args.max_length_diff,
+                                    features=args.features,
+                                    profile=args.profile,
+                                    num_shards=args.shards,
+                                    num_workers=args.workers,
+                                    force=args.force)
 
 
 if __name__ == "__main__":
@@ -1,16 +1,47 @@
 """Base data processor.
 
 Specific dataset processors should inherit from this base processor.
+
+Processors can either return the whole processed dataset at once, or yield it
+in chunks, which are written as they come. The latter keeps the memory usage
+bounded by the chunk size, regardless of the size of the dataset.
+
+Line-based datasets can also be split into shards of contiguous records,
+which are processed in parallel and written as ``<name>_<i>.tsv``. The input,
+number of shards and arguments of the run are recorded in
+``<name>.shards.json``; shards already written by a run with the same ones
+are skipped, so an interrupted run can be resumed.
+
+Optionally, processors also store the features of every candidate pair (see
+:mod:`utils.feature_store`), so that their thresholds can be re-tuned
+without processing the dataset again.
 """
 
+import sys
+import json
 import casefy
+import tempfile
+import multiprocessing
 from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
 import pandas as pd
 
+# The processors import the modules in ``src/utils/`` as ``utils``; importing
+# them under a second name would load them twice.
+sys.path.insert(0, str(Path(__file__).parent))  # src dir
+from utils.filters import (Filter, FilterPipeline, FilterStats, format_stats,
+                           merge_stats)
+from utils.feature_store import FEATURES_SUFFIX, FeatureWriter
+from utils.packed_corpus import PackedCorpusWriter, PACKED_SUFFIX
+from utils.profiling import Profiler, PROFILE_SUFFIX
+from utils.sharding import (existing_shards, file_hash, remove_path,
+                            replace_atomically, shard_path, split_lines)
+
 DEFAULT_OUTPUT_DIR = "processed/"
+SHARDS_MANIFEST_SUFFIX = ".shards.json"
 
 
 class BaseDatasetProcessor(ABC):
@@ -22,8 +53,30 @@ class BaseDatasetProcessor(ABC):
         default_output_dir (:obj:`pathlib.Path`):
             The default directory where the processed data will be written to.
             If not provided, defaults to "processed/".
+        filter_stats (:obj:`List[FilterStats]`):
+            The statistics of the filters applied in the last run, added up
+            over all chunks.
+        profiler (:obj:`Profiler`):
+            The stage measurements of the last run. Children classes can
+            record their own stages (e.g., "read" or "negate") with
+            :meth:`Profiler.stage`.
+        header_lines (:obj:`int`):
+            The number of header lines of the input dataset, which are
+            repeated in every shard when the dataset is sharded.
+        record_features (:obj:`bool`):
+            Whether the features of the candidate pairs are being recorded.
+            Children classes record them with
+            :meth:`_apply_feature_filters`, which writes them next to the
+            output as they come.
+        output_columns (:obj:`Optional[List[str]]`):
+            The columns of the processed dataset. Children classes that yield
+            it in chunks should set them, so that the header is written even
+            if no chunk is yielded.
     """
 
+    header_lines: int = 0
+    output_columns: Optional[List[str]] = None
+
     def __init__(
         self,
         dataset_name: str,
@@ -33,11 +86,21 @@ class BaseDatasetProcessor(ABC):
         self.default_output_dir = (Path(default_output_dir)
                                    if default_output_dir
                                    else Path(DEFAULT_OUTPUT_DIR))
+        self.filter_stats: List[FilterStats] = []
+        self.profiler = Profiler()
+        self.record_features = False
+        self._feature_writer: Optional[FeatureWriter] = None
 
     def process(
         self,
         dataset: Any,
         output_dir: Optional[str] = None,
+        output_format: str = "tsv",
+        profile: bool = False,
+        num_shards: int = 1,
+        num_workers: int = 1,
+        features: bool = False,
+        force: bool = False,
         **kwargs
     ) -> None:
         """Process a dataset.
@@ -48,24 +111,322 @@ class BaseDatasetProcessor(ABC):
             output_dir (:obj:`Optional[str]`):
                 The directory where the processed data will be written to. If
                 not specified, :attr:`default_output_dir` is used.
+            output_format (:obj:`str`, defaults to ``"tsv"``):
+                Either ``"tsv"``, or ``"packed"`` to write a memory-mappable
+                corpus (see :mod:`utils.packed_corpus`).
+            profile (:obj:`bool`, defaults to :obj:`False`):
+                Whether to also profile the run with :mod:`cProfile`. The
+                stage measurements are written next to the output either way.
+            num_shards (:obj:`int`, defaults to ``1``):
+                The number of shards to split the dataset, which must then be
+                a line-based file, into. If ``1``, a single output is written.
+            num_workers (:obj:`int`, defaults to ``1``):
+                The number of processes the shards are processed in.
+            features (:obj:`bool`, defaults to :obj:`False`):
+                Whether to compute every feature of every candidate pair,
+                and write them next to the output (see
+                :mod:`utils.feature_store`).
+            force (:obj:`bool`, defaults to :obj:`False`):
+                Whether to process every shard again, even if it was already
+                written with the same input and arguments.
         """
         output_dir = Path(output_dir) if output_dir else self.default_output_dir
         output_dir.mkdir(parents=True, exist_ok=True)
         print(f"♻️  Processing dataset '{self.dataset_name}'...")
-        processed_dataset = self._process(dataset, output_dir, **kwargs)
+        self.filter_stats = []
+        self.profiler = Profiler(profile)
+        self.record_features = features
         filename = casefy.snakecase(self.dataset_name)
-        processed_dataset.to_csv(output_dir/f"{filename}.tsv", sep="\t",
-                                 encoding='utf-8', index=False)
+        suffix = PACKED_SUFFIX if output_format == "packed" else ".tsv"
+        if num_shards > 1:
+            self._process_shards(dataset, output_dir/f"{filename}{suffix}",
+                                 output_format, profile, num_shards,
+                                 num_workers, force, **kwargs)
+        else:
+            self._process_and_write(dataset, output_dir/f"{filename}{suffix}",
+                                    output_format, **kwargs)
+        if self.filter_stats:
+            print(format_stats(self.filter_stats))
+        self.profiler.write(output_dir/f"{filename}{PROFILE_SUFFIX}")
         print(f"✅ Done! Output data written to '{output_dir}/'.")
 
+    def _process_and_write(
+        self,
+        dataset: Any,
+        path: Path,
+        output_format: str,
+        **kwargs
+    ):
+        """Process a dataset and write it atomically.
+
+        The output is written next to :paramref:`path` first, and only moved
+        into place once complete, so that an interrupted run never leaves a
+        partial output behind. So are the features of the candidate pairs, if
+        recorded, which are written as the chunks are processed.
+        """
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        features_path = path.with_name(path.name.split(".")[0]
+                                       + FEATURES_SUFFIX)
+        tmp_features_path = path.with_name(f".{features_path.name}.tmp")
+        if self.record_features:
+            self._feature_writer = FeatureWriter(tmp_features_path,
+                                                 self.dataset_name)
+        try:
+            with self.profiler.stage("process") as stage:
+                processed = self._process(dataset, path.parent, **kwargs)
+            if isinstance(processed, pd.DataFrame):
+                stage.rows += len(processed)
+                chunks = [processed]
+            else:
+                chunks = self._profile_chunks(processed)
+            if output_format == "packed":
+                self._write_packed(chunks, tmp_path)
+            else:
+                self._write_tsv(chunks, tmp_path)
+            if self._feature_writer is not None:
+                with self.profiler.stage("write features"):
+                    self._feature_writer.close()
+                replace_atomically(tmp_features_path, features_path)
+        finally:
+            if self._feature_writer is not None:
+                self._feature_writer.discard()
+                self._feature_writer = None
+        replace_atomically(tmp_path, path)
+
+    def _process_shards(
+        self,
+        dataset: Union[str, Path],
+        path: Path,
+        output_format: str,
+        profile: bool,
+        num_shards: int,
+        num_workers: int,
+        force: bool,
+        **kwargs
+    ):
+        """Split a dataset into shards and process them in parallel.
+
+        Every shard is processed by a copy of this processor, and written to
+        the shard of :paramref:`path`. Shards that were already written from
+        the same input, number of shards and arguments are skipped, unless
+        :paramref:`force` is set; any other shards of :paramref:`path` are
+        removed.
+        """
+        manifest_path = path.with_name(path.name.split(".")[0]
+                                       + SHARDS_MANIFEST_SUFFIX)
+        with self.profiler.stage("hash"):
+            manifest = json.loads(json.dumps({
+                "input": file_hash(dataset),
+                "num_shards": num_shards,
+                "output_format": output_format,
+                "features": self.record_features,
+                "kwargs": kwargs,
+            }, sort_keys=True, default=str))
+        previous = None
+        if not force and manifest_path.exists():
+            with open(manifest_path, encoding="utf-8") as f:
+                previous = json.load(f)
+        with tempfile.TemporaryDirectory(dir=path.parent) as tmp_dir:
+            with self.profiler.stage("split"):
+                inputs = split_lines(dataset, num_shards, tmp_dir,
+                                     self.header_lines)
+            # Shards of a different run, or beyond the shards of this one,
+            # would be mixed up with those of this run.
+            for i in existing_shards(path):
+                if previous != manifest or i >= len(inputs):
+                    for output in self._shard_outputs(path, i):
+                        remove_path(output)
+            tmp_manifest_path = path.with_name(f".{manifest_path.name}.tmp")
+            with open(tmp_manifest_path, "w", encoding="utf-8") as f:
+                json.dump(manifest, f, indent=2)
+            replace_atomically(tmp_manifest_path, manifest_path)
+            pending = [(i, shard) for i, shard in enumerate(inputs)
+                       if not shard_path(path, i).exists()]
+            if len(pending) < len(inputs):
+                print(f"  ⏩ Skipping {len(inputs) - len(pending)} of "
+                      f"{len(inputs)} shards, which were already written.")
+            # Spawned, rather than forked, workers do not inherit the state
+            # of the threads or models of this process.
+            with self.profiler.stage("shards") as stage, ProcessPoolExecutor(
+                max_workers=max(min(num_workers, len(pending)), 1),
+                mp_context=multiprocessing.get_context("spawn")
+            ) as executor:
+                futures = [
+                    executor.submit(_process_shard, self, shard,
+                                    shard_path(path, i), output_format,
+                                    profile, kwargs)
+                    for i, shard in pending
+                ]
+                for future in futures:
+                    rows, filter_stats = future.result()
+                    stage.rows += rows
+                    self.filter_stats = merge_stats(self.filter_stats,
+                                                    filter_stats)
+
+    @staticmethod
+    def _shard_outputs(path: Path, index: int) -> List[Path]:
+        """Get the output, features and measurements of a shard."""
+        shard = shard_path(path, index)
+        stem = shard.name.split(".")[0]
+        return [shard, shard.with_name(stem + FEATURES_SUFFIX),
+                shard.with_name(stem + PROFILE_SUFFIX)]
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # The profiler is not picklable, and every process records its own.
+        state = self.__dict__.copy()
+        del state["profiler"]
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]):
+        self.__dict__.update(state)
+        self.profiler = Profiler()
+
+    def _profile_chunks(
+        self,
+        chunks: Iterator[pd.DataFrame]
+    ) -> Iterator[pd.DataFrame]:
+        """Measure the time spent producing every chunk."""
+        while True:
+            with self.profiler.stage("process") as stage:
+                chunk = next(chunks, None)
+                if chunk is not None:
+                    stage.rows += len(chunk)
+            if chunk is None:
+                return
+            yield chunk
+
+    def _write_tsv(self, chunks: Iterable[pd.DataFrame], path: Path):
+        """Write processed data as a ``.tsv`` file, one chunk at a time.
+
+        Args:
+            chunks (:obj:`Iterable[pd.DataFrame]`):
+                The processed data.
+            path (:obj:`pathlib.Path`):
+                The file to write to.
+        """
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            header = True
+            for chunk in chunks:
+                with self.profiler.stage("write", rows=len(chunk)):
+                    chunk.to_csv(f, sep="\t", index=False, header=header)
+                header = False
+            if header:
+                pd.DataFrame(columns=self.output_columns).to_csv(
+                    f, sep="\t", index=False)
+
+    def _write_packed(self, chunks: Iterable[pd.DataFrame], path: Path):
+        """Write processed data as a packed corpus.
+
+        The first two columns are taken as the premise and the hypothesis,
+        and the third one, if any, as the label.
+
+        Args:
+            chunks (:obj:`Iterable[pd.DataFrame]`):
+                The processed data.
+            path (:obj:`pathlib.Path`):
+                The directory to write the corpus to.
+        """
+        writer = None
+        for chunk in chunks:
+            columns = list(chunk.columns[:3])
+            writer = writer or PackedCorpusWriter(columns)
+            with self.profiler.stage("write", rows=len(chunk)):
+                for row in chunk[columns].itertuples(index=False):
+                    writer.add(row[0], row[1],
+                               row[2] if len(row) > 2 else None,
+                               self.dataset_name)
+        with self.profiler.stage("write"):
+            (writer or PackedCorpusWriter()).write(path)
+
+    def _apply_filters(
+        self,
+        dataset: pd.DataFrame,
+        filters: Iterable[Filter]
+    ) -> pd.DataFrame:
+        """Remove the rows that do not pass the filters.
+
+        The filters run cheapest first. Their statistics are added to
+        :attr:`filter_stats`, and printed once the whole dataset has been
+        processed.
+
+        Args:
+            dataset (:obj:`pd.DataFrame`):
+                The rows to filter.
+            filters (:obj:`Iterable[Filter]`):
+                The filters to apply.
+
+        Returns:
+            :obj:`pd.DataFrame`: The rows that passed all the filters.
+        """
+        pipeline = FilterPipeline(filters)
+        with self.profiler.stage("filter", rows=len(dataset)):
+            dataset = pipeline.apply(dataset)
+        self.filter_stats = merge_stats(self.filter_stats, pipeline.stats)
+        return dataset
+
+    def _apply_feature_filters(
+        self,
+        dataset: pd.DataFrame,
+        features: pd.DataFrame,
+        filters: Iterable[Filter]
+    ) -> pd.DataFrame:
+        """Record the features of the candidate pairs, and filter by them.
+
+        Args:
+            dataset (:obj:`pd.DataFrame`):
+                The candidate pairs.
+            features (:obj:`pd.DataFrame`):
+                The features of every candidate pair, with the same index as
+                :paramref:`dataset` and a column per feature (see
+                :mod:`utils.feature_store`).
+            filters (:obj:`Iterable[Filter]`):
+                The filters to apply, on the feature columns.
+
+        Returns:
+            :obj:`pd.DataFrame`: The pairs that passed all the filters,
+            without the feature columns.
+        """
+        if self._feature_writer is not None:
+            self._feature_writer.add(features)
+        return self._apply_filters(dataset.join(features),
+                                   filters)[list(dataset.columns)]
+
     @abstractmethod
     def _process(
         self,
         dataset: Any,
         output_dir: str,
         **kwargs
-    ) -> pd.DataFrame:
+    ) -> Union[pd.DataFrame, Iterator[pd.DataFrame]]:
         """Process a dataset.
 
-        Not meant to be called directly. To be implemented by children classes.
+        Not meant to be called directly. To be implemented by children classes,
+        either returning the processed dataset, or yielding it in chunks with
+        the same columns.
         """
+
+
+def _process_shard(
+    processor: BaseDatasetProcessor,
+    dataset: Path,
+    path: Path,
+    output_format: str,
+    profile: bool,
+    kwargs: Dict[str, Any]
+) -> Tuple[int, List[FilterStats]]:
+    """Process a single shard in a worker process.
+
+    The stage measurements of the shard are written next to its output.
+
+    Returns:
+        :obj:`Tuple[int, List[FilterStats]]`: The number of rows written, and
+        the statistics of the filters applied.
+    """
+    # The processor may have been pickled after other shards were merged.
+    processor.filter_stats = []
+    processor.profiler = Profiler(profile)
+    processor._process_and_write(dataset, path, output_format, **kwargs)
+    processor.profiler.write(
+        path.with_name(path.name.split(".")[0] + PROFILE_SUFFIX))
+    return (processor.profiler.stages["process"].rows,
+            processor.filter_stats)
@@ -0,0 +1,187 @@
+"""Batch scheduling utilities.
+
+Sentences are tokenized with ``padding='longest'``, so every sentence in a
+batch is padded up to the longest one and generation then runs over the
+padding as well. Sorting the sentences by token length and filling each batch
+up to a token budget, instead of cutting the input into fixed-size batches,
+keeps the padding (and the wasted work) to a minimum.
+"""
+
+import time
+from typing import Callable, List, Optional, Protocol
+
+
+class Paraphraser(Protocol):
+    """Anything with the interface of :class:`paraphrasis.PegasusParaphraser`."""
+
+    def token_lengths(self, sentences: List[str]) -> List[int]:
+        ...
+
+    def paraphrase_batch(
+        self,
+        sentences: List[str],
+        num_return_sentences: int = 1,
+        num_beams: int = 4
+    ) -> List[List[str]]:
+        ...
+
+
+def _is_full(
+    batch: List[int],
+    length: int,
+    max_tokens: int,
+    max_batch_size: Optional[int]
+) -> bool:
+    """Determine whether a sentence would overflow a batch.
+
+    Sentences are added in ascending length, so the new one is always the
+    longest in the batch and determines its padded size.
+    """
+    if not batch:
+        return False
+    return ((len(batch) + 1) * length > max_tokens
+            or bool(max_batch_size and len(batch) >= max_batch_size))
+
+
+def token_budget_batches(
+    lengths: List[int],
+    max_tokens: int,
+    max_batch_size: Optional[int] = None
+) -> List[List[int]]:
+    """Group sentences of similar length into batches under a token budget.
+
+    The cost of a batch is its padded size, i.e., the number of sentences
+    times the length of the longest one.
+
+    Args:
+        lengths (:obj:`List[int]`):
+            The token length of each sentence.
+        max_tokens (:obj:`int`):
+            The maximum padded size of a batch. A sentence longer than the
+            budget gets a batch of its own.
+        max_batch_size (:obj:`int`, `optional`, defaults to :obj:`None`):
+            The maximum number of sentences per batch, if any.
+
+    Returns:
+        :obj:`List[List[int]]`: The indices of the sentences in each batch.
+    """
+    batches: List[List[int]] = []
+    batch: List[int] = []
+    for i in sorted(range(len(lengths)), key=lengths.__getitem__):
+        if _is_full(batch, lengths[i], max_tokens, max_batch_size):
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class TokenBudgetScheduler:
+    """Paraphraser front-end that batches sentences by token length.
+
+    It exposes the same :meth:`paraphrase_batch` interface as the paraphraser
+    it wraps, so it can be used as a drop-in replacement, e.g., inside a
+    :class:`paraphrasis.CachedParaphraser`.
+
+    Attributes:
+        paraphraser (:obj:`Paraphraser`):
+            The underlying paraphraser.
+        max_tokens (:obj:`int`):
+            The current token budget per batch.
+        max_batch_size (:obj:`Optional[int]`):
+            The maximum number of sentences per batch, if any.
+        auto_tune (:obj:`bool`):
+            Whether to adjust :attr:`max_tokens` from the measured throughput.
+        min_tokens (:obj:`int`):
+            The lower bound of :attr:`max_tokens` when auto-tuning.
+        max_tokens_limit (:obj:`int`):
+            The upper bound of :attr:`max_tokens` when auto-tuning.
+        tokens_per_second (:obj:`float`):
+            The throughput, in non-padding input tokens per second, of the
+            last generated batch.
+    """
+
+    def __init__(
+        self,
+        paraphraser: Paraphraser,
+        max_tokens: int = 1024,
+        max_batch_size: Optional[int] = None,
+        auto_tune: bool = False,
+        min_tokens: int = 128,
+        max_tokens_limit: int = 8192,
+        clock: Callable[[], float] = time.perf_counter
+    ):
+        self.paraphraser = paraphraser
+        self.max_tokens = max_tokens
+        self.max_batch_size = max_batch_size
+        self.auto_tune = auto_tune
+        self.min_tokens = min_tokens
+        self.max_tokens_limit = max_tokens_limit
+        self.tokens_per_second = 0.
+        self._clock = clock
+        self._tune_step = 1.25
+
+    def _tune(self, tokens_per_second: float):
+        """Hill-climb the token budget towards the highest throughput.
+
+        The budget keeps moving in the same direction while the throughput
+        improves, and turns around as soon as it gets worse.
+
+        Args:
+            tokens_per_second (:obj:`float`):
+                The throughput of the batch that has just been generated.
+        """
+        if tokens_per_second < self.tokens_per_second:
+            self._tune_step = 1 / self._tune_step
+        self.max_tokens = int(min(max(self.max_tokens * self._tune_step,
+                                      self.min_tokens),
+                                  self.max_tokens_limit))
+
+    def paraphrase_batch(
+        self,
+        sentences: List[str],
+        num_return_sentences: int = 1,
+        num_beams: int = 4
+    ) -> List[List[str]]:
+        """Paraphrase sentences in length-bucketed, token-budgeted batches.
+
+        See :meth:`paraphrasis.PegasusParaphraser.paraphrase_batch`.
+
+        Returns:
+            :obj:`List[List[str]]`: The paraphrased sentences, in the same
+            order as :paramref:`sentences`.
+        """
+        if not sentences:
+            return []
+        lengths = self.paraphraser.token_lengths(sentences)
+        results: List[Optional[List[str]]] = [None] * len(sentences)
+
+        def generate(batch: List[int]):
+            begin = self._clock()
+            paraphrased = self.paraphraser.paraphrase_batch(
+                [sentences[i] for i in batch],
+                num_return_sentences=num_return_sentences,
+                num_beams=num_beams
+            )
+            elapsed = self._clock() - begin
+            for i, paraphrases in zip(batch, paraphrased):
+                results[i] = paraphrases
+            if elapsed > 0:
+                tokens_per_second = sum(lengths[i] for i in batch) / elapsed
+                if self.auto_tune:
+                    self._tune(tokens_per_second)
+                self.tokens_per_second = tokens_per_second
+
+        batch: List[int] = []
+        for i in sorted(range(len(sentences)), key=lengths.__getitem__):
+            # The budget is read on every step, so a retuned value applies to
+            # the remaining sentences straight away.
+            if _is_full(batch, lengths[i], self.max_tokens,
+                        self.max_batch_size):
+                generate(batch)
+                batch = []
+            batch.append(i)
+        if batch:
+            generate(batch)
+        return results
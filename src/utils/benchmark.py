@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+
+"""Benchmark the hot paths of the dataset build on synthetic data.
+
+Synthetic negation corpora of the given sizes are generated, and every hot
+path is timed on them: merging and deduplicating the samples, adding the
+swapped samples, shuffling and writing them in
+``produce_negation_dataset.py``, the Jaccard index, the GLUE Diagnostic and
+WikiFactCheck-English filters, paraphrase batch scheduling and
+:meth:`BaseDatasetProcessor.process`. The paraphraser and the named entity
+recognizer are replaced by cheap stubs, so that the benchmarks run offline
+and on CPU.
+
+The results can be saved as a JSON baseline, and later runs compared against
+it, e.g.::
+
+   ./benchmark.py -s 1000 10000 --save baseline.json
+   ./benchmark.py -s 1000 10000 --compare baseline.json
+
+When comparing, the exit status is non-zero if any benchmark is slower than
+the baseline by more than the tolerance.
+"""
+
+import io
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import importlib.util
+from pathlib import Path
+from types import ModuleType
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import benchmark
+from batching import TokenBudgetScheduler
+from dedup import Sample, SampleDeduplicator, format_sample, parse_line
+from jaccard_index import jaccard_similarity, pair_features
+from shuffle import shuffle_lines
+
+ROOT_DIR: Path = Path(__file__).resolve().parent.parent.parent
+sys.path.insert(0, str(ROOT_DIR / "src"))
+# Imported as the processors import them, so they are only loaded once.
+from utils.packed_corpus import PackedCorpusWriter
+
+SIZES: List[int] = [1_000, 10_000, 100_000, 1_000_000]
+VOCABULARY_SIZE: int = 5_000
+DUPLICATE_RATIO: float = 0.1
+SCALAR_JACCARD_LIMIT: int = 10_000  # pairs
+TOLERANCE: float = 0.2
+
+arg_parser = argparse.ArgumentParser(
+    formatter_class=argparse.RawTextHelpFormatter,
+    description=(benchmark.__doc__)
+)
+arg_parser.add_argument("-s", "--sizes", type=int, nargs="+", default=SIZES,
+                        help="numbers of sample pairs of the synthetic "
+                             "corpora. Defaults\nto "
+                            f"{' '.join(map(str, SIZES))}.")
+arg_parser.add_argument("-b", "--benchmarks", nargs="+", default=None,
+                        help="names of the benchmarks to run. Defaults to all "
+                             "of them.")
+arg_parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="number of runs per benchmark, of which the "
+                             "fastest one is\nkept. Defaults to 3.")
+arg_parser.add_argument("--seed", type=int, default=0,
+                        help="seed of the synthetic corpora. Defaults to 0.")
+arg_parser.add_argument("--save", type=str, default=None,
+                        help="file to save the results to, as a JSON "
+                             "baseline")
+arg_parser.add_argument("--compare", type=str, default=None,
+                        help="JSON baseline to compare the results against")
+arg_parser.add_argument("-t", "--tolerance", type=float, default=TOLERANCE,
+                        help="relative slowdown over the baseline reported as "
+                             "a\nregression. Defaults to "
+                            f"{TOLERANCE}.")
+
+
+def synthetic_corpus(size: int, seed: int = 0) -> List[Sample]:
+    """Generate a synthetic negation corpus.
+
+    Premises are random sentences over a Zipf-distributed vocabulary, with a
+    few capitalized "named entities". Hypotheses are either the negated
+    premise (label ``"1"``) or the premise with a couple of words replaced
+    (label ``"0"``). A fraction of the samples are exact duplicates.
+
+    Args:
+        size (:obj:`int`):
+            The number of samples.
+        seed (:obj:`int`, defaults to ``0``):
+            The random seed.
+
+    Returns:
+        :obj:`List[Sample]`: The ``(premise, hypothesis, label)`` triples.
+    """
+    rng = np.random.default_rng(seed)
+    vocabulary = [f"w{i}" for i in range(VOCABULARY_SIZE)]
+    entities = [f"Entity{i}" for i in range(VOCABULARY_SIZE // 10)]
+    samples: List[Sample] = []
+    num_unique = size - int(size * DUPLICATE_RATIO)
+    lengths = rng.integers(5, 30, size=num_unique)
+    for length in lengths:
+        word_ids = np.minimum(rng.zipf(1.3, size=length),
+                              VOCABULARY_SIZE) - 1
+        words = [vocabulary[i] for i in word_ids]
+        words[rng.integers(length)] = entities[rng.integers(len(entities))]
+        premise = " ".join(words) + "."
+        if rng.random() < 0.5:
+            position = rng.integers(1, length)
+            hypothesis = " ".join(words[:position] + ["not"]
+                                  + words[position:]) + "."
+            label = "1"
+        else:
+            for position in rng.integers(length, size=2):
+                words[position] = vocabulary[rng.integers(VOCABULARY_SIZE)]
+            hypothesis = " ".join(words) + "."
+            label = "0"
+        samples.append((premise, hypothesis, label))
+    duplicates = rng.integers(num_unique, size=size - num_unique)
+    samples.extend(samples[i] for i in duplicates)
+    return samples
+
+
+class StubParaphraser:
+    """Paraphraser that reverses the words of a sentence, for benchmarking."""
+
+    def token_lengths(self, sentences: List[str]) -> List[int]:
+        return [len(sentence.split()) + 1 for sentence in sentences]
+
+    def paraphrase_batch(
+        self,
+        sentences: List[str],
+        num_return_sentences: int = 1,
+        num_beams: int = 4
+    ) -> List[List[str]]:
+        return [[" ".join(reversed(sentence.split()))] * num_return_sentences
+                for sentence in sentences]
+
+
+class StubEntityClient:
+    """Inference client taking capitalized words as the named entities."""
+
+    def entities(self, sentences: List[str]) -> List[List[str]]:
+        return [[word for word in sentence.split() if word[0].isupper()]
+                for sentence in sentences]
+
+
+def load_processor(script: str) -> ModuleType:
+    """Import a dataset processor, whose directory is not a package.
+
+    Args:
+        script (:obj:`str`):
+            The path of the processor script, relative to ``datasets/``.
+
+    Returns:
+        :obj:`types.ModuleType`: The processor module.
+    """
+    path = ROOT_DIR / "datasets" / script
+    spec = importlib.util.spec_from_file_location(path.stem, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[path.stem] = module  # so that its classes can be pickled
+    spec.loader.exec_module(module)
+    return module
+
+
+glue_diagnostic = load_processor(
+    "glue-diagnostic/process_glue_diagnostic_data.py")
+wikifactcheck_english = load_processor(
+    "wikifactcheck-english/process_wikifactcheck_english_data.py")
+
+
+class SyntheticDatasetProcessor(
+    wikifactcheck_english.WikiFactCheckEnglishDatasetProcessor
+):
+    """WikiFactCheck-English processor for a synthetic corpus."""
+
+    def _process(
+        self,
+        dataset: pd.DataFrame,
+        output_dir: str,
+        **kwargs
+    ) -> pd.DataFrame:
+        return self._clean_up_entries(dataset, client=StubEntityClient())
+
+
+def merged(samples: List[Sample]) -> SampleDeduplicator:
+    """Merge the samples as ``produce_negation_dataset.py`` does."""
+    deduplicator = SampleDeduplicator()
+    deduplicator.add_all((parse_line(format_sample(sample))
+                          for sample in samples), source="synthetic")
+    return deduplicator
+
+
+def benchmarks(
+    samples: List[Sample],
+    workdir: Path
+) -> Dict[str, Tuple[Callable[[], object], Callable[[], None]]]:
+    """Build the benchmarks for a corpus.
+
+    Args:
+        samples (:obj:`List[Sample]`):
+            The synthetic corpus.
+        workdir (:obj:`pathlib.Path`):
+            A scratch directory for the benchmarks that write files.
+
+    Returns:
+        :obj:`Dict[str, Tuple[Callable[[], object], Callable[[], None]]]`:
+        For every benchmark name, a setup function, whose time is not
+        measured, and the function to time, which receives the result of the
+        setup.
+    """
+    lines = [format_sample(sample) for sample in samples]
+    premises = [premise for premise, _, _ in samples]
+    hypotheses = [hypothesis for _, hypothesis, _ in samples]
+    pairs = pd.DataFrame({"sentence": premises, "negated": hypotheses})
+    glue_processor = glue_diagnostic.GlueDiagnosticDatasetProcessor(
+        "synthetic")
+    wikifactcheck_processor = (
+        wikifactcheck_english.WikiFactCheckEnglishDatasetProcessor(
+            "synthetic"))
+    processor = SyntheticDatasetProcessor("synthetic")
+
+    def write_tsv(deduplicator: SampleDeduplicator):
+        with open(workdir / "synthetic.tsv", "w", encoding="utf-8") as f:
+            f.writelines(deduplicator.lines())
+
+    def write_packed(deduplicator: SampleDeduplicator):
+        writer = PackedCorpusWriter()
+        writer.add_all((*sample, "synthetic") for sample in deduplicator)
+        writer.write(workdir / "synthetic.packed")
+
+    def quiet_process(_):
+        # The processor reports its progress, which is not being measured.
+        stdout, sys.stdout = sys.stdout, io.StringIO()
+        try:
+            processor.process(pairs, output_dir=workdir / "processed")
+        finally:
+            sys.stdout = stdout
+
+    def nothing():
+        return None
+
+    return {
+        "merge": (nothing, lambda _: merged(samples)),
+        "swap": (lambda: merged(samples), lambda d: d.add_swapped()),
+        "shuffle": (nothing, lambda _: shuffle_lines(
+            lines, io.StringIO(), seed=0)),
+        "shuffle (on disk)": (nothing, lambda _: shuffle_lines(
+            lines, io.StringIO(), seed=0, chunk_size=max(len(lines) // 4, 1))),
+        "write tsv": (lambda: merged(samples), write_tsv),
+        "write packed": (lambda: merged(samples), write_packed),
+        "jaccard": (nothing, lambda _: pair_features(premises, hypotheses)),
+        "jaccard (scalar)": (nothing, lambda _: [
+            jaccard_similarity(a, b)
+            for a, b in zip(premises[:SCALAR_JACCARD_LIMIT],
+                            hypotheses[:SCALAR_JACCARD_LIMIT])
+        ]),
+        "glue filters": (nothing, lambda _: glue_processor._clean_up_entries(
+            pairs)),
+        "wikifactcheck filters": (
+            nothing, lambda _: wikifactcheck_processor._clean_up_entries(
+                pairs, client=StubEntityClient())),
+        "paraphrase scheduling": (nothing, lambda _: TokenBudgetScheduler(
+            StubParaphraser()).paraphrase_batch(premises)),
+        "process": (nothing, quiet_process),
+    }
+
+
+def run(
+    sizes: List[int],
+    names: Optional[List[str]] = None,
+    repeat: int = 3,
+    seed: int = 0
+) -> Dict[str, Dict[str, float]]:
+    """Run the benchmarks.
+
+    Args:
+        sizes (:obj:`List[int]`):
+            The sizes of the synthetic corpora.
+        names (:obj:`Optional[List[str]]`, defaults to :obj:`None`):
+            The benchmarks to run. If :obj:`None`, all of them are run.
+        repeat (:obj:`int`, defaults to ``3``):
+            The number of runs per benchmark, of which the fastest is kept.
+        seed (:obj:`int`, defaults to ``0``):
+            The seed of the synthetic corpora.
+
+    Returns:
+        :obj:`Dict[str, Dict[str, float]]`: The seconds taken by every
+        benchmark, per corpus size.
+    """
+    results: Dict[str, Dict[str, float]] = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in sizes:
+            samples = synthetic_corpus(size, seed)
+            results[str(size)] = {}
+            for name, (setup, function) in benchmarks(samples,
+                                                      Path(workdir)).items():
+                if names and name not in names:
+                    continue
+                timings = []
+                for _ in range(repeat):
+                    argument = setup()
+                    start = time.perf_counter()
+                    function(argument)
+                    timings.append(time.perf_counter() - start)
+                results[str(size)][name] = min(timings)
+                print(f"   {size:>9} {name:<24} {min(timings):9.4f}s")
+    return results
+
+
+def regressions(
+    results: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    tolerance: float = TOLERANCE
+) -> List[str]:
+    """Find the benchmarks slower than a baseline.
+
+    Args:
+        results (:obj:`Dict[str, Dict[str, float]]`):
+            The results, as returned by :func:`run`.
+        baseline (:obj:`Dict[str, Dict[str, float]]`):
+            The baseline results.
+        tolerance (:obj:`float`, defaults to ``0.2``):
+            The relative slowdown tolerated.
+
+    Returns:
+        :obj:`List[str]`: A description of every regression.
+    """
+    return [
+        f"{size} {name}: {seconds:.4f}s vs. {baseline[size][name]:.4f}s "
+        f"(+{seconds / baseline[size][name] - 1:.0%})"
+        for size, timings in results.items()
+        for name, seconds in timings.items()
+        if name in baseline.get(size, {})
+        and seconds > baseline[size][name] * (1 + tolerance)
+    ]
+
+
+def main(args: argparse.ArgumentParser):
+    """Run the benchmarks and compare them with a baseline."""
+    print("\n⏱  Running benchmarks...")
+    results = run(args.sizes, args.benchmarks, args.repeat, args.seed)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"python": platform.python_version(),
+                       "machine": platform.machine(),
+                       "results": results}, f, indent=2)
+        print(f"\n💾 Results saved to '{args.save}'.")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        slower = regressions(results, baseline, args.tolerance)
+        if slower:
+            print(f"\n🐢 {len(slower)} regressions:")
+            print("\n".join(f"   {regression}" for regression in slower))
+            sys.exit(1)
+        print("\n✅ No regressions.")
+
+
+if __name__ == "__main__":
+    main(arg_parser.parse_args())
@@ -0,0 +1,462 @@
+#!/usr/bin/env python3
+
+"""Build the CANNOT dataset with a single command.
+
+The dataset processors under ``datasets/`` and the final
+``produce_negation_dataset.py`` step are modeled as a dependency graph. The
+processors do not depend on each other, so they run concurrently, each in its
+own process, and their outputs are passed on to the final step, which starts
+as soon as all of them are done.
+
+The output of every step is written to ``<build dir>/<step>/``, and its log to
+``<build dir>/logs/<step>.log``. Next to the output, a manifest records the
+content hashes of the inputs and of the code, and the arguments of the step.
+On the next build, the steps whose manifest has not changed are skipped, so
+e.g. fixing a line in one of the sentiment files only reruns its processor and
+the final step. In the final step, only the sentences that are not in the
+paraphrase cache (kept in ``<build dir>/paraphrase_cache.sqlite``) are sent to
+the model. If the original data of a dataset is not
+available (e.g., WikiFactCheck-English, which is not bundled), the processed
+data already provided under its ``processed/`` directory is used instead.
+
+Any arguments after ``--`` are passed on to ``produce_negation_dataset.py``,
+e.g.::
+
+   ./build_dataset.py -j 4 -- --seed 42 --workers 4
+"""
+
+import os
+import ast
+import sys
+import json
+import time
+import hashlib
+import argparse
+import subprocess
+from concurrent.futures import (FIRST_COMPLETED, Future, ThreadPoolExecutor,
+                                wait)
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import build_dataset
+from sharding import file_hash, shard_sort_key
+
+ROOT_DIR: Path = Path(__file__).resolve().parent.parent.parent
+DATASETS_DIR: Path = ROOT_DIR / "datasets"
+DEFAULT_BUILD_DIR: str = "build"
+PRODUCE_STEP: str = "negation-dataset"
+MANIFEST_NAME: str = "manifest.json"
+PARAPHRASE_CACHE_NAME: str = "paraphrase_cache.sqlite"
+
+arg_parser = argparse.ArgumentParser(
+    formatter_class=argparse.RawTextHelpFormatter,
+    description=(build_dataset.__doc__)
+)
+arg_parser.add_argument("-o", "--output", type=str, default=DEFAULT_BUILD_DIR,
+                        help="the directory where the outputs of every step "
+                             "will be\nwritten to. Defaults to "
+                            f"'{DEFAULT_BUILD_DIR}'.")
+arg_parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="maximum number of steps running at the same "
+                             "time. Defaults\nto running all independent "
+                             "steps at once.")
+arg_parser.add_argument("-r", "--rebuild", action="store_true",
+                        help="run every step, even if its inputs have not "
+                             "changed")
+arg_parser.add_argument("produce_args", nargs=argparse.REMAINDER,
+                        help="arguments passed on to "
+                             "produce_negation_dataset.py")
+
+
+class Step(NamedTuple):
+    """A step of the build.
+
+    Attributes:
+        name (:obj:`str`):
+            The name of the step, which is also the name of its output
+            directory.
+        script (:obj:`pathlib.Path`):
+            The script to run.
+        inputs (:obj:`List[pathlib.Path]`):
+            The files the script reads, besides the outputs of the
+            dependencies. They are passed as positional arguments.
+        args (:obj:`List[str]`):
+            The other arguments of the script, not including the output
+            directory.
+        deps (:obj:`List[str]`):
+            The names of the steps whose ``.tsv`` outputs are passed as the
+            first positional arguments.
+        fallback (:obj:`Optional[pathlib.Path]`):
+            The directory with already processed data to use if the inputs
+            of the step are missing.
+    """
+    name: str
+    script: Path
+    inputs: List[Path] = []
+    args: List[str] = []
+    deps: List[str] = []
+    fallback: Optional[Path] = None
+
+
+class StepTiming(NamedTuple):
+    """When a step ran, in seconds since the start of the build."""
+    start: float
+    end: float
+    up_to_date: bool = False
+
+
+def files_hash(paths: Iterable[Path]) -> str:
+    """Compute a single SHA-256 digest of several files.
+
+    Args:
+        paths (:obj:`Iterable[pathlib.Path]`):
+            The files to hash.
+
+    Returns:
+        :obj:`str`: The hex digest of the paths, relative to the root of the
+        repository, and contents of the files.
+    """
+    digest = hashlib.sha256()
+    for path in sorted(paths):
+        name = path.relative_to(ROOT_DIR).as_posix()
+        digest.update(f"{name}\0{file_hash(path)}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _resolve_module(name: str, roots: List[Path]) -> List[Path]:
+    """Find the files of the repository a module is loaded from."""
+    parts = name.split(".")
+    for root in roots:
+        base = root.joinpath(*parts)
+        for path in (base.with_suffix(".py"), base / "__init__.py"):
+            if path.is_file():
+                # Importing a submodule also runs its packages' ``__init__``.
+                packages = [root.joinpath(*parts[:i], "__init__.py")
+                            for i in range(1, len(parts))]
+                return [path] + [package for package in packages
+                                 if package.is_file()]
+    return []
+
+
+def module_files(script: Path) -> List[Path]:
+    """Find the modules of the repository a script imports.
+
+    The imports are followed transitively, including the ones inside
+    functions. A module is looked up next to the importing file, in ``src/``
+    (imported as ``utils``) and in the root of the repository (imported as
+    ``src``), which are the roots the scripts put on ``sys.path``. Modules
+    outside the repository, and relative imports, which the repository does
+    not use, are not listed.
+
+    Args:
+        script (:obj:`pathlib.Path`):
+            The script.
+
+    Returns:
+        :obj:`List[pathlib.Path]`: The script and the modules it imports,
+        sorted.
+    """
+    found = {script.resolve()}
+    pending = [script.resolve()]
+    while pending:
+        path = pending.pop()
+        roots = [path.parent, ROOT_DIR / "src", ROOT_DIR]
+        tree = ast.parse(path.read_bytes(), filename=str(path))
+        names: List[str] = []
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names += [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module:
+                # ``from package import module`` imports a module too.
+                names += [node.module] + [f"{node.module}.{alias.name}"
+                                          for alias in node.names]
+        for name in names:
+            for dependency in _resolve_module(name, roots):
+                if dependency not in found:
+                    found.add(dependency)
+                    pending.append(dependency)
+    return sorted(found)
+
+
+def code_version(script: Path) -> str:
+    """Hash the code a step runs.
+
+    Args:
+        script (:obj:`pathlib.Path`):
+            The script of the step.
+
+    Returns:
+        :obj:`str`: The hex digest of the script and of the modules of the
+        repository it imports (see :func:`module_files`), so that editing
+        one processor does not rerun the others.
+    """
+    return files_hash(module_files(script))
+
+
+def processor_step(name: str, script: str, dataset: str) -> Step:
+    """Declare a dataset processor step.
+
+    Args:
+        name (:obj:`str`):
+            The name of the step.
+        script (:obj:`str`):
+            The path of the processor script, relative to ``datasets/``.
+        dataset (:obj:`str`):
+            The path of the original data, relative to ``datasets/``.
+
+    Returns:
+        :obj:`Step`: The step.
+    """
+    script_path = DATASETS_DIR / script
+    return Step(name, script_path, inputs=[DATASETS_DIR / dataset],
+                fallback=script_path.parent / "processed")
+
+
+def default_steps(produce_args: List[str], build_dir: Path) -> List[Step]:
+    """Declare the steps needed to build the CANNOT dataset.
+
+    Args:
+        produce_args (:obj:`List[str]`):
+            Extra arguments for ``produce_negation_dataset.py``.
+        build_dir (:obj:`pathlib.Path`):
+            The directory the outputs are written to.
+
+    Returns:
+        :obj:`List[Step]`: The steps.
+    """
+    sentiment = "sentiment-labelled-sentences/original"
+    processors = [
+        processor_step("nan-nli", "nan-nli/process_nan_nli_data.py",
+                       "nan-nli/original/nan.csv"),
+        processor_step("glue-diagnostic",
+                       "glue-diagnostic/process_glue_diagnostic_data.py",
+                       "glue-diagnostic/original/diagnostic-full.tsv"),
+        processor_step("wikifactcheck-english",
+                       "wikifactcheck-english/"
+                       "process_wikifactcheck_english_data.py",
+                       "wikifactcheck-english/original/"
+                       "wikifactcheck-english_full.jsonl"),
+        *(processor_step(f"sentiment-labelled-sentences-{source}",
+                         "sentiment-labelled-sentences/"
+                         "process_sentiment_sentences.py",
+                         f"{sentiment}/{source}_labelled-corrected.txt")
+          for source in ("amazon_cells", "imdb", "yelp")),
+        processor_step("antonym-substitution",
+                       "antonym-substitution/process_antonym_substitution.py",
+                       "antonym-substitution/original/SemAntoNeg_v1.0.json"),
+    ]
+    produce_args = [arg for arg in produce_args if arg != "--"]
+    if not {"-c", "--cache", "--no-cache"} & set(produce_args):
+        produce_args += ["--cache", str(build_dir / PARAPHRASE_CACHE_NAME)]
+    produce = Step(PRODUCE_STEP,
+                   Path(__file__).resolve().parent
+                   / "produce_negation_dataset.py",
+                   args=produce_args,
+                   deps=[step.name for step in processors])
+    return processors + [produce]
+
+
+def critical_path(
+    steps: Dict[str, Step],
+    timings: Dict[str, StepTiming]
+) -> List[str]:
+    """Find the chain of dependencies that determined the build time.
+
+    Starting from the step that finished last, the dependency that finished
+    last is followed until a step without dependencies is reached.
+
+    Args:
+        steps (:obj:`Dict[str, Step]`):
+            The steps, by name.
+        timings (:obj:`Dict[str, StepTiming]`):
+            When each step ran, by name.
+
+    Returns:
+        :obj:`List[str]`: The names of the steps in the critical path, in
+        execution order.
+    """
+    path = [max(timings, key=lambda name: timings[name].end)]
+    while steps[path[-1]].deps:
+        path.append(max(steps[path[-1]].deps,
+                        key=lambda name: timings[name].end))
+    return path[::-1]
+
+
+class Build:
+    """Dependency graph of build steps.
+
+    Attributes:
+        steps (:obj:`Dict[str, Step]`):
+            The steps, by name.
+        build_dir (:obj:`pathlib.Path`):
+            The directory the outputs and logs are written to.
+        timings (:obj:`Dict[str, StepTiming]`):
+            When each finished step ran.
+        rebuild (:obj:`bool`):
+            Whether to run the steps even if they are up to date.
+    """
+
+    def __init__(self, steps: List[Step], build_dir: Path,
+                 rebuild: bool = False):
+        self.steps = {step.name: step for step in steps}
+        self.build_dir = build_dir
+        self.rebuild = rebuild
+        self.timings: Dict[str, StepTiming] = {}
+        self._start = 0.
+        self._code_versions = {step.name: code_version(step.script)
+                               for step in steps}
+
+    def outputs(self, name: str) -> List[Path]:
+        """Get the ``.tsv`` files produced by a step.
+
+        Args:
+            name (:obj:`str`):
+                The name of the step.
+
+        Returns:
+            :obj:`List[pathlib.Path]`: The output files, sorted by name, with
+            shards in order.
+        """
+        return sorted((self.build_dir / name).glob("*.tsv"),
+                      key=shard_sort_key)
+
+    def _inputs(self, step: Step) -> Tuple[List[Path], Optional[Path]]:
+        """Find the inputs of a step, or its fallback data."""
+        if step.fallback and not all(path.exists() for path in step.inputs):
+            return (sorted(step.fallback.glob("*.tsv"), key=shard_sort_key),
+                    step.fallback)
+        return ([path for dep in step.deps for path in self.outputs(dep)]
+                + step.inputs), None
+
+    def manifest(self, step: Step) -> Dict[str, Any]:
+        """Describe everything the output of a step depends on.
+
+        Args:
+            step (:obj:`Step`):
+                The step.
+
+        Returns:
+            :obj:`Dict[str, Any]`: The content hashes of the inputs of the
+            step, its arguments, and the code version.
+        """
+        inputs, _ = self._inputs(step)
+        return {
+            "inputs": {str(path): file_hash(path) for path in inputs},
+            "args": step.args,
+            "code": self._code_versions[step.name],
+        }
+
+    def _is_up_to_date(self, step: Step, manifest: Dict[str, Any]) -> bool:
+        """Determine whether a step has already run with the same inputs."""
+        manifest_path = self.build_dir / step.name / MANIFEST_NAME
+        if self.rebuild or not manifest_path.exists():
+            return False
+        with open(manifest_path, encoding="utf-8") as f:
+            return json.load(f) == manifest and bool(self.outputs(step.name))
+
+    def _run_step(self, step: Step) -> StepTiming:
+        """Run a step, logging its output."""
+        start = time.perf_counter() - self._start
+        output_dir = self.build_dir / step.name
+        output_dir.mkdir(parents=True, exist_ok=True)
+        manifest = self.manifest(step)
+        if self._is_up_to_date(step, manifest):
+            return StepTiming(start, start, up_to_date=True)
+        for path in self.outputs(step.name):
+            path.unlink()  # stale outputs
+        inputs, fallback = self._inputs(step)
+        log_path = self.build_dir / "logs" / f"{step.name}.log"
+        with open(log_path, "w", encoding="utf-8") as log:
+            if fallback:
+                log.write(f"Inputs not found, using '{fallback}/'.\n")
+                for path in inputs:
+                    (output_dir / path.name).write_bytes(path.read_bytes())
+            else:
+                command = [sys.executable, str(step.script),
+                           *map(str, inputs), *step.args,
+                           "-o", str(output_dir), "-f"]
+                log.write(" ".join(command) + "\n")
+                log.flush()
+                # The processors import the modules in ``src/`` as ``utils``.
+                env = {**os.environ,
+                       "PYTHONPATH": os.pathsep.join(
+                           filter(None, [str(ROOT_DIR / "src"),
+                                         os.environ.get("PYTHONPATH")]))}
+                subprocess.run(command, cwd=step.script.parent, env=env,
+                               stdout=log, stderr=subprocess.STDOUT,
+                               stdin=subprocess.DEVNULL, check=True)
+        with open(output_dir / MANIFEST_NAME, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        return StepTiming(start, time.perf_counter() - self._start)
+
+    def run(self, jobs: Optional[int] = None):
+        """Run every step as soon as its dependencies are done.
+
+        Args:
+            jobs (:obj:`int`, `optional`, defaults to :obj:`None`):
+                The maximum number of steps running at the same time. If
+                :obj:`None`, all independent steps run at once.
+
+        Raises:
+            :obj:`subprocess.CalledProcessError`: If a step fails. Running
+            steps are waited for, but no new ones are started.
+        """
+        (self.build_dir / "logs").mkdir(parents=True, exist_ok=True)
+        self._start = time.perf_counter()
+        pending = dict(self.steps)
+        running: Dict[Future, str] = {}
+        with ThreadPoolExecutor(jobs or len(self.steps)) as executor:
+            while pending or running:
+                for name, step in list(pending.items()):
+                    if all(dep in self.timings for dep in step.deps):
+                        print(f"▶️  {name}")
+                        running[executor.submit(self._run_step, step)] = name
+                        del pending[name]
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        self.timings[name] = future.result()
+                    except subprocess.CalledProcessError:
+                        print(f"❌ {name} failed. See "
+                              f"'{self.build_dir}/logs/{name}.log'.")
+                        pending.clear()
+                        wait(running)
+                        raise
+                    timing = self.timings[name]
+                    print(f"✔️  {name} "
+                          + ("(up to date)" if timing.up_to_date
+                             else f"({timing.end - timing.start:.1f}s)"))
+
+    def report(self) -> str:
+        """Summarize the timings of the build.
+
+        Returns:
+            :obj:`str`: A human-readable report of the critical path.
+        """
+        path = critical_path(self.steps, self.timings)
+        total = max(timing.end for timing in self.timings.values())
+        busy = sum(timing.end - timing.start
+                   for timing in self.timings.values())
+        lines = [f"   {name}: "
+                 f"{self.timings[name].end - self.timings[name].start:.1f}s"
+                 for name in path]
+        lines.append(f"   Wall time: {total:.1f}s, "
+                     f"{busy / total if total else 0.:.1f}x parallelism")
+        return "\n".join(lines)
+
+
+def main(args: argparse.ArgumentParser):
+    """Build the CANNOT dataset."""
+    build_dir = Path(args.output).resolve()
+    build = Build(default_steps(args.produce_args, build_dir), build_dir,
+                  rebuild=args.rebuild)
+    print("🏗  Building the CANNOT dataset...\n")
+    build.run(args.jobs)
+    print(f"\n⏱  Critical path:\n{build.report()}")
+    print(f"\n✅ Done! Output data written to "
+          f"'{args.output}/{PRODUCE_STEP}/'.")
+
+
+if __name__ == "__main__":
+    main(arg_parser.parse_args())
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+
+"""Compare the inference precisions of the paraphraser.
+
+Every precision is loaded and run in its own process, and the script reports
+the size of the model weights, the peak resident memory of that process, the
+latency per sentence, and how far its paraphrases drift from the ``fp32``
+ones on a fixed sample of sentences, i.e., the fraction of identical
+paraphrases and their mean Jaccard similarity.
+
+The input is a file with one sentence per line, e.g.::
+
+   ./compare_precisions.py sentences.txt -p fp32 int8 bf16
+"""
+
+import io
+import sys
+import time
+import resource
+import argparse
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, NamedTuple
+
+import torch
+import compare_precisions
+from paraphrasis import PegasusParaphraser, PRECISIONS
+from batching import TokenBudgetScheduler
+from jaccard_index import jaccard_similarity
+
+arg_parser = argparse.ArgumentParser(
+    formatter_class=argparse.RawTextHelpFormatter,
+    description=(compare_precisions.__doc__)
+)
+arg_parser.add_argument("sentences", type=argparse.FileType("r"),
+                        help="file with one sentence per line")
+arg_parser.add_argument("-p", "--precisions", nargs="+", choices=PRECISIONS,
+                        default=list(PRECISIONS),
+                        help="precisions to compare. fp32 is always included "
+                             "as the\nreference.")
+arg_parser.add_argument("-l", "--limit", type=int, default=128,
+                        help="number of sentences to paraphrase. Defaults to "
+                             "128.")
+
+
+def weights_size(model: torch.nn.Module) -> int:
+    """Compute the serialized size of the model weights.
+
+    Dynamically quantized layers keep their weights in packed parameters,
+    which are not listed by :meth:`torch.nn.Module.parameters`, so the state
+    dictionary is serialized instead.
+
+    Args:
+        model (:obj:`torch.nn.Module`):
+            The model.
+
+    Returns:
+        :obj:`int`: The size of the weights, in bytes.
+    """
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+
+def peak_rss() -> int:
+    """Measure the peak resident memory of the process.
+
+    Returns:
+        :obj:`int`: The peak resident memory, in bytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in kibibytes, except on macOS, where it is in bytes.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def similarity(a: str, b: str) -> float:
+    """Calculate the Jaccard similarity of two paraphrases.
+
+    Two paraphrases without words are identical, instead of undefined.
+
+    Args:
+        a (:obj:`str`):
+            The first paraphrase.
+        b (:obj:`str`):
+            The second paraphrase.
+
+    Returns:
+        :obj:`float`: The Jaccard index of the two paraphrases.
+    """
+    if not a.split() and not b.split():
+        return 1.
+    return jaccard_similarity(a, b)
+
+
+class Measurement(NamedTuple):
+    """The paraphrases and costs of one precision.
+
+    Attributes:
+        paraphrases (:obj:`List[str]`):
+            The first paraphrase of every sentence.
+        weights_size (:obj:`int`):
+            The serialized size of the model weights, in bytes.
+        peak_rss (:obj:`int`):
+            The peak resident memory of the process, in bytes.
+        latency (:obj:`float`):
+            The paraphrasing time per sentence, in seconds.
+    """
+    paraphrases: List[str]
+    weights_size: int
+    peak_rss: int
+    latency: float
+
+
+def measure(precision: str, sentences: List[str]) -> Measurement:
+    """Load the paraphraser in a precision and paraphrase the sentences.
+
+    Args:
+        precision (:obj:`str`):
+            The inference precision.
+        sentences (:obj:`List[str]`):
+            The sentences to paraphrase.
+
+    Returns:
+        :obj:`Measurement`: The paraphrases and their costs.
+    """
+    paraphraser = PegasusParaphraser(precision=precision)
+    scheduler = TokenBudgetScheduler(paraphraser)
+    start = time.perf_counter()
+    paraphrases = [
+        paraphrases[0]
+        for paraphrases in scheduler.paraphrase_batch(sentences)
+    ]
+    latency = (time.perf_counter() - start) / len(sentences)
+    return Measurement(paraphrases, weights_size(paraphraser.model),
+                       peak_rss(), latency)
+
+
+def main(args: argparse.ArgumentParser):
+    """Compare memory, latency and parity of the inference precisions."""
+    sentences = [line.strip() for line in args.sentences if line.strip()]
+    sentences = sentences[:args.limit]
+    precisions = ["fp32"] + [p for p in args.precisions if p != "fp32"]
+    outputs: Dict[str, List[str]] = {}
+    print("precision\tweights (MiB)\tpeak RSS (MiB)\tms/sentence\t"
+          "identical\tJaccard")
+    for precision in precisions:
+        # A fresh process per precision, so that the peak memory is not
+        # that of a previously loaded model.
+        with ProcessPoolExecutor(
+            max_workers=1, mp_context=mp.get_context("spawn")
+        ) as pool:
+            try:
+                result = pool.submit(measure, precision, sentences).result()
+            except ValueError as e:
+                print(f"{precision}\t{e}")
+                continue
+        outputs[precision] = result.paraphrases
+        identical = sum(a == b for a, b in zip(outputs[precision],
+                                               outputs["fp32"]))
+        similarities = sum(similarity(a, b) for a, b
+                           in zip(outputs[precision], outputs["fp32"]))
+        print(f"{precision}\t{result.weights_size / 1024**2:.1f}\t"
+              f"{result.peak_rss / 1024**2:.1f}\t"
+              f"{result.latency * 1000:.1f}\t"
+              f"{identical / len(sentences):.1%}\t"
+              f"{similarities / len(sentences):.3f}")
+
+
+if __name__ == "__main__":
+    main(arg_parser.parse_args())
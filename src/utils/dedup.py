@@ -0,0 +1,189 @@
+"""Deduplication utilities.
+
+Samples are handled as ``(premise, hypothesis, label)`` triples. They are
+indexed by their normalized value in a hash table, so checking whether a
+sample has already been seen takes constant time and merging ``n`` samples
+takes linear time.
+"""
+
+from collections import Counter
+from typing import Dict, Iterable, Iterator, Tuple
+
+Sample = Tuple[str, str, str]
+
+
+def parse_line(line: str, default_label: str = "1") -> Sample:
+    """Parse a ``.tsv`` line into a normalized sample.
+
+    Leading and trailing whitespace is removed from every field, so that lines
+    that only differ in e.g. the line terminator are considered equal.
+
+    Args:
+        line (:obj:`str`):
+            A line in the form::
+
+               r"A sentence.\tThe sentence negated.\t1\n"
+
+            or, if it does not contain a label::
+
+               r"A sentence.\tThe sentence negated.\n"
+        default_label (:obj:`str`, defaults to ``"1"``):
+            The label to use if the line does not contain one.
+
+    Returns:
+        :obj:`Sample`: The normalized ``(premise, hypothesis, label)`` triple.
+    """
+    fields = [field.strip() for field in line.strip("\r\n").split("\t")]
+    if len(fields) == 2:
+        fields.append(default_label)
+    premise, hypothesis, label = fields
+    return premise, hypothesis, label
+
+
+def format_sample(sample: Sample) -> str:
+    """Format a sample as a ``.tsv`` line.
+
+    Args:
+        sample (:obj:`Sample`):
+            The ``(premise, hypothesis, label)`` triple.
+
+    Returns:
+        :obj:`str`: The sample as a tab-separated, newline-terminated line.
+    """
+    return "\t".join(sample) + "\n"
+
+
+def swap_sample(sample: Sample) -> Sample:
+    """Swap the premise and hypothesis of a sample.
+
+    Args:
+        sample (:obj:`Sample`):
+            The ``(premise, hypothesis, label)`` triple.
+
+    Returns:
+        :obj:`Sample`: The ``(hypothesis, premise, label)`` triple.
+    """
+    premise, hypothesis, label = sample
+    return hypothesis, premise, label
+
+
+class SampleDeduplicator:
+    """Insertion-ordered set of samples.
+
+    Samples are stored as keys of a :obj:`dict`, which gives hashed lookups
+    while keeping the order in which they were first added. The values are
+    the sources the samples were first added from.
+
+    Attributes:
+        added (:obj:`collections.Counter`):
+            Number of new samples contributed by each source.
+        duplicates (:obj:`collections.Counter`):
+            Number of duplicate samples contributed by each source.
+        removed (:obj:`collections.Counter`):
+            Number of samples of each source removed after being added.
+    """
+
+    def __init__(self):
+        self._samples: Dict[Sample, str] = {}
+        self.added: Counter = Counter()
+        self.duplicates: Counter = Counter()
+        self.removed: Counter = Counter()
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def __contains__(self, sample: Sample) -> bool:
+        return sample in self._samples
+
+    def __iter__(self) -> Iterator[Sample]:
+        return iter(self._samples)
+
+    def add(self, sample: Sample, source: str) -> bool:
+        """Add a sample if it has not been seen before.
+
+        Args:
+            sample (:obj:`Sample`):
+                The ``(premise, hypothesis, label)`` triple to add.
+            source (:obj:`str`):
+                The name of the source the sample comes from.
+
+        Returns:
+            :obj:`bool`: Whether the sample was added, i.e., whether it was
+            not a duplicate.
+        """
+        if sample in self._samples:
+            self.duplicates[source] += 1
+            return False
+        self._samples[sample] = source
+        self.added[source] += 1
+        return True
+
+    def source(self, sample: Sample) -> str:
+        """Get the source a sample was first added from.
+
+        Args:
+            sample (:obj:`Sample`):
+                The ``(premise, hypothesis, label)`` triple.
+
+        Returns:
+            :obj:`str`: The name of the source.
+        """
+        return self._samples[sample]
+
+    def remove(self, sample: Sample):
+        """Remove a sample.
+
+        Args:
+            sample (:obj:`Sample`):
+                The ``(premise, hypothesis, label)`` triple to remove.
+        """
+        self.removed[self._samples.pop(sample)] += 1
+
+    def add_all(self, samples: Iterable[Sample], source: str) -> int:
+        """Add several samples coming from the same source.
+
+        Args:
+            samples (:obj:`Iterable[Sample]`):
+                The samples to add.
+            source (:obj:`str`):
+                The name of the source the samples come from.
+
+        Returns:
+            :obj:`int`: The number of samples actually added.
+        """
+        return sum(self.add(sample, source) for sample in samples)
+
+    def add_swapped(self, source: str = "swapped") -> int:
+        """Add the swapped version of every sample currently in the set.
+
+        Args:
+            source (:obj:`str`, defaults to ``"swapped"``):
+                The name under which the swapped samples are reported.
+
+        Returns:
+            :obj:`int`: The number of swapped samples actually added.
+        """
+        return self.add_all([swap_sample(s) for s in self._samples], source)
+
+    def lines(self) -> Iterator[str]:
+        """Iterate over the samples as ``.tsv`` lines.
+
+        Returns:
+            :obj:`Iterator[str]`: The formatted samples, in insertion order.
+        """
+        return map(format_sample, self._samples)
+
+    def report(self) -> str:
+        """Summarize how many samples and duplicates each source contributed.
+
+        Returns:
+            :obj:`str`: A human-readable, one-line-per-source report.
+        """
+        sources = list(dict.fromkeys([*self.added, *self.duplicates]))
+        return "\n".join(
+            f"   {source}: {self.added[source]} added, "
+            f"{self.duplicates[source]} duplicates"
+            + (f", {self.removed[source]} removed"
+               if self.removed[source] else "")
+            for source in sources
+        )
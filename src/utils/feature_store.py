@@ -0,0 +1,194 @@
+"""Pair-feature store.
+
+Dataset processors filter candidate pairs by thresholds on features of the
+pair, e.g., the Jaccard index of both sentences, their difference in length,
+whether their named entities match, or the number of words of the sentence.
+Computing some of these features (e.g., named entity recognition) takes far
+longer than applying the thresholds, so processors can store the features of
+every candidate pair, before any threshold is applied, in a columnar file
+``<name>.features.npz``. Thresholds can then be re-tuned against the stored
+features in milliseconds (see ``tune_thresholds.py``), without running the
+processors again. The features are written as they are computed, chunk by
+chunk, so that storing them does not hold the whole dataset in memory.
+
+Every feature is a column; features that a processor does not compute are
+left out of its file:
+
+   - ``jaccard``: :obj:`float64` Jaccard index of both sentences.
+   - ``length_diff``: :obj:`int16` difference in words of both sentences.
+   - ``entities_match``: :obj:`bool` whether both sentences have the same
+     named entities.
+   - ``words``: :obj:`int16` number of words of the sentence.
+"""
+
+import shutil
+import zipfile
+import tempfile
+from pathlib import Path
+from typing import BinaryIO, Dict, List, NamedTuple, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+FEATURES_SUFFIX: str = ".features.npz"
+FEATURE_DTYPES: Dict[str, type] = {
+    "jaccard": np.float64,
+    "length_diff": np.int16,
+    "entities_match": np.bool_,
+    "words": np.int16,
+}
+
+
+class Thresholds(NamedTuple):
+    """A combination of thresholds.
+
+    Thresholds set to :obj:`None` (or :obj:`False`) are not applied, and
+    neither are those on features that a source does not have.
+
+    Attributes:
+        jaccard (:obj:`Optional[float]`):
+            The minimum Jaccard index.
+        length_diff (:obj:`Optional[int]`):
+            The maximum difference in words.
+        entities_match (:obj:`bool`):
+            Whether the named entities of both sentences must match.
+        words (:obj:`Optional[int]`):
+            The maximum number of words.
+    """
+    jaccard: Optional[float] = None
+    length_diff: Optional[int] = None
+    entities_match: bool = False
+    words: Optional[int] = None
+
+
+class FeatureWriter:
+    """Incremental writer of the features of the candidate pairs of a dataset.
+
+    Every added chunk is appended to a temporary file per feature right away,
+    so that the memory usage is bounded by the chunk size. On :meth:`close`,
+    the columns are packed into the features file, in the same format as
+    :func:`numpy.savez`.
+
+    Attributes:
+        path (:obj:`pathlib.Path`):
+            The file to write to.
+        source (:obj:`str`):
+            The name of the dataset.
+        num_pairs (:obj:`int`):
+            The number of candidate pairs added so far.
+    """
+
+    def __init__(self, path: Union[str, Path], source: str):
+        self.path = Path(path)
+        self.source = source
+        self.num_pairs = 0
+        self._columns: Optional[List[str]] = None
+        self._files: Dict[str, BinaryIO] = {}
+        self._tmp_dir = Path(tempfile.mkdtemp(prefix=f".{self.path.name}.",
+                                              dir=self.path.parent))
+
+    def add(self, features: pd.DataFrame):
+        """Append the features of a chunk of candidate pairs.
+
+        Args:
+            features (:obj:`pd.DataFrame`):
+                The features, with a column per feature.
+
+        Raises:
+            :obj:`ValueError`: If the chunk has different features than the
+            previous ones.
+        """
+        columns = [name for name in FEATURE_DTYPES if name in features]
+        if self._columns is None:
+            self._columns = columns
+            self._files = {name: open(self._tmp_dir / name, "wb")
+                           for name in columns}
+        elif columns != self._columns:
+            raise ValueError(f"Expected the features {self._columns}, got "
+                             f"{columns}.")
+        for name in columns:
+            self._files[name].write(
+                features[name].to_numpy(dtype=FEATURE_DTYPES[name]).tobytes())
+        self.num_pairs += len(features)
+
+    def close(self):
+        """Write the features file, and remove the temporary files."""
+        for f in self._files.values():
+            f.close()
+        with zipfile.ZipFile(self.path, "w", allowZip64=True) as archive:
+            with archive.open("source.npy", "w") as f:
+                np.lib.format.write_array(f, np.array(self.source))
+            for name in self._columns or []:
+                header = np.lib.format.header_data_from_array_1_0(
+                    np.empty(0, dtype=FEATURE_DTYPES[name]))
+                header["shape"] = (self.num_pairs,)
+                with archive.open(f"{name}.npy", "w", force_zip64=True) as f:
+                    np.lib.format.write_array_header_1_0(f, header)
+                    with open(self._tmp_dir / name, "rb") as column:
+                        shutil.copyfileobj(column, f)
+        self.discard()
+
+    def discard(self):
+        """Remove the temporary files, without writing the features file."""
+        for f in self._files.values():
+            f.close()
+        shutil.rmtree(self._tmp_dir, ignore_errors=True)
+
+
+class FeatureSet(NamedTuple):
+    """The stored features of a source.
+
+    Attributes:
+        source (:obj:`str`):
+            The name of the dataset.
+        columns (:obj:`Dict[str, np.ndarray]`):
+            The features it has, by name.
+        num_pairs (:obj:`int`):
+            The number of candidate pairs.
+    """
+    source: str
+    columns: Dict[str, np.ndarray]
+    num_pairs: int
+
+
+def read_features(path: Union[str, Path]) -> FeatureSet:
+    """Read a features file.
+
+    Args:
+        path (:obj:`Union[str, pathlib.Path]`):
+            The file.
+
+    Returns:
+        :obj:`FeatureSet`: The features.
+    """
+    with np.load(path) as stored:
+        columns = {name: stored[name] for name in FEATURE_DTYPES
+                   if name in stored.files}
+        source = str(stored["source"])
+    num_pairs = len(next(iter(columns.values()))) if columns else 0
+    return FeatureSet(source, columns, num_pairs)
+
+
+def passes(features: FeatureSet, thresholds: Thresholds) -> np.ndarray:
+    """Determine which candidate pairs pass a combination of thresholds.
+
+    Args:
+        features (:obj:`FeatureSet`):
+            The features.
+        thresholds (:obj:`Thresholds`):
+            The thresholds.
+
+    Returns:
+        :obj:`np.ndarray`: Whether each pair passes every threshold.
+    """
+    columns = features.columns
+    keep = np.ones(features.num_pairs, dtype=bool)
+    if thresholds.jaccard is not None and "jaccard" in columns:
+        keep &= columns["jaccard"] >= thresholds.jaccard
+    if thresholds.length_diff is not None and "length_diff" in columns:
+        keep &= columns["length_diff"] <= thresholds.length_diff
+    if thresholds.entities_match and "entities_match" in columns:
+        keep &= columns["entities_match"]
+    if thresholds.words is not None and "words" in columns:
+        keep &= columns["words"] <= thresholds.words
+    return keep
@@ -0,0 +1,265 @@
+"""Filter pipeline.
+
+Filters are declared together with their relative cost and run over whole
+DataFrame columns at once, cheapest first, so that expensive filters (e.g.,
+named entity recognition) only see the rows that survived the cheap ones.
+The number of rows in and out and the time spent are recorded per filter.
+"""
+
+import time
+from typing import Callable, Iterable, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+JACCARD_THRESHOLD: float = 0.55
+MAX_LENGTH_DIFFERENCE: int = 3  # words
+MAX_WORDS: int = 33
+
+
+class Filter(NamedTuple):
+    """A row filter.
+
+    Attributes:
+        name (:obj:`str`):
+            The name of the filter, used in the statistics.
+        predicate (:obj:`Callable[[pd.DataFrame], Sequence[bool]]`):
+            Function returning, for a DataFrame, which rows to keep.
+        cost (:obj:`float`):
+            The relative cost per row. Cheaper filters run first.
+    """
+    name: str
+    predicate: Callable[[pd.DataFrame], Sequence[bool]]
+    cost: float = 1.
+
+
+class FilterStats(NamedTuple):
+    """The statistics of a filter run.
+
+    Attributes:
+        name (:obj:`str`):
+            The name of the filter.
+        rows_in (:obj:`int`):
+            The number of rows the filter received.
+        rows_out (:obj:`int`):
+            The number of rows the filter kept.
+        seconds (:obj:`float`):
+            The time spent in the filter.
+    """
+    name: str
+    rows_in: int
+    rows_out: int
+    seconds: float
+
+
+class FilterPipeline:
+    """Cost-ordered sequence of filters.
+
+    Attributes:
+        filters (:obj:`List[Filter]`):
+            The filters, in the order they run. Filters of equal cost keep
+            the order they were declared in.
+        stats (:obj:`List[FilterStats]`):
+            The statistics of the last run.
+    """
+
+    def __init__(self, filters: Iterable[Filter]):
+        self.filters: List[Filter] = sorted(filters, key=lambda f: f.cost)
+        self.stats: List[FilterStats] = []
+
+    def apply(self, dataset: pd.DataFrame) -> pd.DataFrame:
+        """Keep the rows that pass every filter.
+
+        Args:
+            dataset (:obj:`pd.DataFrame`):
+                The rows to filter.
+
+        Returns:
+            :obj:`pd.DataFrame`: The rows that passed all the filters.
+        """
+        self.stats = []
+        for row_filter in self.filters:
+            rows_in = len(dataset)
+            start = time.perf_counter()
+            if rows_in:
+                keep = np.asarray(row_filter.predicate(dataset), dtype=bool)
+                dataset = dataset.loc[keep]
+            self.stats.append(FilterStats(row_filter.name, rows_in,
+                                          len(dataset),
+                                          time.perf_counter() - start))
+        return dataset
+
+    def report(self) -> str:
+        """Summarize the last run.
+
+        Returns:
+            :obj:`str`: A human-readable, one-line-per-filter report.
+        """
+        return format_stats(self.stats)
+
+
+def format_stats(stats: Iterable[FilterStats]) -> str:
+    """Format filter statistics.
+
+    Args:
+        stats (:obj:`Iterable[FilterStats]`):
+            The statistics of every filter.
+
+    Returns:
+        :obj:`str`: A human-readable, one-line-per-filter report.
+    """
+    return "\n".join(
+        f"   {s.name}: {s.rows_in} → {s.rows_out} rows ({s.seconds:.2f}s)"
+        for s in stats
+    )
+
+
+def merge_stats(
+    totals: List[FilterStats],
+    stats: Iterable[FilterStats]
+) -> List[FilterStats]:
+    """Add up the statistics of several runs, e.g., over chunks of a dataset.
+
+    Args:
+        totals (:obj:`List[FilterStats]`):
+            The statistics accumulated so far.
+        stats (:obj:`Iterable[FilterStats]`):
+            The statistics of another run.
+
+    Returns:
+        :obj:`List[FilterStats]`: The statistics per filter name, in the
+        order the filters were first seen.
+    """
+    merged = {s.name: s for s in totals}
+    for s in stats:
+        total = merged.get(s.name, FilterStats(s.name, 0, 0, 0.))
+        merged[s.name] = FilterStats(s.name, total.rows_in + s.rows_in,
+                                     total.rows_out + s.rows_out,
+                                     total.seconds + s.seconds)
+    return list(merged.values())
+
+
+def equals(column: str, value: object, cost: float = 0.) -> Filter:
+    """Keep the rows in which a column has a given value.
+
+    Args:
+        column (:obj:`str`):
+            The column to check.
+        value (:obj:`object`):
+            The value to keep.
+        cost (:obj:`float`, defaults to ``0.``):
+            The relative cost of the filter.
+
+    Returns:
+        :obj:`Filter`: The filter.
+    """
+    return Filter(f"{column} == {value!r}", lambda df: df[column] == value,
+                  cost)
+
+
+def non_empty(column: str, cost: float = 0.) -> Filter:
+    """Keep the rows in which a column is neither null nor empty.
+
+    Args:
+        column (:obj:`str`):
+            The column to check.
+        cost (:obj:`float`, defaults to ``0.``):
+            The relative cost of the filter.
+
+    Returns:
+        :obj:`Filter`: The filter.
+    """
+    return Filter(f"{column} not empty",
+                  lambda df: df[column].notna() & df[column].astype(bool),
+                  cost)
+
+
+def contains(column: str, pattern: str, cost: float = 1.) -> Filter:
+    """Keep the rows in which a column matches a regular expression.
+
+    Args:
+        column (:obj:`str`):
+            The column to check.
+        pattern (:obj:`str`):
+            The regular expression to search for.
+        cost (:obj:`float`, defaults to ``1.``):
+            The relative cost of the filter.
+
+    Returns:
+        :obj:`Filter`: The filter.
+    """
+    return Filter(f"{column} matches pattern",
+                  lambda df: df[column].str.contains(pattern), cost)
+
+
+def max_words(
+    column: str,
+    max_count: int = MAX_WORDS,
+    cost: float = 1.
+) -> Filter:
+    """Keep the rows in which a column has at most a number of words.
+
+    Args:
+        column (:obj:`str`):
+            The column to check.
+        max_count (:obj:`int`, defaults to ``MAX_WORDS``):
+            The maximum number of whitespace-separated words.
+        cost (:obj:`float`, defaults to ``1.``):
+            The relative cost of the filter.
+
+    Returns:
+        :obj:`Filter`: The filter.
+    """
+    return Filter(f"{column} ≤ {max_count} words",
+                  lambda df: df[column].str.split().str.len().le(max_count),
+                  cost)
+
+
+def at_least(
+    column: str,
+    minimum: float,
+    name: Optional[str] = None,
+    cost: float = 0.
+) -> Filter:
+    """Keep the rows in which a numeric column reaches a minimum.
+
+    Args:
+        column (:obj:`str`):
+            The column to check, e.g., a precomputed feature.
+        minimum (:obj:`float`):
+            The minimum value to keep.
+        name (:obj:`Optional[str]`, defaults to :obj:`None`):
+            The name of the filter. Defaults to ``"<column> ≥ <minimum>"``.
+        cost (:obj:`float`, defaults to ``0.``):
+            The relative cost of the filter.
+
+    Returns:
+        :obj:`Filter`: The filter.
+    """
+    return Filter(name or f"{column} ≥ {minimum}",
+                  lambda df: df[column] >= minimum, cost)
+
+
+def at_most(
+    column: str,
+    maximum: float,
+    name: Optional[str] = None,
+    cost: float = 0.
+) -> Filter:
+    """Keep the rows in which a numeric column does not exceed a maximum.
+
+    Args:
+        column (:obj:`str`):
+            The column to check, e.g., a precomputed feature.
+        maximum (:obj:`float`):
+            The maximum value to keep.
+        name (:obj:`Optional[str]`, defaults to :obj:`None`):
+            The name of the filter. Defaults to ``"<column> ≤ <maximum>"``.
+        cost (:obj:`float`, defaults to ``0.``):
+            The relative cost of the filter.
+
+    Returns:
+        :obj:`Filter`: The filter.
+    """
+    return Filter(name or f"{column} ≤ {maximum}",
+                  lambda df: df[column] <= maximum, cost)
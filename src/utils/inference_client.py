@@ -0,0 +1,180 @@
+"""Client of the local inference service.
+
+See ``inference_service.py``. The client only depends on the standard
+library, so that scripts can check whether a service is running without
+importing any model code, and fall back to loading the models themselves
+otherwise::
+
+   client = InferenceClient.connect()
+   if client is not None:
+       paraphrases = client.paraphrase_batch(sentences)
+"""
+
+import json
+import time
+import urllib.error
+import urllib.request
+from typing import Any, Dict, List, Optional, Tuple
+
+DEFAULT_ADDRESS: str = "127.0.0.1:8765"
+REQUEST_SIZE: int = 256  # sentences
+RETRIES: int = 5
+
+
+class ServiceOverloaded(RuntimeError):
+    """The service rejected a request because its queue is full."""
+
+
+class InferenceClient:
+    """Client of a running inference service.
+
+    Large inputs are sent in requests of :data:`REQUEST_SIZE` sentences, so
+    that the requests of concurrent clients can be interleaved. Requests
+    rejected by admission control are retried with exponential backoff.
+
+    Attributes:
+        address (:obj:`str`):
+            The ``host:port`` address of the service.
+        info (:obj:`Dict[str, Any]`):
+            The configuration of the service, e.g., its ``model_name`` and
+            ``precision``.
+        timeout (:obj:`float`):
+            The timeout of every request, in seconds.
+    """
+
+    def __init__(
+        self,
+        address: str = DEFAULT_ADDRESS,
+        timeout: float = 600.
+    ):
+        self.address = address
+        self.timeout = timeout
+        self.info: Dict[str, Any] = self._request("health", timeout=timeout)
+
+    @classmethod
+    def connect(
+        cls,
+        address: Optional[str] = DEFAULT_ADDRESS,
+        timeout: float = 0.5
+    ) -> Optional["InferenceClient"]:
+        """Connect to a service, if one is running.
+
+        Args:
+            address (:obj:`Optional[str]`, defaults to ``DEFAULT_ADDRESS``):
+                The ``host:port`` address of the service. If :obj:`None`, no
+                connection is attempted.
+            timeout (:obj:`float`, defaults to ``0.5``):
+                How long to wait for the service to answer, in seconds.
+
+        Returns:
+            :obj:`Optional[InferenceClient]`: The client, or :obj:`None` if
+            no service is answering at that address, e.g., because another
+            kind of server is listening there.
+        """
+        if not address:
+            return None
+        try:
+            client = cls(address, timeout=timeout)
+        except (OSError, ValueError, RuntimeError):
+            return None
+        if not isinstance(client.info, dict) or "loaded" not in client.info:
+            return None  # not an inference service
+        client.timeout = 600.
+        return client
+
+    def _request(
+        self,
+        endpoint: str,
+        payload: Optional[Dict[str, Any]] = None,
+        timeout: Optional[float] = None
+    ) -> Any:
+        """Send a request, retrying while the service is overloaded."""
+        data = None if payload is None else json.dumps(payload).encode()
+        for attempt in range(RETRIES + 1):
+            request = urllib.request.Request(
+                f"http://{self.address}/{endpoint}", data=data,
+                headers={"Content-Type": "application/json"}
+            )
+            try:
+                with urllib.request.urlopen(
+                    request, timeout=timeout or self.timeout
+                ) as response:
+                    return json.loads(response.read())
+            except urllib.error.HTTPError as e:
+                if e.code != 503:
+                    raise RuntimeError(
+                        f"Inference service error: {e.read().decode()}"
+                    ) from e
+                if attempt == RETRIES:
+                    raise ServiceOverloaded(
+                        f"The inference service at {self.address} is "
+                        "overloaded."
+                    ) from e
+                time.sleep(0.1 * 2**attempt)
+        return None  # unreachable
+
+    def _batched(
+        self,
+        endpoint: str,
+        sentences: List[str],
+        **settings
+    ) -> List[Any]:
+        results: List[Any] = []
+        for i in range(0, len(sentences), REQUEST_SIZE):
+            results.extend(self._request(
+                endpoint,
+                {"sentences": sentences[i:i+REQUEST_SIZE], **settings}
+            )["results"])
+        return results
+
+    def paraphrase_batch(
+        self,
+        sentences: List[str],
+        num_return_sentences: int = 1,
+        num_beams: int = 4
+    ) -> List[List[str]]:
+        """Paraphrase sentences.
+
+        See :meth:`paraphrasis.PegasusParaphraser.paraphrase_batch`.
+        """
+        return self._batched("paraphrase", sentences,
+                             num_return_sentences=num_return_sentences,
+                             num_beams=num_beams)
+
+    def negate(
+        self,
+        sentences: List[str]
+    ) -> List[Tuple[str, Optional[str], Optional[str]]]:
+        """Negate sentences.
+
+        Args:
+            sentences (:obj:`List[str]`):
+                The sentences to negate.
+
+        Returns:
+            :obj:`List[Tuple[str, Optional[str], Optional[str]]]`: The
+            fields of a :obj:`negation.NegationResult` for every sentence.
+        """
+        return [tuple(result) for result in self._batched("negate",
+                                                          sentences)]
+
+    def entities(self, sentences: List[str]) -> List[List[str]]:
+        """Extract the named entities of sentences.
+
+        Args:
+            sentences (:obj:`List[str]`):
+                The sentences.
+
+        Returns:
+            :obj:`List[List[str]]`: The text of the named entities in every
+            sentence.
+        """
+        return self._batched("ner", sentences)
+
+    def stats(self) -> Dict[str, Any]:
+        """Get the queue depth, batching and latency statistics.
+
+        Returns:
+            :obj:`Dict[str, Any]`: The statistics of every endpoint.
+        """
+        return self._request("stats")
@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+
+"""Local inference service.
+
+Keeps the Pegasus paraphraser, the negator and the spaCy NER pipeline loaded
+between script invocations, and serves them over HTTP on localhost. Requests
+from concurrent clients are merged into micro-batches, so that they share
+single ``paraphrase_batch`` and ``nlp.pipe`` calls. When the queue of an
+endpoint is full, new requests are rejected with ``503`` (admission control)
+and clients retry later.
+
+Endpoints (``POST``, with a JSON body ``{"sentences": [...]}``):
+
+   - ``/paraphrase``: Also accepts ``num_return_sentences`` and
+     ``num_beams``.
+   - ``/negate``: Returns ``[sentence, negated, error]`` triples.
+   - ``/ner``: Returns the named entities of every sentence.
+
+``GET /health`` returns the service configuration, and ``GET /stats`` the
+queue depth, batch sizes and latencies of every endpoint.
+
+``produce_negation_dataset.py`` and the dataset processors use a running
+service automatically (see ``inference_client.py``), e.g.::
+
+   ./inference_service.py --preload paraphrase &
+   ./produce_negation_dataset.py ...
+"""
+
+import json
+import time
+import argparse
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+import inference_service
+from inference_client import DEFAULT_ADDRESS
+from paraphrasis import MODEL_NAME, PRECISIONS
+
+MAX_BATCH_SIZE: int = 256  # sentences
+MAX_WAIT: float = 0.01  # seconds
+MAX_QUEUE: int = 8192  # sentences
+LATENCY_WINDOW: int = 1000  # requests
+
+arg_parser = argparse.ArgumentParser(
+    formatter_class=argparse.RawTextHelpFormatter,
+    description=(inference_service.__doc__)
+)
+arg_parser.add_argument("-a", "--address", type=str, default=DEFAULT_ADDRESS,
+                        help="the host:port to listen on. Defaults to "
+                            f"'{DEFAULT_ADDRESS}'.")
+arg_parser.add_argument("-p", "--precision", choices=PRECISIONS,
+                        default="fp32",
+                        help="inference precision of the paraphrasing model. "
+                             "Defaults to\n'fp32'.")
+arg_parser.add_argument("--preload", nargs="+", default=[],
+                        choices=["paraphrase", "negate", "ner"],
+                        help="models to load at startup instead of on the "
+                             "first request")
+arg_parser.add_argument("-b", "--max-batch-size", type=int,
+                        default=MAX_BATCH_SIZE,
+                        help="maximum number of sentences per micro-batch. "
+                             "Defaults to\n"
+                            f"{MAX_BATCH_SIZE}.")
+arg_parser.add_argument("-w", "--max-wait", type=float, default=MAX_WAIT,
+                        help="maximum time to wait for more requests before "
+                             "running a\nmicro-batch, in seconds. Defaults "
+                            f"to {MAX_WAIT}.")
+arg_parser.add_argument("-q", "--max-queue", type=int, default=MAX_QUEUE,
+                        help="maximum number of queued sentences per "
+                             "endpoint. Further\nrequests are rejected. "
+                            f"Defaults to {MAX_QUEUE}.")
+
+
+class Overloaded(RuntimeError):
+    """The queue of an endpoint is full."""
+
+
+class _Request:
+    """The sentences of a request, waiting to be processed."""
+
+    def __init__(self, items: List[Any]):
+        self.items = items
+        self.results: Optional[List[Any]] = None
+        self.error: Optional[BaseException] = None
+        self.enqueued = time.perf_counter()
+        self.done = threading.Event()
+
+
+class MicroBatcher:
+    """Merges concurrent requests into batches.
+
+    A worker thread waits for up to :attr:`max_wait` seconds after the first
+    queued request for more requests to arrive, and processes them together
+    in a single call, up to :attr:`max_batch_size` items.
+
+    Attributes:
+        process_batch (:obj:`Callable[[List[Any]], List[Any]]`):
+            The function processing a batch, returning one result per item.
+        max_batch_size (:obj:`int`):
+            The maximum number of items per batch. Larger requests are
+            processed in a batch of their own.
+        max_wait (:obj:`float`):
+            The maximum time a request waits for others, in seconds.
+        max_queue (:obj:`int`):
+            The maximum number of queued items. Requests that would exceed it
+            are rejected, unless the queue is empty.
+    """
+
+    def __init__(
+        self,
+        process_batch: Callable[[List[Any]], List[Any]],
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_wait: float = MAX_WAIT,
+        max_queue: int = MAX_QUEUE
+    ):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self._queue: Deque[_Request] = deque()
+        self._queued_items = 0
+        self._condition = threading.Condition()
+        self._requests = 0
+        self._items = 0
+        self._batches = 0
+        self._rejected = 0
+        self._latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, items: List[Any]) -> List[Any]:
+        """Process items, together with those of other requests.
+
+        Args:
+            items (:obj:`List[Any]`):
+                The items to process.
+
+        Returns:
+            :obj:`List[Any]`: The result of every item.
+
+        Raises:
+            :obj:`Overloaded`: If the queue is full.
+        """
+        if not items:
+            return []
+        request = _Request(items)
+        with self._condition:
+            if (self._queued_items
+                    and self._queued_items + len(items) > self.max_queue):
+                self._rejected += 1
+                raise Overloaded(f"{self._queued_items} sentences queued.")
+            self._queue.append(request)
+            self._queued_items += len(items)
+            self._condition.notify()
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.results
+
+    def _next_batch(self) -> List[_Request]:
+        """Wait for the requests of the next batch."""
+        with self._condition:
+            while not self._queue:
+                self._condition.wait()
+            deadline = self._queue[0].enqueued + self.max_wait
+            while self._queued_items < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            batch = [self._queue.popleft()]
+            size = len(batch[0].items)
+            while (self._queue
+                   and size + len(self._queue[0].items)
+                   <= self.max_batch_size):
+                batch.append(self._queue.popleft())
+                size += len(batch[-1].items)
+            self._queued_items -= size
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            items = [item for request in batch for item in request.items]
+            try:
+                results = self.process_batch(items)
+            except Exception as e:
+                results = None
+                for request in batch:
+                    request.error = e
+            start = 0
+            now = time.perf_counter()
+            with self._condition:
+                self._batches += 1
+                self._requests += len(batch)
+                self._items += len(items)
+                self._latencies.extend(now - request.enqueued
+                                       for request in batch)
+            for request in batch:
+                if results is not None:
+                    request.results = results[start:start+len(request.items)]
+                    start += len(request.items)
+                request.done.set()
+
+    def stats(self) -> Dict[str, Any]:
+        """Get the statistics of the batcher.
+
+        Returns:
+            :obj:`Dict[str, Any]`: The current queue depth, the number of
+            requests, items, batches and rejected requests so far, the mean
+            batch size, and the median and 95th percentile latency of the
+            latest requests, in milliseconds.
+        """
+        with self._condition:
+            latencies = sorted(self._latencies)
+
+            def percentile(p: float) -> Optional[float]:
+                if not latencies:
+                    return None
+                return latencies[int(p * (len(latencies) - 1))] * 1000
+
+            return {
+                "queued_requests": len(self._queue),
+                "queued_sentences": self._queued_items,
+                "requests": self._requests,
+                "sentences": self._items,
+                "batches": self._batches,
+                "mean_batch_size": (self._items / self._batches
+                                    if self._batches else None),
+                "rejected": self._rejected,
+                "latency_p50_ms": percentile(0.5),
+                "latency_p95_ms": percentile(0.95),
+            }
+
+
+class InferenceService:
+    """The models behind the service, each with its micro-batchers.
+
+    Models are loaded on their first request, unless preloaded, and are then
+    kept in memory. Each model is only used by one batch at a time.
+
+    Attributes:
+        precision (:obj:`str`):
+            The inference precision of the paraphrasing model.
+    """
+
+    def __init__(
+        self,
+        precision: str = "fp32",
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_wait: float = MAX_WAIT,
+        max_queue: int = MAX_QUEUE
+    ):
+        self.precision = precision
+        self._batcher_settings = (max_batch_size, max_wait, max_queue)
+        self._models: Dict[str, Any] = {}
+        self._model_locks: Dict[str, threading.Lock] = {
+            name: threading.Lock() for name in ("paraphrase", "negate", "ner")
+        }
+        self._batchers: Dict[Tuple, MicroBatcher] = {}
+        self._batchers_lock = threading.Lock()
+
+    def model(self, name: str) -> Any:
+        """Get a model, loading it if needed.
+
+        Args:
+            name (:obj:`str`):
+                One of ``"paraphrase"``, ``"negate"`` or ``"ner"``.
+
+        Returns:
+            :obj:`Any`: The model.
+        """
+        with self._model_locks[name]:
+            if name not in self._models:
+                print(f"⏳ Loading the {name} model...")
+                if name == "paraphrase":
+                    from batching import TokenBudgetScheduler
+                    from paraphrasis import PegasusParaphraser
+                    self._models[name] = TokenBudgetScheduler(
+                        PegasusParaphraser(precision=self.precision))
+                elif name == "negate":
+                    from negate import Negator
+                    self._models[name] = Negator(fail_on_unsupported=True)
+                else:
+                    from named_entities import load_ner_pipeline
+                    self._models[name] = load_ner_pipeline()
+            return self._models[name]
+
+    def _batcher(
+        self,
+        key: Tuple,
+        process_batch: Callable[[List[Any]], List[Any]]
+    ) -> MicroBatcher:
+        with self._batchers_lock:
+            if key not in self._batchers:
+                self._batchers[key] = MicroBatcher(process_batch,
+                                                   *self._batcher_settings)
+            return self._batchers[key]
+
+    def _locked(self, name: str, function: Callable) -> Callable:
+        """Run a batch function while holding the lock of a model."""
+        def locked(items: List[Any]) -> List[Any]:
+            model = self.model(name)
+            with self._model_locks[name]:
+                return function(model, items)
+        return locked
+
+    def paraphrase(
+        self,
+        sentences: List[str],
+        num_return_sentences: int = 1,
+        num_beams: int = 4
+    ) -> List[List[str]]:
+        """Paraphrase sentences. See :meth:`MicroBatcher.submit`."""
+        # Only requests with the same settings can share a batch.
+        key = ("paraphrase", num_return_sentences, num_beams)
+        return self._batcher(key, self._locked(
+            "paraphrase",
+            lambda model, items: model.paraphrase_batch(
+                items, num_return_sentences=num_return_sentences,
+                num_beams=num_beams)
+        )).submit(sentences)
+
+    def negate(self, sentences: List[str]) -> List[Tuple]:
+        """Negate sentences. See :meth:`MicroBatcher.submit`."""
+        from negation import negate_with
+
+        return self._batcher(("negate",), self._locked(
+            "negate",
+            lambda model, items: [tuple(negate_with(model, sentence))
+                                  for sentence in items]
+        )).submit(sentences)
+
+    def entities(self, sentences: List[str]) -> List[List[str]]:
+        """Extract named entities. See :meth:`MicroBatcher.submit`."""
+        return self._batcher(("ner",), self._locked(
+            "ner",
+            lambda model, items: [[ent.text for ent in doc.ents]
+                                  for doc in model.pipe(items)]
+        )).submit(sentences)
+
+    def info(self) -> Dict[str, Any]:
+        """Get the configuration of the service.
+
+        Returns:
+            :obj:`Dict[str, Any]`: The model name, precision and loaded
+            models.
+        """
+        return {"model_name": MODEL_NAME, "precision": self.precision,
+                "loaded": sorted(self._models)}
+
+    def stats(self) -> Dict[str, Any]:
+        """Get the statistics of every micro-batcher.
+
+        Returns:
+            :obj:`Dict[str, Any]`: See :meth:`MicroBatcher.stats`.
+        """
+        with self._batchers_lock:
+            batchers = dict(self._batchers)
+        return {"/".join(map(str, key)): batcher.stats()
+                for key, batcher in batchers.items()}
+
+
+def make_handler(service: InferenceService) -> type:
+    """Create the HTTP request handler of a service.
+
+    Args:
+        service (:obj:`InferenceService`):
+            The service.
+
+    Returns:
+        :obj:`type`: The :obj:`http.server.BaseHTTPRequestHandler` subclass.
+    """
+    class Handler(BaseHTTPRequestHandler):
+
+        def _reply(self, code: int, body: Any):
+            data = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._reply(200, service.info())
+            elif self.path == "/stats":
+                self._reply(200, service.stats())
+            else:
+                self._reply(404, {"error": f"Unknown endpoint {self.path}."})
+
+        def do_POST(self):
+            endpoints = {"/paraphrase": service.paraphrase,
+                         "/negate": service.negate,
+                         "/ner": service.entities}
+            if self.path not in endpoints:
+                self._reply(404, {"error": f"Unknown endpoint {self.path}."})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length))
+                sentences = payload.pop("sentences")
+            except (ValueError, KeyError, AttributeError) as e:
+                self._reply(400, {"error": f"Invalid request: {e}"})
+                return
+            try:
+                results = endpoints[self.path](sentences, **payload)
+            except Overloaded as e:
+                self._reply(503, {"error": str(e)})
+            except Exception as e:
+                self._reply(500, {"error": repr(e)})
+            else:
+                self._reply(200, {"results": results})
+
+        def log_message(self, *args):
+            pass  # one line per request would flood the output
+
+    return Handler
+
+
+def main(args: argparse.ArgumentParser):
+    """Run the inference service."""
+    host, port = args.address.rsplit(":", 1)
+    service = InferenceService(args.precision, args.max_batch_size,
+                               args.max_wait, args.max_queue)
+    for name in args.preload:
+        service.model(name)
+    server = ThreadingHTTPServer((host, int(port)), make_handler(service))
+    print(f"🚀 Serving on http://{args.address}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main(arg_parser.parse_args())
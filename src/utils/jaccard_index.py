@@ -3,7 +3,52 @@
 See `https://en.wikipedia.org/wiki/Jaccard_index`__."""
 
 import string
-from typing import Set
+from typing import Sequence, Set, Tuple
+
+import numpy as np
+
+
+def _words(sentence: str) -> Tuple[Set[str], int]:
+    words = sentence.split()
+    return {w.strip(string.punctuation) for w in words}, len(words)
+
+
+def pair_features(
+    a: Sequence[str],
+    b: Sequence[str]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Calculate the Jaccard similarity and length difference of string pairs.
+
+    Every pair is split into words once, and the same sets are used for both
+    features.
+
+    Args:
+        a (:obj:`Sequence[str]`):
+            The first string of each pair.
+        b (:obj:`Sequence[str]`):
+            The second string of each pair.
+
+    Returns:
+        :obj:`Tuple[np.ndarray, np.ndarray]`: The Jaccard index (see
+        :func:`jaccard_similarity`) and the absolute difference in number of
+        whitespace-separated words of every pair.
+
+    Raises:
+        :obj:`ValueError`: If :paramref:`a` and :paramref:`b` differ in
+        length.
+        :obj:`ZeroDivisionError`: If both strings of a pair are empty.
+    """
+    if len(a) != len(b):
+        raise ValueError(f"Expected sequences of equal length, got {len(a)} "
+                         f"and {len(b)}.")
+    jaccard = np.empty(len(a), dtype=np.float64)
+    length_diff = np.empty(len(a), dtype=np.int64)
+    for i, (sentence_a, sentence_b) in enumerate(zip(a, b)):
+        words_a, count_a = _words(sentence_a)
+        words_b, count_b = _words(sentence_b)
+        jaccard[i] = len(words_a & words_b) / len(words_a | words_b)
+        length_diff[i] = abs(count_a - count_b)
+    return jaccard, length_diff
 
 
 def jaccard_similarity(a: str, b: str) -> float:
@@ -21,6 +66,6 @@ def jaccard_similarity(a: str, b: str) -> float:
     Returns:
         :obj:`float`: The Jaccard index of the two strings.
     """
-    words_a: Set[str] = {w.strip(string.punctuation) for w in a.split()}
-    words_b: Set[str] = {w.strip(string.punctuation) for w in b.split()}
-    return len(words_a.intersection(words_b)) / len(words_a.union(words_b))
+    words_a, _ = _words(a)
+    words_b, _ = _words(b)
+    return len(words_a & words_b) / len(words_a | words_b)
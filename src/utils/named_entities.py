@@ -0,0 +1,176 @@
+"""Named entity utilities."""
+
+import multiprocessing as mp
+from itertools import chain
+from typing import TYPE_CHECKING, Iterable, Iterator, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from spacy.language import Language
+
+SPACY_MODEL: str = "en_core_web_md"
+# Components that cannot change ``doc.ents``: the lemmatizer only sets
+# lemmas, which NER does not read, and the senter is disabled by default.
+# The parser, tagger and attribute ruler set sentence boundaries and token
+# attributes, so they are kept and the entities match the full pipeline's.
+NER_UNUSED_COMPONENTS: List[str] = ["lemmatizer", "senter"]
+
+# The pipeline of the current worker process.
+_worker_nlp: Optional["Language"] = None
+
+
+def load_ner_pipeline(model: str = SPACY_MODEL) -> "Language":
+    """Load a spaCy pipeline with only the components NER needs.
+
+    Args:
+        model (:obj:`str`, defaults to ``"en_core_web_md"``):
+            The name of the spaCy pipeline to load.
+
+    Returns:
+        :obj:`spacy.language.Language`: The loaded pipeline.
+    """
+    import spacy  # slow to import, so only when a pipeline is needed
+
+    return spacy.load(model, exclude=NER_UNUSED_COMPONENTS)
+
+
+def entities_match(ents_a: List[str], ents_b: List[str]) -> bool:
+    """Determine whether two sentences mention the same named entities.
+
+    Args:
+        ents_a (:obj:`List[str]`):
+            The named entities in the first sentence.
+        ents_b (:obj:`List[str]`):
+            The named entities in the second sentence.
+
+    Returns:
+        :obj:`bool`: Whether both sentences contain the same number of named
+        entities and every entity in one of them appears in the other.
+    """
+    if len(ents_a) != len(ents_b):
+        return False
+    return (all(ent_a in ents_b for ent_a in ents_a)
+            and all(ent_b in ents_a for ent_b in ents_b))
+
+
+def extract_entity_pairs(
+    pairs: Iterable[Tuple[str, str]],
+    nlp: "Language",
+    batch_size: int = 256,
+    n_process: int = 1
+) -> Iterator[Tuple[List[str], List[str]]]:
+    """Extract the named entities of sentence pairs.
+
+    All sentences are streamed through a single :meth:`nlp.pipe` call.
+
+    Args:
+        pairs (:obj:`Iterable[Tuple[str, str]]`):
+            The sentence pairs.
+        nlp (:obj:`spacy.language.Language`):
+            The spaCy pipeline, e.g., as returned by :func:`load_ner_pipeline`.
+        batch_size (:obj:`int`, defaults to ``256``):
+            The number of sentences to buffer in each :meth:`nlp.pipe` batch.
+        n_process (:obj:`int`, defaults to ``1``):
+            The number of processes :meth:`nlp.pipe` should use.
+
+    Returns:
+        :obj:`Iterator[Tuple[List[str], List[str]]]`: The text of the named
+        entities in each sentence of every pair, in the same order.
+    """
+    docs = nlp.pipe(chain.from_iterable(pairs), batch_size=batch_size,
+                    n_process=n_process)
+    for doc_a, doc_b in zip(docs, docs):
+        yield ([ent.text for ent in doc_a.ents],
+               [ent.text for ent in doc_b.ents])
+
+
+def unmatched_entities(
+    pairs: Iterable[Tuple[str, str]],
+    nlp: "Language",
+    batch_size: int = 256,
+    n_process: int = 1
+) -> List[bool]:
+    """Determine, for each sentence pair, whether their named entities differ.
+
+    Args:
+        pairs (:obj:`Iterable[Tuple[str, str]]`):
+            The sentence pairs.
+        nlp (:obj:`spacy.language.Language`):
+            The spaCy pipeline, e.g., as returned by :func:`load_ner_pipeline`.
+        batch_size (:obj:`int`, defaults to ``256``):
+            The number of sentences to buffer in each :meth:`nlp.pipe` batch.
+        n_process (:obj:`int`, defaults to ``1``):
+            The number of processes :meth:`nlp.pipe` should use.
+
+    Returns:
+        :obj:`List[bool]`: Whether there are named entities in the first
+        sentence of each pair not in the second one or vice versa.
+    """
+    return [not entities_match(ents_a, ents_b)
+            for ents_a, ents_b in extract_entity_pairs(pairs, nlp, batch_size,
+                                                       n_process)]
+
+
+def _init_worker(model: str):
+    """Load the pipeline of a worker process."""
+    global _worker_nlp
+    _worker_nlp = load_ner_pipeline(model)
+
+
+def _unmatched_chunk(
+    chunk: Tuple[List[Tuple[str, str]], int]
+) -> List[bool]:
+    """Compare the named entities of a chunk of pairs in a worker process."""
+    pairs, batch_size = chunk
+    return unmatched_entities(pairs, _worker_nlp, batch_size)
+
+
+class EntityRecognitionPool:
+    """Pool of worker processes that recognize named entities.
+
+    ``nlp.pipe(..., n_process=n)`` starts its workers, each loading the
+    pipeline, on every call, and stops them when done. The workers of this
+    pool are started, and load the pipeline, only once, so it can be reused
+    for every chunk of a dataset.
+
+    Attributes:
+        batch_size (:obj:`int`):
+            The number of sentence pairs handed to a worker at a time.
+    """
+
+    def __init__(
+        self,
+        n_process: int,
+        model: str = SPACY_MODEL,
+        batch_size: int = 256
+    ):
+        self.batch_size = batch_size
+        # Forking after spaCy has been loaded is not safe.
+        self._pool = mp.get_context("spawn").Pool(n_process,
+                                                  initializer=_init_worker,
+                                                  initargs=(model,))
+
+    def unmatched_entities(
+        self,
+        pairs: Iterable[Tuple[str, str]]
+    ) -> List[bool]:
+        """Determine, for each sentence pair, whether their entities differ.
+
+        See :func:`unmatched_entities`.
+        """
+        pairs = list(pairs)
+        chunks = [(pairs[i:i+self.batch_size], self.batch_size)
+                  for i in range(0, len(pairs), self.batch_size)]
+        return [unmatched
+                for chunk in self._pool.imap(_unmatched_chunk, chunks)
+                for unmatched in chunk]
+
+    def close(self):
+        """Stop the worker processes."""
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self) -> "EntityRecognitionPool":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,189 @@
+"""Near-duplicate detection.
+
+Samples are compared through MinHash signatures of their word shingles, which
+estimate the Jaccard similarity of the shingle sets. Instead of comparing
+every pair of samples, the signatures are split into bands, and only samples
+that share at least one band with identical values (i.e., that fall in the
+same locality-sensitive hashing bucket) are compared. The number of
+comparisons is therefore linear in the number of samples.
+
+Only samples with the same label are compared: a negated pair and the
+paraphrased pair built from the same premise are expected to be very similar.
+
+See Leskovec, J., Rajaraman, A., & Ullman, J. D. (2014), "Mining of Massive
+Datasets", chapter 3.
+"""
+
+import hashlib
+import string
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Sequence, Set, Tuple
+
+import numpy as np
+
+from dedup import Sample
+
+MERSENNE_PRIME: int = (1 << 31) - 1
+SHINGLE_SIZE: int = 3  # words
+MAX_BUCKET_SIZE: int = 64  # members compared with each other
+
+
+def shingles(sample: Sample, size: int = SHINGLE_SIZE) -> Set[int]:
+    """Hash the word n-grams of a sample.
+
+    Words are lowercased and common punctuation characters are stripped. The
+    premise and the hypothesis are shingled separately.
+
+    Args:
+        sample (:obj:`Sample`):
+            The ``(premise, hypothesis, label)`` triple.
+        size (:obj:`int`, defaults to ``3``):
+            The number of words per shingle. Sentences with fewer words are
+            taken as a single shingle.
+
+    Returns:
+        :obj:`Set[int]`: The 32-bit hashes of the shingles.
+    """
+    hashes: Set[int] = set()
+    for side, sentence in enumerate(sample[:2]):
+        words = [w.strip(string.punctuation).lower() for w in sentence.split()]
+        for i in range(max(len(words) - size + 1, 1)):
+            shingle = f"{side}|{' '.join(words[i:i+size])}"
+            digest = hashlib.blake2b(shingle.encode("utf-8"), digest_size=4)
+            hashes.add(int.from_bytes(digest.digest(), "little"))
+    return hashes
+
+
+class UnionFind:
+    """Disjoint sets of integers."""
+
+    def __init__(self, size: int):
+        self._parent = list(range(size))
+
+    def find(self, x: int) -> int:
+        """Find the representative of the set containing an element."""
+        while self._parent[x] != x:
+            self._parent[x] = self._parent[self._parent[x]]
+            x = self._parent[x]
+        return x
+
+    def union(self, x: int, y: int):
+        """Merge the sets containing two elements."""
+        root_x, root_y = self.find(x), self.find(y)
+        if root_x != root_y:
+            # Keep the earliest element as the representative.
+            self._parent[max(root_x, root_y)] = min(root_x, root_y)
+
+
+class NearDuplicateDetector:
+    """MinHash/LSH near-duplicate detector.
+
+    With ``b`` bands of ``r`` rows, two samples with a Jaccard similarity of
+    ``s`` become candidates with probability ``1 - (1 - s**r)**b``. Candidates
+    are then only clustered if their estimated similarity is at least
+    :attr:`threshold`.
+
+    Every member of a bucket is compared with every other member, so two
+    candidates are clustered even if neither is similar to the first member.
+    To keep the number of comparisons linear in very large buckets, members
+    are only compared with the :attr:`max_bucket_size` members before them.
+
+    Attributes:
+        threshold (:obj:`float`):
+            The minimum estimated Jaccard similarity of near-duplicates.
+        num_bands (:obj:`int`):
+            The number of LSH bands.
+        rows_per_band (:obj:`int`):
+            The number of signature values per band.
+        max_bucket_size (:obj:`int`):
+            The number of preceding members of a bucket each member is
+            compared with.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.8,
+        num_bands: int = 16,
+        rows_per_band: int = 8,
+        seed: int = 0,
+        max_bucket_size: int = MAX_BUCKET_SIZE
+    ):
+        self.threshold = threshold
+        self.num_bands = num_bands
+        self.rows_per_band = rows_per_band
+        self.max_bucket_size = max_bucket_size
+        num_perm = num_bands * rows_per_band
+        rng = np.random.default_rng(seed)
+        # Universal hashing modulo a 31-bit prime, so that a * x + b cannot
+        # overflow with 32-bit shingle hashes.
+        self._a = rng.integers(1, MERSENNE_PRIME, size=num_perm,
+                               dtype=np.uint64)
+        self._b = rng.integers(0, MERSENNE_PRIME, size=num_perm,
+                               dtype=np.uint64)
+
+    def signature(self, sample: Sample) -> np.ndarray:
+        """Compute the MinHash signature of a sample.
+
+        Args:
+            sample (:obj:`Sample`):
+                The ``(premise, hypothesis, label)`` triple.
+
+        Returns:
+            :obj:`np.ndarray`: The signature, with one value per band row.
+        """
+        hashes = np.fromiter(shingles(sample), dtype=np.uint64)
+        return ((np.outer(self._a, hashes) + self._b[:, None])
+                % MERSENNE_PRIME).min(axis=1)
+
+    def clusters(self, samples: Sequence[Sample]) -> List[List[int]]:
+        """Group samples into clusters of near-duplicates.
+
+        Args:
+            samples (:obj:`Sequence[Sample]`):
+                The samples to cluster.
+
+        Returns:
+            :obj:`List[List[int]]`: The indices of the members of every
+            cluster with more than one member. Both the clusters and their
+            members are sorted by their first index.
+        """
+        signatures = np.array([self.signature(sample) for sample in samples])
+        buckets: Dict[Tuple[str, int, bytes], List[int]] = defaultdict(list)
+        r = self.rows_per_band
+        for i, (sample, sig) in enumerate(zip(samples, signatures)):
+            for band in range(self.num_bands):
+                key = (sample[2], band, sig[band*r:(band+1)*r].tobytes())
+                buckets[key].append(i)
+        sets = UnionFind(len(samples))
+        for members in buckets.values():
+            for j in range(1, len(members)):
+                previous = members[max(j - self.max_bucket_size, 0):j]
+                similarities = np.mean(
+                    signatures[previous] == signatures[members[j]], axis=1)
+                for i, similarity in zip(previous, similarities):
+                    if similarity >= self.threshold:
+                        sets.union(i, members[j])
+        groups: Dict[int, List[int]] = defaultdict(list)
+        for i in range(len(samples)):
+            groups[sets.find(i)].append(i)
+        return [members for members in groups.values() if len(members) > 1]
+
+
+def cross_source_counts(
+    clusters: Iterable[List[int]],
+    sources: Sequence[str]
+) -> Counter:
+    """Count the clusters shared by each combination of sources.
+
+    Args:
+        clusters (:obj:`Iterable[List[int]]`):
+            The clusters, as returned by :meth:`NearDuplicateDetector.clusters`.
+        sources (:obj:`Sequence[str]`):
+            The source of every sample.
+
+    Returns:
+        :obj:`collections.Counter`: The number of clusters per sorted tuple of
+        distinct sources of their members.
+    """
+    return Counter(tuple(sorted({sources[i] for i in members}))
+                   for members in clusters)
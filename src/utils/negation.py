@@ -0,0 +1,111 @@
+"""Negation utilities.
+
+Sentences are negated with `negate <https://github.com/dmlls/negate>`__. Each
+sentence needs its own spaCy parse, so for large corpora the work is split in
+chunks across a pool of worker processes, each of which loads its own
+:obj:`negate.Negator` only once.
+"""
+
+import multiprocessing as mp
+from typing import (TYPE_CHECKING, Iterable, Iterator, List, NamedTuple,
+                    Optional)
+
+if TYPE_CHECKING:
+    from negate import Negator
+
+# The negator of the current worker process.
+_worker_negator: Optional["Negator"] = None
+
+
+class NegationResult(NamedTuple):
+    """The outcome of negating a sentence.
+
+    Attributes:
+        sentence (:obj:`str`):
+            The original sentence.
+        negated (:obj:`Optional[str]`):
+            The negated sentence, or :obj:`None` if it is not supported.
+        error (:obj:`Optional[str]`):
+            Why the sentence is not supported, if that is the case.
+    """
+    sentence: str
+    negated: Optional[str]
+    error: Optional[str] = None
+
+
+def negate_with(negator: "Negator", sentence: str) -> NegationResult:
+    """Negate a sentence, recording unsupported sentences instead of failing.
+
+    Args:
+        negator (:obj:`negate.Negator`):
+            A negator created with ``fail_on_unsupported=True``.
+        sentence (:obj:`str`):
+            The sentence to negate.
+
+    Returns:
+        :obj:`NegationResult`: The negated sentence, or the reason why it
+        could not be negated.
+    """
+    try:
+        return NegationResult(sentence, negator.negate_sentence(sentence))
+    except RuntimeError as e:
+        return NegationResult(sentence, None, str(e))
+
+
+def _init_worker():
+    """Load the negator of a worker process."""
+    from negate import Negator
+
+    global _worker_negator
+    _worker_negator = Negator(fail_on_unsupported=True)
+
+
+def _negate_chunk(sentences: List[str]) -> List[NegationResult]:
+    """Negate a chunk of sentences in a worker process."""
+    return [negate_with(_worker_negator, sentence) for sentence in sentences]
+
+
+def _chunks(sentences: Iterable[str], size: int) -> Iterator[List[str]]:
+    chunk: List[str] = []
+    for sentence in sentences:
+        chunk.append(sentence)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def negate_sentences(
+    sentences: Iterable[str],
+    n_process: int = 1,
+    chunk_size: int = 64
+) -> List[NegationResult]:
+    """Negate sentences, optionally in parallel.
+
+    Args:
+        sentences (:obj:`Iterable[str]`):
+            The sentences to negate.
+        n_process (:obj:`int`, defaults to ``1``):
+            The number of worker processes. With ``1``, the sentences are
+            negated in the current process.
+        chunk_size (:obj:`int`, defaults to ``64``):
+            The number of sentences handed to a worker at a time.
+
+    Returns:
+        :obj:`List[NegationResult]`: The result of every sentence, in the
+        same order.
+    """
+    if n_process <= 1:
+        # negate loads spaCy, which is slow to import.
+        from negate import Negator
+
+        negator = Negator(fail_on_unsupported=True)
+        return [negate_with(negator, sentence) for sentence in sentences]
+    # Forking after spaCy has been loaded is not safe.
+    with mp.get_context("spawn").Pool(n_process,
+                                      initializer=_init_worker) as pool:
+        return [result
+                for chunk in pool.imap(_negate_chunk,
+                                       _chunks(sentences, chunk_size))
+                for result in chunk]
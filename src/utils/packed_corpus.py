@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+
+"""Packed corpus format.
+
+In the ``.tsv`` output, every sentence is repeated several times (e.g., as a
+premise, in its paraphrased pair and in the swapped pairs), and the whole file
+has to be parsed every time it is loaded. A packed corpus is a directory that
+instead stores every distinct sentence only once, and refers to sentences by
+id:
+
+   - ``heap.bin``: The UTF-8 encoded sentences, one after the other.
+   - ``offsets.npy``: :obj:`int32` array with the start of every sentence in
+     the heap, plus the end of the last one.
+   - ``premise.npy``, ``hypothesis.npy``: :obj:`int32` arrays with the
+     sentence id of the premise and hypothesis of every row.
+   - ``label.npy``: :obj:`int8` array with the label of every row, or ``-1``
+     if the corpus has no labels.
+   - ``source.npy``: :obj:`int16` array with the source id of every row.
+   - ``meta.json``: The source names and the original column names.
+
+All the arrays are memory-mapped when loaded, so opening a corpus takes
+constant time and memory, and rows are read on demand.
+
+When run as a script, it converts a packed corpus back into a ``.tsv`` file,
+or benchmarks loading it against :func:`pandas.read_csv`, e.g.::
+
+   ./packed_corpus.py negation_dataset.packed -o negation_dataset.tsv
+   ./packed_corpus.py negation_dataset.packed --benchmark negation_dataset.tsv
+"""
+
+import gc
+import json
+import mmap
+import time
+import resource
+import argparse
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+PACKED_SUFFIX: str = ".packed"
+NO_LABEL: int = -1
+
+Row = Tuple[str, str, int, str]
+
+
+class PackedCorpusWriter:
+    """Builder of packed corpora.
+
+    Attributes:
+        columns (:obj:`List[str]`):
+            The names of the premise, hypothesis and (if any) label columns,
+            used when converting back to ``.tsv``.
+    """
+
+    def __init__(self, columns: Optional[List[str]] = None):
+        self.columns = columns or ["premise", "hypothesis", "label"]
+        self._strings: Dict[str, int] = {}
+        self._sources: Dict[str, int] = {}
+        self._premise: List[int] = []
+        self._hypothesis: List[int] = []
+        self._label: List[int] = []
+        self._source: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self._premise)
+
+    def _intern(self, sentence: str) -> int:
+        return self._strings.setdefault(sentence, len(self._strings))
+
+    def add(
+        self,
+        premise: str,
+        hypothesis: str,
+        label: Union[int, str, None] = None,
+        source: str = ""
+    ):
+        """Add a row.
+
+        Args:
+            premise (:obj:`str`):
+                The premise.
+            hypothesis (:obj:`str`):
+                The hypothesis.
+            label (:obj:`Union[int, str, None]`, defaults to :obj:`None`):
+                The label, if any.
+            source (:obj:`str`, defaults to ``""``):
+                The name of the source the row comes from.
+        """
+        self._premise.append(self._intern(premise))
+        self._hypothesis.append(self._intern(hypothesis))
+        self._label.append(NO_LABEL if label is None else int(label))
+        self._source.append(self._sources.setdefault(source,
+                                                     len(self._sources)))
+
+    def add_all(self, rows: Iterable[Row]):
+        """Add several ``(premise, hypothesis, label, source)`` rows.
+
+        Args:
+            rows (:obj:`Iterable[Row]`):
+                The rows to add.
+        """
+        for premise, hypothesis, label, source in rows:
+            self.add(premise, hypothesis, label, source)
+
+    def write(self, path: Union[str, Path], order: Optional[np.ndarray] = None):
+        """Write the corpus.
+
+        Args:
+            path (:obj:`Union[str, pathlib.Path]`):
+                The directory to write the corpus to.
+            order (:obj:`np.ndarray`, `optional`, defaults to :obj:`None`):
+                The permutation of the rows to write, e.g., to shuffle them.
+                If :obj:`None`, they are written in the order they were
+                added.
+
+        Raises:
+            :obj:`ValueError`: If the heap does not fit :obj:`int32` offsets.
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        offsets = [0]
+        with open(path / "heap.bin", "wb") as heap:
+            for sentence in self._strings:  # dicts keep insertion order
+                offsets.append(offsets[-1] + heap.write(
+                    sentence.encode("utf-8")))
+        if offsets[-1] > np.iinfo(np.int32).max:
+            raise ValueError("The corpus is too large for int32 offsets.")
+        np.save(path / "offsets.npy", np.asarray(offsets, dtype=np.int32))
+        rows = (slice(None) if order is None
+                else np.asarray(order, dtype=np.int64))
+        for name, values, dtype in (("premise", self._premise, np.int32),
+                                    ("hypothesis", self._hypothesis, np.int32),
+                                    ("label", self._label, np.int8),
+                                    ("source", self._source, np.int16)):
+            np.save(path / f"{name}.npy", np.asarray(values, dtype=dtype)[rows])
+        with open(path / "meta.json", "w", encoding="utf-8") as f:
+            json.dump({"sources": list(self._sources),
+                       "columns": self.columns}, f, ensure_ascii=False,
+                      indent=2)
+
+
+class PackedCorpus:
+    """Memory-mapped, read-only packed corpus.
+
+    Attributes:
+        path (:obj:`pathlib.Path`):
+            The directory of the corpus.
+        sources (:obj:`List[str]`):
+            The source names, by source id.
+        columns (:obj:`List[str]`):
+            The original column names.
+        premise (:obj:`np.ndarray`):
+            The sentence id of the premise of every row.
+        hypothesis (:obj:`np.ndarray`):
+            The sentence id of the hypothesis of every row.
+        label (:obj:`np.ndarray`):
+            The label of every row, or ``-1`` if there are no labels.
+        source (:obj:`np.ndarray`):
+            The source id of every row.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        with open(self.path / "meta.json", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.sources: List[str] = meta["sources"]
+        self.columns: List[str] = meta["columns"]
+        self._offsets = np.load(self.path / "offsets.npy", mmap_mode="r")
+        self.premise = np.load(self.path / "premise.npy", mmap_mode="r")
+        self.hypothesis = np.load(self.path / "hypothesis.npy", mmap_mode="r")
+        self.label = np.load(self.path / "label.npy", mmap_mode="r")
+        self.source = np.load(self.path / "source.npy", mmap_mode="r")
+        with open(self.path / "heap.bin", "rb") as f:
+            # An empty file cannot be memory-mapped.
+            self._heap = (mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                          if self._offsets[-1] else b"")
+
+    def __len__(self) -> int:
+        return len(self.premise)
+
+    def __getitem__(self, index: int) -> Row:
+        return (self.string(self.premise[index]),
+                self.string(self.hypothesis[index]),
+                int(self.label[index]),
+                self.sources[self.source[index]])
+
+    def __iter__(self) -> Iterator[Row]:
+        return (self[i] for i in range(len(self)))
+
+    @property
+    def num_strings(self) -> int:
+        """:obj:`int`: The number of distinct sentences."""
+        return len(self._offsets) - 1
+
+    def string(self, string_id: int) -> str:
+        """Get a sentence by id.
+
+        Args:
+            string_id (:obj:`int`):
+                The id of the sentence.
+
+        Returns:
+            :obj:`str`: The sentence.
+        """
+        start, end = self._offsets[string_id], self._offsets[string_id + 1]
+        return self._heap[start:end].decode("utf-8")
+
+    def to_tsv(self, path: Union[str, Path]):
+        """Convert the corpus into a ``.tsv`` file.
+
+        Args:
+            path (:obj:`Union[str, pathlib.Path]`):
+                The file to write to.
+        """
+        has_labels = len(self) and self.label.min() != NO_LABEL
+        columns = self.columns if has_labels else self.columns[:2]
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\t".join(columns) + "\n")
+            for premise, hypothesis, label, _ in self:
+                f.write(f"{premise}\t{hypothesis}"
+                        + (f"\t{label}\n" if has_labels else "\n"))
+
+
+def rss() -> int:
+    """Measure the resident memory of the process.
+
+    Returns:
+        :obj:`int`: The current resident memory, in bytes, or the peak one on
+        systems without ``/proc``.
+    """
+    try:
+        with open("/proc/self/statm", encoding="utf-8") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def benchmark(packed_path: Path, tsv_path: Path) -> str:
+    """Compare loading a packed corpus with :func:`pandas.read_csv`.
+
+    Both are loaded and then fully traversed, reading every sentence once.
+
+    Args:
+        packed_path (:obj:`pathlib.Path`):
+            The packed corpus.
+        tsv_path (:obj:`pathlib.Path`):
+            The same corpus as a ``.tsv`` file.
+
+    Returns:
+        :obj:`str`: A human-readable report of time and memory.
+    """
+    import pandas as pd
+
+    lines = []
+    for name, load in (
+        ("packed", lambda: PackedCorpus(packed_path)),
+        ("read_csv", lambda: pd.read_csv(tsv_path, sep="\t")),
+    ):
+        gc.collect()
+        rss_before = rss()
+        start = time.perf_counter()
+        corpus = load()
+        load_time = time.perf_counter() - start
+        load_rss = rss() - rss_before
+        start = time.perf_counter()
+        rows = corpus if name == "packed" else corpus.itertuples(index=False)
+        for _ in rows:
+            pass
+        scan_time = time.perf_counter() - start
+        lines.append(f"   {name}: load {load_time * 1000:.1f} ms, "
+                     f"{load_rss / 1024**2:.1f} MiB RSS; "
+                     f"full scan {scan_time * 1000:.1f} ms")
+        del corpus, rows
+    return "\n".join(lines)
+
+
+arg_parser = argparse.ArgumentParser(
+    formatter_class=argparse.RawTextHelpFormatter,
+    description=__doc__
+)
+arg_parser.add_argument("corpus", type=str, help="the packed corpus")
+arg_parser.add_argument("-o", "--output", type=str, default=None,
+                        help="the .tsv file to convert the corpus into")
+arg_parser.add_argument("-b", "--benchmark", type=str, default=None,
+                        help="the same corpus as a .tsv file, to compare "
+                             "loading times\nand memory with")
+
+
+def main(args: argparse.ArgumentParser):
+    """Convert or benchmark a packed corpus."""
+    if args.output:
+        PackedCorpus(args.corpus).to_tsv(args.output)
+        print(f"✅ Done! Output data written to '{args.output}'.")
+    if args.benchmark:
+        print(benchmark(Path(args.corpus), Path(args.benchmark)))
+
+
+if __name__ == "__main__":
+    main(arg_parser.parse_args())
@@ -0,0 +1,194 @@
+"""Persistent paraphrase cache.
+
+Generated paraphrases are stored in a SQLite database, keyed on a hash of the
+input sentence, the model name and the generation settings, so that rerunning
+the paraphrase stage only sends unseen sentences to the model.
+"""
+
+import hashlib
+import json
+import sqlite3
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Mapping, Tuple, Union
+
+DEFAULT_CACHE_PATH: str = "paraphrase_cache.sqlite"
+DEFAULT_MAX_SIZE: int = 1024**3  # bytes
+
+
+def cache_key(sentence: str, **settings: Any) -> str:
+    """Compute the content address of a paraphrasing request.
+
+    Args:
+        sentence (:obj:`str`):
+            The sentence to paraphrase.
+        **settings (:obj:`Any`):
+            Everything else that influences the output, e.g., the model name,
+            the number of beams or the generation parameters. Values must be
+            JSON serializable.
+
+    Returns:
+        :obj:`str`: The hex digest of the request.
+    """
+    payload = json.dumps([sentence, settings], sort_keys=True,
+                         ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ParaphraseCache:
+    """Size-bounded, least-recently-used paraphrase cache backed by SQLite.
+
+    Attributes:
+        path (:obj:`pathlib.Path`):
+            The path of the SQLite database.
+        max_size (:obj:`int`):
+            The maximum total size, in bytes, of the cached paraphrases. When
+            exceeded, the least recently used entries are evicted.
+        hits (:obj:`int`):
+            The number of lookups found in the cache.
+        misses (:obj:`int`):
+            The number of lookups not found in the cache.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path] = DEFAULT_CACHE_PATH,
+        max_size: int = DEFAULT_MAX_SIZE
+    ):
+        self.path = Path(path)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS paraphrases ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_used INTEGER NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS last_used_idx"
+            " ON paraphrases (last_used)"
+        )
+        self._conn.commit()
+        self._clock = self._conn.execute(
+            "SELECT COALESCE(MAX(last_used), 0) FROM paraphrases"
+        ).fetchone()[0]
+
+    def __len__(self) -> int:
+        return self._conn.execute(
+            "SELECT COUNT(*) FROM paraphrases"
+        ).fetchone()[0]
+
+    def __enter__(self) -> "ParaphraseCache":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def size(self) -> int:
+        """:obj:`int`: The total size, in bytes, of the cached paraphrases."""
+        return self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM paraphrases"
+        ).fetchone()[0]
+
+    def _tick(self) -> int:
+        self._clock += 1
+        return self._clock
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, List[str]]:
+        """Look up several keys at once.
+
+        Args:
+            keys (:obj:`Iterable[str]`):
+                The keys to look up, as returned by :func:`cache_key`.
+
+        Returns:
+            :obj:`Dict[str, List[str]]`: The cached paraphrases of the keys
+            that were found. Missing keys are not included.
+        """
+        keys = list(dict.fromkeys(keys))
+        found: Dict[str, List[str]] = {}
+        chunk_size = 500  # stay below SQLite's host parameter limit
+        for i in range(0, len(keys), chunk_size):
+            chunk = keys[i:i+chunk_size]
+            rows = self._conn.execute(
+                "SELECT key, value FROM paraphrases WHERE key IN "
+                f"({', '.join('?' * len(chunk))})",
+                chunk
+            )
+            found.update((key, json.loads(value)) for key, value in rows)
+        if found:
+            now = self._tick()
+            self._conn.executemany(
+                "UPDATE paraphrases SET last_used = ? WHERE key = ?",
+                [(now, key) for key in found]
+            )
+            self._conn.commit()
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items: Mapping[str, List[str]]):
+        """Store several paraphrase lists at once, evicting if needed.
+
+        Args:
+            items (:obj:`Mapping[str, List[str]]`):
+                The paraphrases to store, keyed as returned by
+                :func:`cache_key`.
+        """
+        now = self._tick()
+        rows: List[Tuple[str, str, int, int]] = []
+        for key, paraphrases in items.items():
+            value = json.dumps(paraphrases, ensure_ascii=False)
+            rows.append((key, value, len(value.encode("utf-8")), now))
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO paraphrases (key, value, size, last_used)"
+            " VALUES (?, ?, ?, ?)",
+            rows
+        )
+        self._conn.commit()
+        self.evict()
+
+    def evict(self) -> int:
+        """Evict the least recently used entries until within :attr:`max_size`.
+
+        Returns:
+            :obj:`int`: The number of evicted entries.
+        """
+        excess = self.size - self.max_size
+        if excess <= 0:
+            return 0
+        evicted = 0
+        rows = self._conn.execute(
+            "SELECT key, size FROM paraphrases ORDER BY last_used"
+        ).fetchall()
+        to_delete: List[Tuple[str]] = []
+        for key, size in rows:
+            if excess <= 0:
+                break
+            to_delete.append((key,))
+            excess -= size
+            evicted += 1
+        self._conn.executemany("DELETE FROM paraphrases WHERE key = ?",
+                               to_delete)
+        self._conn.commit()
+        return evicted
+
+    def stats(self) -> str:
+        """Summarize the cache usage.
+
+        Returns:
+            :obj:`str`: A human-readable summary of hits, misses and size.
+        """
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0.
+        return (f"{self.hits} hits, {self.misses} misses "
+                f"({hit_rate:.1%} hit rate), {len(self)} entries, "
+                f"{self.size / 1024**2:.1f} MiB")
+
+    def close(self):
+        """Close the underlying database connection."""
+        self._conn.close()
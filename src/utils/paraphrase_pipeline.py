@@ -0,0 +1,304 @@
+"""Pipelined paraphrase generation.
+
+:meth:`paraphrasis.PegasusParaphraser.paraphrase_batch` tokenizes, generates
+and decodes every batch strictly in sequence, so the CPU-bound tokenization
+and decoding add up to the generation time. :class:`PipelinedParaphraser`
+runs each of these steps in its own thread instead, connected by bounded
+queues: while batch ``k`` is being generated, batch ``k+1`` is tokenized and
+batch ``k-1`` decoded. The tokenizer and torch release the GIL for most of
+their work, so the steps actually overlap.
+
+The queues are bounded, so a fast step blocks as soon as it gets too far
+ahead of the next one (backpressure), and every step handles the batches in
+order, so the results come out in order as well. For every step, the time
+spent working, waiting for input (starved) and waiting for room in the next
+queue (blocked) is recorded: the step that is busy most of the time is the
+bottleneck.
+"""
+
+import queue
+import threading
+import time
+from typing import (Any, Callable, Dict, Iterable, Iterator, List, Optional,
+                    Protocol, Sequence, Tuple)
+
+from batching import token_budget_batches
+
+QUEUE_SIZE: int = 2  # batches
+
+# Marks the end of the input of a step.
+_DONE = object()
+
+
+class SplitParaphraser(Protocol):
+    """A paraphraser with separate tokenize, generate and decode steps.
+
+    See :class:`paraphrasis.PegasusParaphraser`.
+    """
+
+    def token_lengths(self, sentences: List[str]) -> List[int]:
+        ...
+
+    def encode(self, sentences: List[str]) -> Any:
+        ...
+
+    def generate(
+        self,
+        batch: Any,
+        num_return_sentences: int = 1,
+        num_beams: int = 4
+    ) -> Any:
+        ...
+
+    def decode(
+        self,
+        generated: Any,
+        num_return_sentences: int = 1
+    ) -> List[List[str]]:
+        ...
+
+
+class StageMetrics:
+    """Where the time of a pipeline step goes.
+
+    Attributes:
+        name (:obj:`str`):
+            The name of the step.
+        items (:obj:`int`):
+            The number of items processed.
+        busy (:obj:`float`):
+            The seconds spent processing items.
+        starved (:obj:`float`):
+            The seconds spent waiting for the previous step.
+        blocked (:obj:`float`):
+            The seconds spent waiting for the next step to make room.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.busy = 0.
+        self.starved = 0.
+        self.blocked = 0.
+
+    def occupancy(self) -> float:
+        """Compute the fraction of the time the step was busy.
+
+        Returns:
+            :obj:`float`: The busy time over the total time of the step.
+        """
+        total = self.busy + self.starved + self.blocked
+        return self.busy / total if total else 0.
+
+
+class _Failure:
+    """An exception raised by a step, passed down to the consumer."""
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def _put(out: queue.Queue, item: Any, stop: threading.Event) -> bool:
+    """Put an item in a queue, unless the pipeline is stopped."""
+    while not stop.is_set():
+        try:
+            out.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _get(source: queue.Queue, stop: threading.Event) -> Any:
+    """Get an item from a queue, unless the pipeline is stopped."""
+    while not stop.is_set():
+        try:
+            return source.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return _DONE
+
+
+def _run_step(
+    function: Callable[[Any], Any],
+    source: queue.Queue,
+    out: queue.Queue,
+    metrics: StageMetrics,
+    stop: threading.Event
+):
+    """Apply a step to every item of a queue, in order."""
+    while True:
+        start = time.perf_counter()
+        item = _get(source, stop)
+        metrics.starved += time.perf_counter() - start
+        if item is _DONE or isinstance(item, _Failure):
+            _put(out, item, stop)
+            return
+        start = time.perf_counter()
+        try:
+            result = function(item)
+        except BaseException as e:
+            _put(out, _Failure(e), stop)
+            return
+        metrics.busy += time.perf_counter() - start
+        metrics.items += 1
+        start = time.perf_counter()
+        if not _put(out, result, stop):
+            return
+        metrics.blocked += time.perf_counter() - start
+
+
+def run_pipeline(
+    items: Iterable[Any],
+    steps: Sequence[Tuple[str, Callable[[Any], Any]]],
+    queue_size: int = QUEUE_SIZE,
+    metrics: Optional[Dict[str, StageMetrics]] = None
+) -> Iterator[Any]:
+    """Pass items through a sequence of steps, each in its own thread.
+
+    Args:
+        items (:obj:`Iterable[Any]`):
+            The input items.
+        steps (:obj:`Sequence[Tuple[str, Callable[[Any], Any]]]`):
+            The name and the function of every step. Each function receives
+            the output of the previous one.
+        queue_size (:obj:`int`, defaults to ``2``):
+            The maximum number of items waiting between two steps.
+        metrics (:obj:`Dict[str, StageMetrics]`, `optional`):
+            If given, the metrics of every step are added to it, by name.
+
+    Yields:
+        :obj:`Any`: The output of the last step for every item, in order.
+
+    Raises:
+        :obj:`BaseException`: Whatever any of the steps raises.
+    """
+    metrics = {} if metrics is None else metrics
+    stop = threading.Event()
+    queues = [queue.Queue(queue_size) for _ in range(len(steps) + 1)]
+    threads = [
+        threading.Thread(
+            target=_run_step,
+            args=(function, queues[i], queues[i + 1],
+                  metrics.setdefault(name, StageMetrics(name)), stop),
+            name=f"pipeline-{name}",
+            daemon=True
+        )
+        for i, (name, function) in enumerate(steps)
+    ]
+
+    def feed():
+        try:
+            for item in items:
+                if not _put(queues[0], item, stop):
+                    return
+        except BaseException as e:
+            _put(queues[0], _Failure(e), stop)
+            return
+        _put(queues[0], _DONE, stop)
+
+    threads.append(threading.Thread(target=feed, name="pipeline-feed",
+                                    daemon=True))
+    for thread in threads:
+        thread.start()
+    try:
+        while True:
+            item = queues[-1].get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        # Also unblocks the steps if the consumer stops early.
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+
+class PipelinedParaphraser:
+    """Paraphraser front-end that overlaps tokenization, generation and
+    decoding.
+
+    Like :class:`batching.TokenBudgetScheduler`, it groups sentences of
+    similar length into batches under a token budget, and exposes the same
+    :meth:`paraphrase_batch` interface as the paraphraser it wraps. Since the
+    batches are formed before any of them is generated, the budget is fixed.
+
+    Attributes:
+        paraphraser (:obj:`SplitParaphraser`):
+            The underlying paraphraser.
+        max_tokens (:obj:`int`):
+            The token budget per batch.
+        max_batch_size (:obj:`Optional[int]`):
+            The maximum number of sentences per batch, if any.
+        queue_size (:obj:`int`):
+            The maximum number of batches waiting between two steps.
+        metrics (:obj:`Dict[str, StageMetrics]`):
+            The metrics of every step, added up over all calls.
+    """
+
+    def __init__(
+        self,
+        paraphraser: SplitParaphraser,
+        max_tokens: int = 1024,
+        max_batch_size: Optional[int] = None,
+        queue_size: int = QUEUE_SIZE
+    ):
+        self.paraphraser = paraphraser
+        self.max_tokens = max_tokens
+        self.max_batch_size = max_batch_size
+        self.queue_size = queue_size
+        self.metrics: Dict[str, StageMetrics] = {}
+
+    def paraphrase_batch(
+        self,
+        sentences: List[str],
+        num_return_sentences: int = 1,
+        num_beams: int = 4
+    ) -> List[List[str]]:
+        """Paraphrase sentences in pipelined, token-budgeted batches.
+
+        See :meth:`paraphrasis.PegasusParaphraser.paraphrase_batch`.
+
+        Returns:
+            :obj:`List[List[str]]`: The paraphrased sentences, in the same
+            order as :paramref:`sentences`.
+        """
+        if not sentences:
+            return []
+        num_return_sentences = max(num_return_sentences, 1)
+        paraphraser = self.paraphraser
+        batches = token_budget_batches(paraphraser.token_lengths(sentences),
+                                       self.max_tokens, self.max_batch_size)
+        steps = [
+            ("tokenize", lambda batch: (
+                batch, paraphraser.encode([sentences[i] for i in batch]))),
+            ("generate", lambda encoded: (
+                encoded[0], paraphraser.generate(encoded[1],
+                                                 num_return_sentences,
+                                                 num_beams))),
+            ("decode", lambda generated: (
+                generated[0], [[paraphrase.strip() for paraphrase in group]
+                               for group in paraphraser.decode(
+                                   generated[1], num_return_sentences)])),
+        ]
+        results: List[Optional[List[str]]] = [None] * len(sentences)
+        for batch, paraphrased in run_pipeline(batches, steps,
+                                               self.queue_size, self.metrics):
+            for i, paraphrases in zip(batch, paraphrased):
+                results[i] = paraphrases
+        return results
+
+    def report(self) -> str:
+        """Summarize where the time of every step went.
+
+        Returns:
+            :obj:`str`: A human-readable, one-line-per-step report.
+        """
+        return "\n".join(
+            f"   {m.name}: {m.items} batches, {m.occupancy():.0%} busy "
+            f"({m.busy:.2f}s), {m.starved:.2f}s starved, "
+            f"{m.blocked:.2f}s blocked"
+            for m in self.metrics.values()
+        )
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+"""Multi-process paraphrase generation.
+
+A single ``model.generate`` call does not keep all the cores of a CPU-only
+machine busy. :class:`ParaphraserPool` starts several worker processes
+instead, each with its own copy of the model and a fixed number of torch
+threads, splits every batch of sentences into contiguous shards, one per
+worker, and merges the results back in the input order.
+
+When run as a script, it measures the throughput of the pool for several
+worker/thread splits of the available cores on a file with one sentence per
+line, e.g.::
+
+   ./paraphrase_pool.py sentences.txt -w 1 2 4 8
+"""
+
+import os
+import sys
+import time
+import argparse
+import multiprocessing as mp
+from typing import List, Optional, Tuple
+
+import paraphrase_pool
+from paraphrasis import PegasusParaphraser, MODEL_NAME
+from batching import TokenBudgetScheduler
+
+# The paraphraser of the current worker process.
+_worker_paraphraser: Optional[TokenBudgetScheduler] = None
+
+
+def _init_worker(model_name: str, precision: str, num_threads: int,
+                 max_tokens: int, auto_tune: bool,
+                 token_corpus: Optional[str]):
+    """Load the model of a worker process."""
+    import torch
+
+    global _worker_paraphraser
+    torch.set_num_threads(num_threads)
+    _worker_paraphraser = TokenBudgetScheduler(
+        PegasusParaphraser(model_name=model_name, precision=precision,
+                           token_corpus=token_corpus),
+        max_tokens=max_tokens,
+        auto_tune=auto_tune
+    )
+
+
+def _paraphrase_shard(
+    task: Tuple[List[str], int, int]
+) -> List[List[str]]:
+    """Paraphrase a shard of sentences in a worker process."""
+    sentences, num_return_sentences, num_beams = task
+    return _worker_paraphraser.paraphrase_batch(
+        sentences,
+        num_return_sentences=num_return_sentences,
+        num_beams=num_beams
+    )
+
+
+def default_num_threads(num_workers: int) -> int:
+    """Split the available cores evenly among the workers.
+
+    Args:
+        num_workers (:obj:`int`):
+            The number of worker processes.
+
+    Returns:
+        :obj:`int`: The number of torch threads per worker.
+    """
+    return max((os.cpu_count() or 1) // num_workers, 1)
+
+
+class ParaphraserPool:
+    """Pool of worker processes, each holding its own Pegasus model.
+
+    Within each worker, sentences are batched by
+    :class:`batching.TokenBudgetScheduler`.
+
+    Attributes:
+        num_workers (:obj:`int`):
+            The number of worker processes.
+        num_threads (:obj:`int`):
+            The number of torch threads of each worker.
+    """
+
+    def __init__(
+        self,
+        num_workers: int,
+        num_threads: Optional[int] = None,
+        model_name: str = MODEL_NAME,
+        precision: str = "fp32",
+        max_tokens: int = 1024,
+        auto_tune: bool = False,
+        token_corpus: Optional[str] = None
+    ):
+        self.num_workers = num_workers
+        self.num_threads = num_threads or default_num_threads(num_workers)
+        # Forking a process that has already initialized torch is unsafe.
+        self._pool = mp.get_context("spawn").Pool(
+            num_workers,
+            initializer=_init_worker,
+            initargs=(model_name, precision, self.num_threads, max_tokens,
+                      auto_tune, token_corpus)
+        )
+
+    def __enter__(self) -> "ParaphraserPool":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def paraphrase_batch(
+        self,
+        sentences: List[str],
+        num_return_sentences: int = 1,
+        num_beams: int = 4
+    ) -> List[List[str]]:
+        """Paraphrase a batch of sentences across all workers.
+
+        See :meth:`paraphrasis.PegasusParaphraser.paraphrase_batch`.
+
+        Returns:
+            :obj:`List[List[str]]`: The paraphrased sentences, in the same
+            order as :paramref:`sentences`.
+        """
+        shard_size = -(-len(sentences) // self.num_workers)  # ceil
+        if not shard_size:
+            return []
+        shards = [
+            (sentences[i:i+shard_size], num_return_sentences, num_beams)
+            for i in range(0, len(sentences), shard_size)
+        ]
+        return [paraphrases
+                for shard in self._pool.map(_paraphrase_shard, shards)
+                for paraphrases in shard]
+
+    def close(self):
+        """Shut the worker processes down."""
+        self._pool.close()
+        self._pool.join()
+
+
+arg_parser = argparse.ArgumentParser(
+    formatter_class=argparse.RawTextHelpFormatter,
+    description=(paraphrase_pool.__doc__)
+)
+arg_parser.add_argument("sentences", type=argparse.FileType("r"),
+                        help="file with one sentence per line")
+arg_parser.add_argument("-w", "--workers", type=int, nargs="+",
+                        default=[1, 2, 4],
+                        help="numbers of workers to measure. The cores are "
+                             "split evenly\namong them. Defaults to 1 2 4.")
+arg_parser.add_argument("-l", "--limit", type=int, default=256,
+                        help="number of sentences to paraphrase. Defaults to "
+                             "256.")
+
+
+def main(args: argparse.ArgumentParser):
+    """Measure the speedup of the pool for several worker/thread splits."""
+    sentences = [line.strip() for line in args.sentences if line.strip()]
+    sentences = sentences[:args.limit]
+    baseline = None
+    print("workers\tthreads\tsents/s\tspeedup")
+    for num_workers in args.workers:
+        with ParaphraserPool(num_workers) as pool:
+            pool.paraphrase_batch(sentences[:num_workers])  # warm-up
+            start = time.perf_counter()
+            pool.paraphrase_batch(sentences)
+            throughput = len(sentences) / (time.perf_counter() - start)
+        baseline = baseline or throughput
+        print(f"{num_workers}\t{pool.num_threads}\t{throughput:.2f}\t"
+              f"{throughput / baseline:.2f}x")
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main(arg_parser.parse_args())
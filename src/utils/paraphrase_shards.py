@@ -0,0 +1,139 @@
+"""Checkpointing of the paraphrase stage.
+
+Every finished chunk of paraphrased samples is written to its own shard file
+as soon as it is generated, and recorded in a manifest. If the run is
+interrupted, it can be resumed by skipping the chunks that are already in the
+manifest. Both the shards and the manifest are written to a temporary file
+first and then atomically renamed, so a crash never leaves a truncated file
+behind.
+
+Each chunk is recorded together with its content address (see
+:func:`paraphrase_cache.cache_key`), so a chunk whose sentences or generation
+settings have changed since the checkpoint was written is generated again.
+"""
+
+import os
+import json
+import shutil
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Union
+
+from dedup import Sample, format_sample, parse_line
+from paraphrase_cache import cache_key
+
+SHARDS_DIR: str = "paraphrase-shards"
+MANIFEST_NAME: str = "manifest.json"
+
+
+def _write_atomically(path: Path, content: str):
+    """Write a file durably, replacing it in a single step."""
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def chunk_key(chunk: List[str], **settings: Any) -> str:
+    """Compute the content address of a chunk of sentences.
+
+    Args:
+        chunk (:obj:`List[str]`):
+            The sentences to paraphrase.
+        **settings (:obj:`Any`):
+            The generation settings. See
+            :func:`paraphrasis.generation_settings`.
+
+    Returns:
+        :obj:`str`: The hex digest of the chunk.
+    """
+    return cache_key("\n".join(chunk), **settings)
+
+
+class ParaphraseCheckpoint:
+    """Directory of paraphrase shards with a progress manifest.
+
+    Attributes:
+        path (:obj:`pathlib.Path`):
+            The directory the shards and the manifest are written to.
+    """
+
+    def __init__(self, path: Union[str, Path], resume: bool = False):
+        """Open a checkpoint directory.
+
+        Args:
+            path (:obj:`Union[str, pathlib.Path]`):
+                The directory the shards and the manifest are written to.
+            resume (:obj:`bool`, defaults to :obj:`False`):
+                Whether to keep the chunks completed by a previous run. If
+                :obj:`False`, any existing shards are removed.
+        """
+        self.path = Path(path)
+        if not resume and self.path.exists():
+            shutil.rmtree(self.path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._completed: Dict[str, str] = {}
+        manifest = self.path / MANIFEST_NAME
+        if manifest.exists():
+            with open(manifest, encoding="utf-8") as f:
+                self._completed = json.load(f)["completed"]
+
+    def __len__(self) -> int:
+        return len(self._completed)
+
+    def _shard_path(self, index: int) -> Path:
+        return self.path / f"shard-{index:05d}.tsv"
+
+    def is_complete(self, index: int, key: str) -> bool:
+        """Determine whether a chunk has already been written.
+
+        Args:
+            index (:obj:`int`):
+                The position of the chunk.
+            key (:obj:`str`):
+                The content address of the chunk, as returned by
+                :func:`chunk_key`.
+
+        Returns:
+            :obj:`bool`: Whether the shard of the chunk exists and was
+            generated from the same sentences and settings.
+        """
+        return (self._completed.get(str(index)) == key
+                and self._shard_path(index).exists())
+
+    def write(self, index: int, key: str, samples: Iterable[Sample]):
+        """Durably write the samples of a chunk and mark it as complete.
+
+        Args:
+            index (:obj:`int`):
+                The position of the chunk.
+            key (:obj:`str`):
+                The content address of the chunk, as returned by
+                :func:`chunk_key`.
+            samples (:obj:`Iterable[Sample]`):
+                The paraphrased samples of the chunk.
+        """
+        _write_atomically(self._shard_path(index),
+                          "".join(map(format_sample, samples)))
+        self._completed[str(index)] = key
+        _write_atomically(self.path / MANIFEST_NAME,
+                          json.dumps({"completed": self._completed}, indent=2))
+
+    def samples(self, num_chunks: int) -> Iterator[Sample]:
+        """Stream the samples of the first chunks, in order.
+
+        Args:
+            num_chunks (:obj:`int`):
+                The number of chunks to read.
+
+        Returns:
+            :obj:`Iterator[Sample]`: The paraphrased samples.
+        """
+        for index in range(num_chunks):
+            with open(self._shard_path(index), encoding="utf-8") as f:
+                yield from (parse_line(line) for line in f if line.strip())
+
+    def remove(self):
+        """Delete the shards and the manifest."""
+        shutil.rmtree(self.path)
@@ -1,8 +1,66 @@
-"""Paraphrasis utilities."""
+"""Paraphrasis utilities.
 
-from typing import List
-import torch
-from transformers import PegasusForConditionalGeneration, PegasusTokenizer
+torch and transformers take seconds to import, so they are only imported when
+a model is actually loaded. Everything else, e.g. :func:`generation_settings`
+or :class:`CachedParaphraser`, can be used without them.
+"""
+
+from pathlib import Path
+from typing import (TYPE_CHECKING, Any, Callable, Dict, List, Optional,
+                    Sequence, Tuple, Union)
+from paraphrase_cache import ParaphraseCache, cache_key
+from batching import Paraphraser
+from token_corpus import TokenCorpus
+
+if TYPE_CHECKING:
+    import torch
+    from transformers import BatchEncoding, PreTrainedTokenizerBase
+
+MODEL_NAME: str = "tuner007/pegasus_paraphrase"
+MAX_LENGTH: int = 60
+TEMPERATURE: float = 1.5
+PRECISIONS: Tuple[str, ...] = ("fp32", "int8", "bf16")
+
+
+def bf16_supported(device: str) -> bool:
+    """Determine whether bf16 inference is natively supported.
+
+    Args:
+        device (:obj:`str`):
+            The torch device, i.e., ``"cpu"`` or ``"cuda"``.
+
+    Returns:
+        :obj:`bool`: Whether the device supports bf16 arithmetic.
+    """
+    import torch
+
+    if device == "cuda":
+        return torch.cuda.is_bf16_supported()
+    try:
+        return torch.ops.mkldnn._is_mkldnn_bf16_supported()
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def load_tokenizer(model_name: str = MODEL_NAME) -> "PreTrainedTokenizerBase":
+    """Load the tokenizer of a model, preferably the fast (Rust) one.
+
+    Args:
+        model_name (:obj:`str`, `optional`, defaults to ``MODEL_NAME``):
+            The name of the pre-trained model.
+
+    Returns:
+        :obj:`PreTrainedTokenizerBase`: The ``PegasusTokenizerFast``, or the
+        slow ``PegasusTokenizer`` if the ``tokenizers`` library is not
+        installed.
+    """
+    from transformers import PegasusTokenizer
+
+    try:
+        from transformers import PegasusTokenizerFast
+        return PegasusTokenizerFast.from_pretrained(model_name)
+    except (ImportError, ValueError):
+        return PegasusTokenizer.from_pretrained(model_name)
 
 
 class PegasusParaphraser:
@@ -11,18 +69,94 @@ class PegasusParaphraser:
     See `https://huggingface.co/tuner007/pegasus_paraphrase`__.
 
     Attributes:
-        tokenizer (:obj:`PegasusTokenizer`):
-            The Pegasus tokenizer.
+        model_name (:obj:`str`):
+            The name of the pre-trained model.
+        precision (:obj:`str`):
+            The inference precision, one of ``PRECISIONS``: ``"fp32"`` for the
+            full-precision model, ``"int8"`` for dynamic int8 quantization of
+            the linear layers (CPU only), or ``"bf16"`` for bfloat16 weights
+            and activations.
+        tokenizer (:obj:`PreTrainedTokenizerBase`):
+            The Pegasus tokenizer. See :func:`load_tokenizer`.
         model (:obj:`PegasusForConditionalGeneration`):
             The Pegasus model.
+        token_corpus (:obj:`Optional[str]`):
+            The directory of pre-tokenized sentences, if any. See
+            :mod:`token_corpus`.
     """
 
-    def __init__(self):
-        model_name = "tuner007/pegasus_paraphrase"
+    def __init__(
+        self,
+        model_name: str = MODEL_NAME,
+        precision: str = "fp32",
+        token_corpus: Optional[Union[str, Path]] = None
+    ):
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision '{precision}'. Expected one "
+                             f"of {', '.join(PRECISIONS)}.")
+        import torch
+        from transformers import PegasusForConditionalGeneration
+
+        self.model_name = model_name
+        self.precision = precision
         self._torch_device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        self.tokenizer = PegasusTokenizer.from_pretrained(model_name)
+        if precision == "int8":
+            # Dynamically quantized modules only run on the CPU.
+            self._torch_device = 'cpu'
+        if precision == "bf16" and not bf16_supported(self._torch_device):
+            raise ValueError("bf16 is not supported on this device "
+                             f"({self._torch_device}).")
+        self.tokenizer = load_tokenizer(model_name)
+        self.token_corpus = token_corpus
+        self._token_corpus: Optional[TokenCorpus] = None
         self.model = PegasusForConditionalGeneration.from_pretrained(
         model_name).to(self._torch_device)
+        self.model.eval()
+        if precision == "int8":
+            self.model = torch.quantization.quantize_dynamic(
+                self.model, {torch.nn.Linear}, dtype=torch.qint8)
+        elif precision == "bf16":
+            self.model = self.model.to(torch.bfloat16)
+
+    def _corpus(self) -> Optional[TokenCorpus]:
+        """Open the token corpus, once it has been written."""
+        if self._token_corpus is None and self.token_corpus:
+            self._token_corpus = TokenCorpus.open(self.token_corpus,
+                                                  self.tokenizer, MAX_LENGTH)
+        return self._token_corpus
+
+    def token_ids(self, sentences: List[str]) -> Optional[List[Sequence[int]]]:
+        """Look up the pre-tokenized ids of sentences.
+
+        Args:
+            sentences (:obj:`List[str]`):
+                The sentences.
+
+        Returns:
+            :obj:`Optional[List[Sequence[int]]]`: The token ids of every
+            sentence, or :obj:`None` if there is no token corpus or any of
+            the sentences is not in it.
+        """
+        corpus = self._corpus()
+        return corpus.lookup(sentences) if corpus is not None else None
+
+    def token_lengths(self, sentences: List[str]) -> List[int]:
+        """Count the tokens the model will see for each sentence.
+
+        Args:
+            sentences (:obj:`List[str]`):
+                The sentences to tokenize.
+
+        Returns:
+            :obj:`List[int]`: The number of tokens of each sentence, after
+            truncation to ``MAX_LENGTH``.
+        """
+        ids = self.token_ids(sentences)
+        if ids is not None:
+            return [len(sentence_ids) for sentence_ids in ids]
+        encoded = self.tokenizer(sentences, truncation=True,
+                                 max_length=MAX_LENGTH)
+        return [len(input_ids) for input_ids in encoded["input_ids"]]
 
     def paraphrase(
         self,
@@ -44,27 +178,29 @@ class PegasusParaphraser:
         Returns:
             :obj:`List[str]`: The paraphrased sentences.
         """
+        import torch
+
         batch = self.tokenizer(
             [sentence],
             truncation=True,
             padding='longest',
-            max_length=60,
+            max_length=MAX_LENGTH,
             return_tensors="pt"
         ).to(self._torch_device)
-        paraphrased = self.model.generate(
-            **batch,
-            max_length=60,
-            num_beams=num_beams,
-            num_return_sequences=num_return_sentences,
-            temperature=1.5
-        )
+        with torch.inference_mode():
+            paraphrased = self.model.generate(
+                **batch,
+                max_length=MAX_LENGTH,
+                num_beams=num_beams,
+                num_return_sequences=num_return_sentences,
+                temperature=TEMPERATURE
+            )
         paraphrased_sents = self.tokenizer.batch_decode(
             paraphrased,
             skip_special_tokens=True
         )
         return paraphrased_sents
 
-
     def paraphrase_batch(
         self,
         sentences: List[str],
@@ -88,23 +224,233 @@ class PegasusParaphraser:
         """
         if num_return_sentences < 1:
             num_return_sentences = 1
-        batch = self.tokenizer(
+        return self.decode(
+            self.generate(self.encode(sentences), num_return_sentences,
+                          num_beams),
+            num_return_sentences
+        )
+
+    def paraphrase_batch_ids(
+        self,
+        ids: List[Sequence[int]],
+        num_return_sentences: int = 1,
+        num_beams: int = 4
+    ) -> List[List[str]]:
+        """Paraphrase a batch of pre-tokenized sentences.
+
+        Args:
+            ids (:obj:`List[Sequence[int]]`):
+                The token ids of every sentence, truncated to ``MAX_LENGTH``,
+                e.g., from a :class:`token_corpus.TokenCorpus`.
+            num_return_sentences (:obj:`int`, `optional`, defaults to ``1``):
+                The number of paraphrased versions to return per sentence.
+            num_beams (:obj:`int`, `optional`, defaults to ``4``):
+                The number of beams to use for generation.
+
+        Returns:
+            :obj:`List[List[str]]`: The paraphrased versions of each sentence,
+            grouped in lists of length :param:`num_return_sentences`.
+        """
+        num_return_sentences = max(num_return_sentences, 1)
+        return self.decode(
+            self.generate(self.encode_ids(ids), num_return_sentences,
+                          num_beams),
+            num_return_sentences
+        )
+
+    def encode(self, sentences: List[str]) -> "BatchEncoding":
+        """Tokenize a batch of sentences.
+
+        This is the first step of :meth:`paraphrase_batch`, split out so that
+        it can overlap with the generation of another batch. Sentences in the
+        token corpus are not tokenized again.
+
+        Args:
+            sentences (:obj:`List[str]`):
+                The sentences to tokenize.
+
+        Returns:
+            :obj:`BatchEncoding`: The padded batch, on the CPU.
+        """
+        ids = self.token_ids(sentences)
+        if ids is not None:
+            return self.encode_ids(ids)
+        return self.tokenizer(
             sentences,
             truncation=True,
             padding='longest',
-            max_length=60,
+            max_length=MAX_LENGTH,
             return_tensors="pt"
-        ).to(self._torch_device)
-        paraphrased = self.model.generate(
-            **batch,
-            max_length=60,
-            num_beams=num_beams,
-            num_return_sequences=num_return_sentences,
-            temperature=1.5
         )
+
+    def encode_ids(self, ids: List[Sequence[int]]) -> "BatchEncoding":
+        """Pad a batch of pre-tokenized sentences.
+
+        Args:
+            ids (:obj:`List[Sequence[int]]`):
+                The token ids of every sentence.
+
+        Returns:
+            :obj:`BatchEncoding`: The padded batch, on the CPU.
+        """
+        return self.tokenizer.pad(
+            {"input_ids": [list(map(int, sentence_ids))
+                           for sentence_ids in ids]},
+            padding='longest',
+            return_tensors="pt"
+        )
+
+    def generate(
+        self,
+        batch: "BatchEncoding",
+        num_return_sentences: int = 1,
+        num_beams: int = 4
+    ) -> "torch.Tensor":
+        """Generate the paraphrases of a tokenized batch.
+
+        Args:
+            batch (:obj:`BatchEncoding`):
+                The batch, as returned by :meth:`encode`.
+            num_return_sentences (:obj:`int`, `optional`, defaults to ``1``):
+                The number of paraphrased versions to return per sentence.
+            num_beams (:obj:`int`, `optional`, defaults to ``4``):
+                The number of beams to use for generation.
+
+        Returns:
+            :obj:`torch.Tensor`: The generated token ids.
+        """
+        import torch
+
+        with torch.inference_mode():
+            return self.model.generate(
+                **batch.to(self._torch_device),
+                max_length=MAX_LENGTH,
+                num_beams=num_beams,
+                num_return_sequences=num_return_sentences,
+                temperature=TEMPERATURE
+            )
+
+    def decode(
+        self,
+        generated: "torch.Tensor",
+        num_return_sentences: int = 1
+    ) -> List[List[str]]:
+        """Decode generated paraphrases.
+
+        Args:
+            generated (:obj:`torch.Tensor`):
+                The token ids, as returned by :meth:`generate`.
+            num_return_sentences (:obj:`int`, `optional`, defaults to ``1``):
+                The number of paraphrased versions per sentence.
+
+        Returns:
+            :obj:`List[List[str]]`: The paraphrased versions of each sentence,
+            grouped in lists of length :param:`num_return_sentences`.
+        """
         paraphrased_sents = self.tokenizer.batch_decode(
-            paraphrased,
+            generated,
             skip_special_tokens=True
         )
         return [paraphrased_sents[i:i+num_return_sentences]
                 for i in range(0, len(paraphrased_sents), num_return_sentences)]
+
+
+def generation_settings(
+    model_name: str = MODEL_NAME,
+    num_return_sentences: int = 1,
+    num_beams: int = 4,
+    precision: str = "fp32"
+) -> Dict[str, Any]:
+    """Collect every setting that influences the generated paraphrases.
+
+    Args:
+        model_name (:obj:`str`, `optional`, defaults to ``MODEL_NAME``):
+            The name of the pre-trained model.
+        num_return_sentences (:obj:`int`, `optional`, defaults to ``1``):
+            The number of paraphrased versions to return per sentence.
+        num_beams (:obj:`int`, `optional`, defaults to ``4``):
+            The number of beams to use for generation.
+        precision (:obj:`str`, `optional`, defaults to ``"fp32"``):
+            The inference precision. See :class:`PegasusParaphraser`.
+
+    Returns:
+        :obj:`Dict[str, Any]`: The generation settings.
+    """
+    return {
+        "model_name": model_name,
+        "precision": precision,
+        "num_return_sentences": max(num_return_sentences, 1),
+        "num_beams": num_beams,
+        "max_length": MAX_LENGTH,
+        "temperature": TEMPERATURE,
+    }
+
+
+class CachedParaphraser:
+    """Paraphraser that only sends cache misses to the model.
+
+    The underlying paraphraser is not instantiated until the first cache miss,
+    so a fully cached run never loads the model.
+
+    Attributes:
+        cache (:obj:`ParaphraseCache`):
+            The persistent paraphrase cache.
+        model_name (:obj:`str`):
+            The name of the pre-trained model.
+        precision (:obj:`str`):
+            The inference precision. See :class:`PegasusParaphraser`.
+    """
+
+    def __init__(
+        self,
+        cache: ParaphraseCache,
+        model_name: str = MODEL_NAME,
+        paraphraser_factory: Optional[Callable[[], Paraphraser]] = None,
+        precision: str = "fp32"
+    ):
+        self.cache = cache
+        self.model_name = model_name
+        self.precision = precision
+        self._paraphraser_factory = (
+            paraphraser_factory
+            or (lambda: PegasusParaphraser(model_name=model_name,
+                                           precision=precision))
+        )
+        self._paraphraser: Optional[Paraphraser] = None
+
+    @property
+    def paraphraser(self) -> Paraphraser:
+        """:obj:`Paraphraser`: The underlying (lazily loaded) paraphraser."""
+        if self._paraphraser is None:
+            self._paraphraser = self._paraphraser_factory()
+        return self._paraphraser
+
+    def paraphrase_batch(
+        self,
+        sentences: List[str],
+        num_return_sentences: int = 1,
+        num_beams: int = 4
+    ) -> List[List[str]]:
+        """Paraphrase a batch of sentences, reusing cached results.
+
+        See :meth:`PegasusParaphraser.paraphrase_batch`.
+        """
+        settings = generation_settings(self.model_name, num_return_sentences,
+                                       num_beams, self.precision)
+        keys = [cache_key(sentence, **settings) for sentence in sentences]
+        cached = self.cache.get_many(keys)
+        missing = list(dict.fromkeys(
+            sentence for sentence, key in zip(sentences, keys)
+            if key not in cached
+        ))
+        if missing:
+            generated = self.paraphraser.paraphrase_batch(
+                missing,
+                num_return_sentences=num_return_sentences,
+                num_beams=num_beams
+            )
+            new_entries = {cache_key(sentence, **settings): paraphrases
+                           for sentence, paraphrases in zip(missing, generated)}
+            self.cache.put_many(new_entries)
+            cached.update(new_entries)
+        return [cached[key] for key in keys]
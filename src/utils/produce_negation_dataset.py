@@ -17,7 +17,10 @@ The input datasets must be ``.tsv`` files with two columns as follows::
    Second sentence.\tSecond sentence negated.
    ...
 
-Note that the first line is the header.
+Note that the first line is the header. Glob patterns, e.g.,
+``processed/wikifactcheck_english_*.tsv``, can be given instead of single
+files, and are expanded with the shards in order. The shards of a dataset
+count as a single source.
 
 The output dataset will also be a ``.tsv`` with three columns, ``premise``,
 ``hypothesis``, and ``label``, e.g.::
@@ -33,23 +36,76 @@ Again, the first line is the header.
 import sys
 import argparse
 from pathlib import Path
-from typing import List
+from typing import List, Union
 import numpy as np
 from tqdm import tqdm
 import produce_negation_dataset
-from paraphrasis import PegasusParaphraser
+from paraphrasis import (CachedParaphraser, PegasusParaphraser, MAX_LENGTH,
+                         MODEL_NAME, PRECISIONS, generation_settings,
+                         load_tokenizer)
+from batching import TokenBudgetScheduler
+from paraphrase_pipeline import PipelinedParaphraser
+from warmup import BackgroundLoader
+from inference_client import DEFAULT_ADDRESS, InferenceClient
+from paraphrase_pool import ParaphraserPool
+from paraphrase_shards import ParaphraseCheckpoint, SHARDS_DIR, chunk_key
+from paraphrase_cache import (ParaphraseCache, DEFAULT_CACHE_PATH,
+                              DEFAULT_MAX_SIZE)
+from dedup import SampleDeduplicator, format_sample, parse_line
+from shuffle import shuffle_lines, CHUNK_SIZE as SHUFFLE_CHUNK_SIZE
+from near_duplicates import NearDuplicateDetector, cross_source_counts
+from packed_corpus import PackedCorpusWriter, PACKED_SUFFIX
+from profiling import Profiler, PROFILE_SUFFIX
+from sharding import expand_shards, shard_sort_key
+from work_queue import WorkQueue, LEASE_SECONDS
+from token_corpus import TokenCorpus
 
 DEFAULT_OUTPUT_DIR: str = "negation-dataset"
 OUTPUT_NAME: str = "negation_dataset"
 NON_NEGATED: int = 1
+MAX_TOKENS: int = 1024
+CHUNK_SIZE: int = 1024
+NEAR_DUPLICATE_THRESHOLD: float = 0.8
+NEAR_DUPLICATES_NAME: str = "near_duplicates"
 
 arg_parser = argparse.ArgumentParser(
     formatter_class=argparse.RawTextHelpFormatter,
     description=(produce_negation_dataset.__doc__)
 )
-arg_parser.add_argument('datasets', type=argparse.FileType('r'), nargs='+')
+arg_parser.add_argument("datasets", type=str, nargs="+",
+                        help="the datasets to merge, or glob patterns "
+                             "matching their shards")
 arg_parser.add_argument("-s", "--no-shuffle", action="store_true",
                         help="do not shuffle the data samples")
+arg_parser.add_argument("--seed", type=int, default=None,
+                        help="seed used to shuffle the data samples, for "
+                             "reproducible\nreleases")
+arg_parser.add_argument("--permutation", type=argparse.FileType("w"),
+                        default=None,
+                        help="file to write the shuffling permutation to, as "
+                             "one\nzero-based sample index per line")
+arg_parser.add_argument("--shuffle-chunk-size", type=int,
+                        default=SHUFFLE_CHUNK_SIZE,
+                        help="maximum number of samples to shuffle in "
+                             "memory. Larger\ndatasets are shuffled on disk. "
+                            f"Defaults to {SHUFFLE_CHUNK_SIZE}.")
+arg_parser.add_argument("--format", choices=["tsv", "packed"], default="tsv",
+                        help="output format: a '.tsv' file, or a packed, "
+                             "memory-mappable\ncorpus that stores every "
+                             "distinct sentence only once\n(see "
+                             "'packed_corpus.py'). Defaults to 'tsv'.")
+arg_parser.add_argument("-d", "--near-duplicates", choices=["flag", "drop"],
+                        default=None,
+                        help="detect near-duplicate samples and either only "
+                             "report them\n('flag') or also keep only the "
+                             "first one of each cluster\n('drop'). Clusters "
+                             "are written to "
+                            f"'{NEAR_DUPLICATES_NAME}.tsv'.")
+arg_parser.add_argument("--near-duplicate-threshold", type=float,
+                        default=NEAR_DUPLICATE_THRESHOLD,
+                        help="minimum estimated Jaccard similarity of the "
+                             "word shingles\nof near-duplicate samples. "
+                            f"Defaults to {NEAR_DUPLICATE_THRESHOLD}.")
 arg_parser.add_argument("-i", "--no-inverse", action="store_true",
                         help="do not add samples with the premise and the "
                              "hypothesis swapped")
@@ -63,84 +119,301 @@ arg_parser.add_argument("-n", "--non-negated", type=int,
                             f"negated\nsentence. Defaults to {NON_NEGATED}.")
 arg_parser.add_argument("-f", "--force", action="store_true",
                         help="overwrite data in the output directory")
-
-
-def _swap_sentences(line: str) -> str:
-    """Swap the premise and hypothesis in a line.
-
-    Args:
-        line (:obj:`str`):
-            A line in the form::
-
-               r"A sentence.\tThe sentence negated.\t1\n"
-
-    Returns:
-        :obj:`str`: The line with the sentences swapped, i.e.::
-
-               r"The sentence negated.\tA sentence.\t1\n"
-    """
-    sentence, negated, label = line.strip().split("\t")
-    return f"{negated}\t{sentence}\t{label}\n"
+arg_parser.add_argument("--profile", action="store_true",
+                        help="also profile the run with cProfile. Stage "
+                             "timings are always\nwritten to "
+                            f"'{OUTPUT_NAME}{PROFILE_SUFFIX}'.")
+arg_parser.add_argument("-r", "--resume", action="store_true",
+                        help="continue an interrupted run, skipping the "
+                             "paraphrases\nalready written to the output "
+                             "directory")
+arg_parser.add_argument("-q", "--work-queue", type=str, default=None,
+                        help="shared directory, e.g., on NFS, to distribute "
+                             "the\nparaphrasing over workers on several nodes "
+                             "(see\n'work_queue.py'). This process also works "
+                             "on the queue.")
+arg_parser.add_argument("--lease", type=float, default=LEASE_SECONDS,
+                        help="seconds after which the batches of a worker "
+                             "that stopped\nrenewing its lease are "
+                             "reclaimed. Defaults to "
+                            f"{LEASE_SECONDS:g}.")
+arg_parser.add_argument("--token-corpus", type=str, default=None,
+                        help="directory of pre-tokenized sentences (see "
+                             "'token_corpus.py').\nThe sentences to "
+                             "paraphrase are added to it if missing,\nand "
+                             "not tokenized again by the paraphrasing model.")
+arg_parser.add_argument("-t", "--max-tokens", type=int, default=MAX_TOKENS,
+                        help="maximum number of padded tokens per paraphrasing "
+                             "batch.\nSentences are grouped by length to "
+                             "minimize padding.\nDefaults to "
+                            f"{MAX_TOKENS}.")
+arg_parser.add_argument("-a", "--auto-tune", action="store_true",
+                        help="adjust the token budget from the measured "
+                             "throughput")
+arg_parser.add_argument("--pipeline", action="store_true",
+                        help="tokenize the next batch and decode the previous "
+                             "one while\ngenerating the current one. Only with "
+                             "a single worker, and\nwithout --auto-tune.")
+arg_parser.add_argument("--service", type=str, default=DEFAULT_ADDRESS,
+                        help="address of the inference service to paraphrase "
+                             "with, if\none is running with the same model "
+                             "and precision\n(see 'inference_service.py'). "
+                            f"Defaults to '{DEFAULT_ADDRESS}'.")
+arg_parser.add_argument("--no-service", action="store_true",
+                        help="always load the paraphrasing model in this "
+                             "process")
+arg_parser.add_argument("--no-warm-up", action="store_true",
+                        help="do not load the paraphrasing model in the "
+                             "background while\nmerging the datasets, e.g., "
+                             "if all the paraphrases are\nexpected to be "
+                             "cached")
+arg_parser.add_argument("-p", "--precision", choices=PRECISIONS,
+                        default="fp32",
+                        help="inference precision of the paraphrasing model: "
+                             "full\nprecision, dynamic int8 quantization of the "
+                             "linear layers,\nor bfloat16. Defaults to "
+                             "'fp32'.")
+arg_parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="number of paraphrasing processes, each with its "
+                             "own copy\nof the model. Defaults to 1.")
+arg_parser.add_argument("--threads", type=int, default=None,
+                        help="number of torch threads per paraphrasing "
+                             "process when\n--workers is greater than 1. "
+                             "Defaults to splitting the\ncores evenly among "
+                             "the workers.")
+arg_parser.add_argument("-c", "--cache", type=str, default=DEFAULT_CACHE_PATH,
+                        help="the SQLite file where generated paraphrases are "
+                             "cached.\nDefaults to "
+                            f"'{DEFAULT_CACHE_PATH}'.")
+arg_parser.add_argument("--cache-size", type=int, default=DEFAULT_MAX_SIZE,
+                        help="maximum size of the paraphrase cache, in bytes. "
+                             "Least\nrecently used entries are evicted when "
+                             "exceeded. Defaults\nto "
+                            f"{DEFAULT_MAX_SIZE}.")
+arg_parser.add_argument("--no-cache", action="store_true",
+                        help="do not read from or write to the paraphrase "
+                             "cache")
 
 
 def main(args: argparse.ArgumentParser):
     """Produce final negation dataset."""
+    if args.pipeline and (args.workers > 1 or args.auto_tune):
+        arg_parser.error("--pipeline cannot be combined with --workers or "
+                         "--auto-tune")
+    datasets = expand_shards(args.datasets)
+    missing = [str(path) for path in datasets if not path.is_file()]
+    if not datasets or missing:
+        arg_parser.error("no such datasets: "
+                         f"{', '.join(missing or args.datasets)}")
     output_dir = Path(args.output) if args.output else Path(DEFAULT_OUTPUT_DIR)
-    if output_dir and output_dir.exists() and not args.force:
+    overwrite = args.force or args.resume
+    if output_dir and output_dir.exists() and not overwrite:
         print(f"Output directory '{output_dir}/' already exists.")
         decision = input("Overwrite? (y/N): ")
         if decision.lower() != "y":
             sys.exit()
     output_dir.mkdir(parents=True, exist_ok=True)
+    profiler = Profiler(args.profile)
+    print(f"\n⏱  Started in {profiler.startup_seconds:.2f}s.")
+
+    pools: List[ParaphraserPool] = []
+    pipelines: List[PipelinedParaphraser] = []
+
+    def scheduler_factory() -> Union[TokenBudgetScheduler,
+                                     PipelinedParaphraser,
+                                     ParaphraserPool,
+                                     InferenceClient]:
+        with profiler.stage("load model"):
+            client = InferenceClient.connect(
+                None if args.no_service else args.service)
+            if (client is not None
+                    and client.info.get("model_name") == MODEL_NAME
+                    and client.info.get("precision") == args.precision):
+                print(f"\n🔌 Paraphrasing with the service at "
+                      f"{args.service}.")
+                return client
+            if args.workers > 1:
+                pools.append(ParaphraserPool(args.workers, args.threads,
+                                             precision=args.precision,
+                                             max_tokens=args.max_tokens,
+                                             auto_tune=args.auto_tune,
+                                             token_corpus=args.token_corpus))
+                return pools[-1]
+            if args.pipeline:
+                pipelines.append(PipelinedParaphraser(
+                    PegasusParaphraser(precision=args.precision,
+                                       token_corpus=args.token_corpus),
+                    max_tokens=args.max_tokens
+                ))
+                return pipelines[-1]
+            return TokenBudgetScheduler(
+                PegasusParaphraser(precision=args.precision,
+                                   token_corpus=args.token_corpus),
+                max_tokens=args.max_tokens,
+                auto_tune=args.auto_tune
+            )
+
+    load_paraphraser = scheduler_factory
+    if args.non_negated > 0 and not args.no_warm_up:
+        # The model loads while the samples are merged and deduplicated.
+        load_paraphraser = BackgroundLoader(scheduler_factory)
 
     print("\n🖇  Merging files...")
 
-    lines: List[str] = []
-    for dataset in tqdm(args.datasets):
-        contains_label = int("label" in next(dataset))  # header
-        for line in dataset:
-            line = (line if contains_label
-                    else f"{line.strip()}\t1\n")  # add label
-            if line not in lines:
-                lines.append(line)
+    samples = SampleDeduplicator()
+    with profiler.stage("read") as stage:
+        for path in tqdm(datasets):
+            with open(path, "r", encoding="utf-8") as dataset:
+                next(dataset)  # header
+                stage.rows += samples.add_all(
+                    (parse_line(line) for line in dataset if line.strip()),
+                    source=shard_sort_key(path)[0]
+                )
 
     if args.non_negated > 0:
         print("\n⚙  Generating paraphrased sentences...")
-        sentences = [line.strip().split("\t")[0] for line in lines]
-        batch_size = 32
+        sentences = [premise for premise, _, _ in samples]
+        # Sentences are bucketed by length within each chunk, which is large
+        # enough to keep padding low while still reporting progress.
         batches: List[List[str]] = [
-            sentences[i:i+batch_size]
-            for i in range(0, len(sentences), batch_size)
+            sentences[i:i+CHUNK_SIZE]
+            for i in range(0, len(sentences), CHUNK_SIZE)
         ]
-        paraphraser = PegasusParaphraser()
-        paraphrased: List[str] = []
-        for batch in tqdm(batches):
-            paraphrased_batch = paraphraser.paraphrase_batch(
-                batch,
-                num_return_sentences=args.non_negated
+
+        if args.token_corpus:
+            # Before the first batch, so that the model finds the corpus.
+            with profiler.stage("tokenize", sentences=len(sentences)):
+                corpus = TokenCorpus.update(args.token_corpus, sentences,
+                                            load_tokenizer(MODEL_NAME),
+                                            MAX_LENGTH)
+            print(f"   {len(corpus)} sentences pre-tokenized in "
+                  f"'{corpus.path}'.")
+
+        cache = None
+        if args.no_cache:
+            paraphraser = load_paraphraser()
+        else:
+            cache = ParaphraseCache(args.cache, max_size=args.cache_size)
+            paraphraser = CachedParaphraser(
+                cache,
+                paraphraser_factory=load_paraphraser,
+                precision=args.precision
             )
-            paraphrased += [
-                f"{batch[i]}\t{para_sent}\t0\n"
-                for i, paraphrased_sents in enumerate(paraphrased_batch)
-                for para_sent in paraphrased_sents
-            ]
-        lines += paraphrased
+        settings = generation_settings(num_return_sentences=args.non_negated,
+                                       precision=args.precision)
+        if args.work_queue:
+            # The queue keeps the finished batches, just like a checkpoint.
+            checkpoint = WorkQueue.create(args.work_queue, batches, settings,
+                                          lease=args.lease)
+            print(f"   {checkpoint.status()}. More workers can be started "
+                  f"with:\n   python {Path(__file__).parent}/work_queue.py "
+                  f"{args.work_queue}")
+            # Also waits for the batches of the other workers.
+            with profiler.stage("paraphrase", rows=len(sentences),
+                                sentences=len(sentences) * args.non_negated):
+                checkpoint.work(paraphraser)
+        else:
+            checkpoint = ParaphraseCheckpoint(output_dir / SHARDS_DIR,
+                                              resume=args.resume)
+            for i, batch in enumerate(tqdm(batches)):
+                key = chunk_key(batch, **settings)
+                if checkpoint.is_complete(i, key):
+                    continue
+                # Includes loading the model, if this is the first uncached
+                # batch.
+                with profiler.stage("paraphrase", rows=len(batch),
+                                    sentences=len(batch) * args.non_negated):
+                    paraphrased_batch = paraphraser.paraphrase_batch(
+                        batch,
+                        num_return_sentences=args.non_negated
+                    )
+                checkpoint.write(
+                    i,
+                    key,
+                    ((batch[j], para_sent.strip(), "0")
+                     for j, paraphrased_sents in enumerate(paraphrased_batch)
+                     for para_sent in paraphrased_sents)
+                )
+        samples.add_all(checkpoint.samples(len(batches)),
+                        source="paraphrases")
+        if (isinstance(load_paraphraser, BackgroundLoader)
+                and args.workers > 1):
+            # The model is not needed if everything was cached, but a pool it
+            # may be starting has to be closed. Errors only matter if the
+            # model was needed, in which case they were already raised.
+            load_paraphraser.wait()
+        for pool in pools:
+            pool.close()
+        for pipeline in pipelines:
+            print(f"\n🚰 Paraphrase pipeline:\n{pipeline.report()}")
+        if cache is not None:
+            print(f"\n💾 Paraphrase cache: {cache.stats()}")
+            cache.close()
+
+    if args.near_duplicates:
+        print("\n🔍 Detecting near-duplicates...")
+        unique_samples = list(samples)
+        with profiler.stage("dedup", rows=len(unique_samples)):
+            clusters = NearDuplicateDetector(
+                threshold=args.near_duplicate_threshold
+            ).clusters(unique_samples)
+        sources = [samples.source(sample) for sample in unique_samples]
+        with open(output_dir / f"{NEAR_DUPLICATES_NAME}.tsv", "w",
+                  encoding="utf-8") as f:
+            f.write("cluster\tsource\tpremise\thypothesis\tlabel\n")
+            f.writelines(
+                f"{c}\t{sources[i]}\t{format_sample(unique_samples[i])}"
+                for c, members in enumerate(clusters)
+                for i in members
+            )
+        print(f"   {len(clusters)} clusters with "
+              f"{sum(map(len, clusters))} samples:")
+        for cluster_sources, count in cross_source_counts(
+            clusters, sources
+        ).most_common():
+            print(f"   {' + '.join(cluster_sources)}: {count}")
+        if args.near_duplicates == "drop":
+            for members in clusters:
+                for i in members[1:]:
+                    samples.remove(unique_samples[i])
 
     if not args.no_inverse:
-        swapped = [_swap_sentences(line) for line in lines]
-        swapped = [s for s in swapped if s not in lines]
-        lines += swapped
+        with profiler.stage("swap") as stage:
+            stage.rows += samples.add_swapped()
 
-    if not args.no_shuffle:
-        lines_np = np.array(lines)
-        np.random.default_rng().shuffle(lines_np)
-        lines = lines_np.tolist()
+    print(f"\n🔎 Kept {len(samples)} unique samples:")
+    print(samples.report())
 
-    lines = ["premise\thypothesis\tlabel\n"] + lines
+    with profiler.stage("write" if args.no_shuffle else "shuffle",
+                        rows=len(samples)):
+        if args.format == "packed":
+            writer = PackedCorpusWriter()
+            writer.add_all((*sample, samples.source(sample))
+                           for sample in samples)
+            order = None
+            if not args.no_shuffle:
+                # Only row ids are permuted, so the corpus is shuffled in
+                # memory.
+                rng = np.random.default_rng(args.seed)
+                order = rng.permutation(len(writer))
+                if args.permutation is not None:
+                    args.permutation.writelines(f"{i}\n" for i in order)
+            writer.write(output_dir / f"{OUTPUT_NAME}{PACKED_SUFFIX}", order)
+        else:
+            with open(output_dir / f"{OUTPUT_NAME}.tsv", "w",
+                      encoding="utf-8") as f:
+                f.write("premise\thypothesis\tlabel\n")
+                if args.no_shuffle:
+                    f.writelines(samples.lines())
+                else:
+                    shuffle_lines(samples.lines(), f, seed=args.seed,
+                                  chunk_size=args.shuffle_chunk_size,
+                                  permutation=args.permutation)
 
-    with open(output_dir / f"{OUTPUT_NAME}.tsv", "w", encoding="utf-8") as f:
-        f.writelines(lines)
+    if args.non_negated > 0:
+        checkpoint.remove()
 
+    profiler.write(output_dir / f"{OUTPUT_NAME}{PROFILE_SUFFIX}")
     print(f"\n✅ Done! Output data written to '{output_dir}/'.")
 
 
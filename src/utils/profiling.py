@@ -0,0 +1,233 @@
+"""Stage-level instrumentation.
+
+Pipelines are split into named stages (e.g., "read", "filter", "paraphrase",
+"write"), whose wall time, number of rows and sentences, and the peak
+resident memory of the process are recorded. Stages with the same name, e.g.
+the same stage run over several chunks, are added up. Optionally, the whole
+run is also profiled with :mod:`cProfile`.
+
+The results are written as a JSON report, so that they can be compared
+between builds.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import resource
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+# Fallback for systems without /proc: when this module was imported.
+_IMPORT_TIME: float = time.time()
+
+PROFILE_SUFFIX: str = ".profile.json"
+CPROFILE_SUFFIX: str = ".prof"
+TOP_FUNCTIONS: int = 30
+
+
+def peak_rss() -> int:
+    """Get the peak resident memory of the process.
+
+    Returns:
+        :obj:`int`: The peak resident memory so far, in bytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in kilobytes on Linux, but in bytes on macOS.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def startup_seconds() -> float:
+    """Measure the time elapsed since the process started.
+
+    Called at the beginning of ``main``, this is the time spent starting the
+    interpreter and importing modules.
+
+    Returns:
+        :obj:`float`: The seconds since the process started, or, on systems
+        without ``/proc``, since this module was imported.
+    """
+    try:
+        with open("/proc/self/stat", encoding="utf-8") as f:
+            # The command name may contain spaces, but ends with ")".
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime", encoding="utf-8") as f:
+            uptime = float(f.read().split()[0])
+        ticks = os.sysconf("SC_CLK_TCK")
+        return uptime - int(fields[19]) / ticks
+    except (OSError, IndexError, ValueError):
+        return time.time() - _IMPORT_TIME
+
+
+class Stage:
+    """The measurements of a stage.
+
+    Attributes:
+        name (:obj:`str`):
+            The name of the stage.
+        seconds (:obj:`float`):
+            The total wall time spent in the stage.
+        calls (:obj:`int`):
+            The number of times the stage ran.
+        rows (:obj:`int`):
+            The number of rows (e.g., samples) processed.
+        sentences (:obj:`int`):
+            The number of sentences processed.
+        peak_rss (:obj:`int`):
+            The peak resident memory of the process at the end of the stage,
+            in bytes.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.seconds = 0.
+        self.calls = 0
+        self.rows = 0
+        self.sentences = 0
+        self.peak_rss = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert the measurements into a JSON-serializable dictionary.
+
+        Returns:
+            :obj:`Dict[str, Any]`: The measurements, including the throughput
+            in rows and sentences per second.
+        """
+        def per_second(count: int) -> Optional[float]:
+            return count / self.seconds if self.seconds and count else None
+
+        return {
+            "name": self.name,
+            "seconds": self.seconds,
+            "calls": self.calls,
+            "rows": self.rows,
+            "rows_per_second": per_second(self.rows),
+            "sentences": self.sentences,
+            "sentences_per_second": per_second(self.sentences),
+            "peak_rss": self.peak_rss,
+        }
+
+
+class Profiler:
+    """Recorder of stage measurements.
+
+    Attributes:
+        stages (:obj:`Dict[str, Stage]`):
+            The measurements of every stage, in the order the stages first
+            ran.
+        profile (:obj:`bool`):
+            Whether the run is also profiled with :mod:`cProfile`.
+        startup_seconds (:obj:`float`):
+            The time from the start of the process until the profiler was
+            created. See :func:`startup_seconds`.
+    """
+
+    def __init__(self, profile: bool = False):
+        self.stages: Dict[str, Stage] = {}
+        self.profile = profile
+        self.startup_seconds = startup_seconds()
+        self._start = time.perf_counter()
+        self._cprofile: Optional[cProfile.Profile] = None
+        if profile:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    @contextmanager
+    def stage(
+        self,
+        name: str,
+        rows: int = 0,
+        sentences: int = 0
+    ) -> Iterator[Stage]:
+        """Measure a stage.
+
+        The counts can be given upfront, or added to the yielded
+        :obj:`Stage` once they are known, e.g.::
+
+           with profiler.stage("filter") as stage:
+               dataset = apply_filters(dataset)
+               stage.rows += len(dataset)
+
+        Args:
+            name (:obj:`str`):
+                The name of the stage.
+            rows (:obj:`int`, defaults to ``0``):
+                The number of rows the stage processes.
+            sentences (:obj:`int`, defaults to ``0``):
+                The number of sentences the stage processes.
+
+        Yields:
+            :obj:`Stage`: The accumulated measurements of the stage.
+        """
+        stage = self.stages.setdefault(name, Stage(name))
+        stage.rows += rows
+        stage.sentences += sentences
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            stage.seconds += time.perf_counter() - start
+            stage.calls += 1
+            stage.peak_rss = max(stage.peak_rss, peak_rss())
+
+    def report(self) -> Dict[str, Any]:
+        """Summarize the run.
+
+        Returns:
+            :obj:`Dict[str, Any]`: The measurements of every stage, the total
+            wall time and peak resident memory, and, if profiling, the
+            functions with the highest cumulative time.
+        """
+        report: Dict[str, Any] = {
+            "command": sys.argv,
+            "startup_seconds": self.startup_seconds,
+            "seconds": time.perf_counter() - self._start,
+            "peak_rss": peak_rss(),
+            "stages": [stage.to_dict() for stage in self.stages.values()],
+        }
+        if self._cprofile is not None:
+            report["functions"] = self._top_functions()
+        return report
+
+    def _top_functions(self) -> List[Dict[str, Any]]:
+        stats = pstats.Stats(self._cprofile, stream=io.StringIO())
+        functions = sorted(stats.stats.items(), key=lambda item: item[1][3],
+                           reverse=True)[:TOP_FUNCTIONS]
+        return [
+            {
+                "function": f"{filename}:{line}({function})",
+                "calls": calls,
+                "total_seconds": total_time,
+                "cumulative_seconds": cumulative_time,
+            }
+            for (filename, line, function),
+                (_, calls, total_time, cumulative_time, _) in functions
+        ]
+
+    def stop(self):
+        """Stop profiling with :mod:`cProfile`, if the run is profiled."""
+        if self._cprofile is not None:
+            self._cprofile.disable()
+
+    def write(self, path: Union[str, Path]):
+        """Write the final JSON report.
+
+        Profiling with :mod:`cProfile` stops first (see :meth:`stop`), so
+        that the report covers everything that was profiled. The raw
+        statistics are also written next to it, with the ``.prof`` extension,
+        so that they can be inspected with e.g. :mod:`pstats` or SnakeViz.
+
+        Args:
+            path (:obj:`Union[str, pathlib.Path]`):
+                The file to write the report to.
+        """
+        path = Path(path)
+        self.stop()
+        if self._cprofile is not None:
+            self._cprofile.dump_stats(path.with_suffix(CPROFILE_SUFFIX))
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=2)
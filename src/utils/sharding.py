@@ -0,0 +1,205 @@
+"""Sharding utilities.
+
+Large inputs are split into shards by record (line) ranges, so that they can
+be processed in parallel. Shard ``i`` of a file ``<name>.<ext>`` is named
+``<name>_<i>.<ext>``. Shards are always ordered by their index, i.e.,
+``_10`` comes after ``_9``.
+"""
+
+import os
+import re
+import glob
+import shutil
+import hashlib
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple, Union
+
+_SHARD_INDEX = re.compile(r"_(\d+)$")
+
+
+def shard_path(path: Union[str, Path], index: int) -> Path:
+    """Get the path of a shard.
+
+    Args:
+        path (:obj:`Union[str, pathlib.Path]`):
+            The path of the whole file, e.g., ``"out/name.tsv"``.
+        index (:obj:`int`):
+            The index of the shard.
+
+    Returns:
+        :obj:`pathlib.Path`: The path of the shard, e.g.,
+        ``"out/name_3.tsv"``.
+    """
+    path = Path(path)
+    return path.with_name(f"{path.stem}_{index}{path.suffix}")
+
+
+def existing_shards(path: Union[str, Path]) -> Dict[int, Path]:
+    """Find the shards of a file that exist.
+
+    Args:
+        path (:obj:`Union[str, pathlib.Path]`):
+            The path of the whole file, e.g., ``"out/name.tsv"``.
+
+    Returns:
+        :obj:`Dict[int, pathlib.Path]`: The existing shards, by index.
+    """
+    path = Path(path)
+    pattern = re.compile(re.escape(path.stem) + r"_(\d+)"
+                         + re.escape(path.suffix))
+    shards: Dict[int, Path] = {}
+    for shard in path.parent.glob(f"{glob.escape(path.stem)}_*{path.suffix}"):
+        match = pattern.fullmatch(shard.name)
+        if match is not None:
+            shards[int(match.group(1))] = shard
+    return shards
+
+
+def shard_sort_key(path: Union[str, Path]) -> Tuple[str, int]:
+    """Sort key that orders shards by their numeric index.
+
+    Args:
+        path (:obj:`Union[str, pathlib.Path]`):
+            The path of a shard, or of any other file.
+
+    Returns:
+        :obj:`Tuple[str, int]`: The path without the shard index, and the
+        index (``-1`` for files that are not shards).
+    """
+    path = Path(path)
+    match = _SHARD_INDEX.search(path.stem)
+    if match is None:
+        return str(path), -1
+    return (str(path.with_name(path.stem[:match.start()] + path.suffix)),
+            int(match.group(1)))
+
+
+def expand_shards(patterns: Iterable[str]) -> List[Path]:
+    """Expand glob patterns into files, with the shards of each in order.
+
+    The patterns are expanded in the order they are given. Patterns without
+    wildcards are kept as they are, even if the file does not exist.
+
+    Args:
+        patterns (:obj:`Iterable[str]`):
+            The paths or glob patterns, e.g., ``"processed/wiki_*.tsv"``.
+
+    Returns:
+        :obj:`List[pathlib.Path]`: The files.
+    """
+    paths: List[Path] = []
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            paths.extend(sorted(map(Path, glob.glob(pattern)),
+                                key=shard_sort_key))
+        else:
+            paths.append(Path(pattern))
+    return paths
+
+
+def file_hash(path: Union[str, Path]) -> str:
+    """Compute the SHA-256 digest of a file.
+
+    Args:
+        path (:obj:`Union[str, pathlib.Path]`):
+            The file to hash.
+
+    Returns:
+        :obj:`str`: The hex digest of the contents of the file.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def remove_path(path: Union[str, Path]):
+    """Remove a file or a directory, if it exists.
+
+    Args:
+        path (:obj:`Union[str, pathlib.Path]`):
+            The file or directory.
+    """
+    if Path(path).is_dir():
+        shutil.rmtree(path)
+    elif Path(path).exists():
+        Path(path).unlink()
+
+
+def count_lines(path: Union[str, Path]) -> int:
+    """Count the lines of a file without loading it.
+
+    Args:
+        path (:obj:`Union[str, pathlib.Path]`):
+            The file.
+
+    Returns:
+        :obj:`int`: The number of lines.
+    """
+    with open(path, "rb") as f:
+        return sum(1 for _ in f)
+
+
+def split_lines(
+    path: Union[str, Path],
+    num_shards: int,
+    directory: Union[str, Path],
+    header_lines: int = 0
+) -> List[Path]:
+    """Split a line-based file into shards of contiguous records.
+
+    Args:
+        path (:obj:`Union[str, pathlib.Path]`):
+            The file to split.
+        num_shards (:obj:`int`):
+            The number of shards. Fewer are written if the file has fewer
+            records.
+        directory (:obj:`Union[str, pathlib.Path]`):
+            The directory the shards are written to.
+        header_lines (:obj:`int`, defaults to ``0``):
+            The number of header lines, which are repeated in every shard.
+
+    Returns:
+        :obj:`List[pathlib.Path]`: The shards, in order.
+    """
+    path = Path(path)
+    num_records = max(count_lines(path) - header_lines, 0)
+    shard_size = max(-(-num_records // num_shards), 1)  # ceil
+    shards: List[Path] = []
+    with open(path, "rb") as f:
+        header = [f.readline() for _ in range(header_lines)]
+        for index in range(-(-num_records // shard_size)):
+            shards.append(shard_path(Path(directory) / path.name, index))
+            with open(shards[-1], "wb") as shard:
+                shard.writelines(header)
+                for _ in range(shard_size):
+                    line = f.readline()
+                    if not line:
+                        break
+                    shard.write(line)
+    return shards
+
+
+def replace_atomically(tmp_path: Union[str, Path], path: Union[str, Path]):
+    """Move a finished file or directory into place in a single step.
+
+    Args:
+        tmp_path (:obj:`Union[str, pathlib.Path]`):
+            The finished file or directory.
+        path (:obj:`Union[str, pathlib.Path]`):
+            Where to move it to. An existing directory is replaced.
+    """
+    if Path(tmp_path).is_file():
+        with open(tmp_path, "rb") as f:
+            os.fsync(f.fileno())
+    elif Path(path).is_dir():
+        # Directories cannot be atomically replaced, only renamed.
+        old_path = Path(path).with_name(f".{Path(path).name}.old")
+        os.replace(path, old_path)
+        os.replace(tmp_path, path)
+        for child in old_path.iterdir():
+            child.unlink()
+        old_path.rmdir()
+        return
+    os.replace(tmp_path, path)
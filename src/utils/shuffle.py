@@ -0,0 +1,117 @@
+"""Shuffling utilities.
+
+Lines are never copied into a NumPy string array: only a permutation of
+integer indices is generated, and the lines are written out in that order.
+
+If there are more lines than fit in a chunk, the lines are shuffled
+out-of-core instead (see Rao, C. R. (1961), "Generation of random
+permutations of given number of elements using random sampling numbers").
+The lines are spilled to disk, every line is scattered into one of several
+bucket files chosen at random, and then each bucket, which does fit in memory,
+is shuffled on its own and appended to the output. This produces a uniformly
+random permutation.
+
+With the same seed and chunk size, the order is always the same.
+"""
+
+import shutil
+import tempfile
+from itertools import chain, islice
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, TextIO, Tuple
+
+import numpy as np
+
+CHUNK_SIZE: int = 1_000_000  # lines
+
+
+def shuffle_lines(
+    lines: Iterable[str],
+    output: TextIO,
+    seed: Optional[int] = None,
+    chunk_size: int = CHUNK_SIZE,
+    permutation: Optional[TextIO] = None
+) -> int:
+    """Write lines in a random order.
+
+    Args:
+        lines (:obj:`Iterable[str]`):
+            The newline-terminated lines to shuffle.
+        output (:obj:`TextIO`):
+            The file to write the shuffled lines to.
+        seed (:obj:`int`, `optional`, defaults to :obj:`None`):
+            The seed of the random generator. If :obj:`None`, the order is
+            not reproducible.
+        chunk_size (:obj:`int`, defaults to ``CHUNK_SIZE``):
+            The maximum number of lines to hold in memory at once.
+        permutation (:obj:`TextIO`, `optional`, defaults to :obj:`None`):
+            If given, the file to write the permutation to, as one original
+            (zero-based) line index per line, in output order.
+
+    Returns:
+        :obj:`int`: The number of lines written.
+    """
+    rng = np.random.default_rng(seed)
+    lines = iter(lines)
+    head = list(islice(lines, chunk_size + 1))
+    if len(head) <= chunk_size:
+        return _write_shuffled(enumerate(head), output, rng, permutation)
+
+    total = 0
+    tmp_dir = Path(tempfile.mkdtemp(prefix="shuffle-"))
+    try:
+        # The number of buckets depends on the number of lines, which is not
+        # known until the input has been consumed.
+        num_lines = 0
+        # Only "\n" ends a line, so that a bare carriage return inside a line
+        # does not split it in two when read back.
+        with open(tmp_dir / "lines", "w", encoding="utf-8",
+                  newline="\n") as f:
+            for num_lines, line in enumerate(chain(head, lines), start=1):
+                f.write(f"{num_lines - 1}\t{line}")
+        # On average, each bucket holds half a chunk, so that even an unlucky
+        # one stays well within memory.
+        num_buckets = -(-2 * num_lines // chunk_size)  # ceil
+        bucket_paths = [tmp_dir / f"bucket-{i:05d}"
+                        for i in range(num_buckets)]
+        buckets = [open(path, "w", encoding="utf-8", newline="\n")
+                   for path in bucket_paths]
+        with open(tmp_dir / "lines", encoding="utf-8", newline="\n") as f:
+            while True:
+                entries = list(islice(f, chunk_size))
+                if not entries:
+                    break
+                targets = rng.integers(num_buckets, size=len(entries))
+                for entry, target in zip(entries, targets):
+                    buckets[target].write(entry)
+        for bucket in buckets:
+            bucket.close()
+        for path in bucket_paths:
+            with open(path, encoding="utf-8", newline="\n") as f:
+                total += _write_shuffled(_parse_bucket(f), output, rng,
+                                         permutation)
+    finally:
+        shutil.rmtree(tmp_dir)
+    return total
+
+
+def _parse_bucket(bucket: TextIO) -> Iterator[Tuple[int, str]]:
+    """Read the ``(index, line)`` pairs of a bucket file."""
+    for entry in bucket:
+        index, line = entry.split("\t", 1)
+        yield int(index), line
+
+
+def _write_shuffled(
+    entries: Iterable[Tuple[int, str]],
+    output: TextIO,
+    rng: np.random.Generator,
+    permutation: Optional[TextIO]
+) -> int:
+    """Shuffle ``(index, line)`` pairs in memory and write them out."""
+    entries = list(entries)
+    order = rng.permutation(len(entries))
+    output.writelines(entries[i][1] for i in order)
+    if permutation is not None:
+        permutation.writelines(f"{entries[i][0]}\n" for i in order)
+    return len(entries)
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+
+"""Pre-tokenized, memory-mapped corpus of token ids.
+
+Tokenizing the sentences takes a noticeable share of every paraphrasing
+batch, and is repeated on every run, e.g., for every generation setting that
+is tried. A token corpus stores the token ids of every sentence once, in a
+directory that is memory-mapped when opened:
+
+   - ``ids.npy``: :obj:`int32` array with the token ids of all the sentences,
+     one after the other.
+   - ``offsets.npy``: :obj:`int64` array with the start of the ids of every
+     sentence, plus the end of the last one.
+   - ``hashes.npy``: :obj:`uint64` array with the sorted hashes of the
+     sentences, to look them up.
+   - ``rows.npy``: :obj:`int64` array with the row of every sorted hash.
+   - ``meta.json``: The tokenizer the ids were produced with.
+
+Ids are only valid for the tokenizer that produced them, so every corpus is
+written to a subdirectory named after the tokenizer version (see
+:func:`tokenizer_key`). A :class:`paraphrasis.PegasusParaphraser` given the
+parent directory uses the ids of its own tokenizer, if present, and
+tokenizes the sentences that are not in the corpus as usual.
+
+When run as a script, it pre-tokenizes the premises of the given datasets,
+e.g.::
+
+   ./token_corpus.py 'processed/*.tsv' -o token-corpus
+"""
+
+import json
+import hashlib
+import argparse
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Union
+
+import numpy as np
+
+import token_corpus
+from dedup import parse_line
+from sharding import expand_shards, replace_atomically
+
+DEFAULT_TOKEN_CORPUS_DIR: str = "token-corpus"
+TOKENIZE_BATCH_SIZE: int = 1024  # sentences
+
+arg_parser = argparse.ArgumentParser(
+    formatter_class=argparse.RawTextHelpFormatter,
+    description=(token_corpus.__doc__)
+)
+arg_parser.add_argument("datasets", type=str, nargs="+",
+                        help="the datasets whose premises are tokenized, or "
+                             "glob patterns\nmatching their shards")
+arg_parser.add_argument("-o", "--output", type=str,
+                        default=DEFAULT_TOKEN_CORPUS_DIR,
+                        help="the directory of the token corpus. Defaults to "
+                            f"'{DEFAULT_TOKEN_CORPUS_DIR}'.")
+arg_parser.add_argument("-b", "--batch-size", type=int,
+                        default=TOKENIZE_BATCH_SIZE,
+                        help="number of sentences tokenized at a time. "
+                            f"Defaults to {TOKENIZE_BATCH_SIZE}.")
+
+
+def sentence_hash(sentence: str) -> int:
+    """Hash a sentence into 64 bits.
+
+    Args:
+        sentence (:obj:`str`):
+            The sentence.
+
+    Returns:
+        :obj:`int`: The hash.
+    """
+    return int.from_bytes(hashlib.blake2b(sentence.encode("utf-8"),
+                                          digest_size=8).digest(), "little")
+
+
+def _hashes(sentences: Iterable[str]) -> np.ndarray:
+    return np.fromiter(map(sentence_hash, sentences), dtype=np.uint64)
+
+
+def tokenizer_info(tokenizer: Any, max_length: int) -> Dict[str, Any]:
+    """Describe everything that determines the token ids of a sentence.
+
+    Args:
+        tokenizer (:obj:`PreTrainedTokenizerBase`):
+            The tokenizer.
+        max_length (:obj:`int`):
+            The length sentences are truncated to.
+
+    Returns:
+        :obj:`Dict[str, Any]`: The description of the tokenizer.
+    """
+    import transformers
+
+    return {
+        "name": tokenizer.name_or_path,
+        "class": type(tokenizer).__name__,
+        "vocab_size": len(tokenizer),
+        "max_length": max_length,
+        "transformers": transformers.__version__,
+    }
+
+
+def tokenizer_key(tokenizer: Any, max_length: int) -> str:
+    """Compute the version of a tokenizer.
+
+    Args:
+        tokenizer (:obj:`PreTrainedTokenizerBase`):
+            The tokenizer.
+        max_length (:obj:`int`):
+            The length sentences are truncated to.
+
+    Returns:
+        :obj:`str`: A short hex digest of :func:`tokenizer_info`.
+    """
+    info = json.dumps(tokenizer_info(tokenizer, max_length), sort_keys=True)
+    return hashlib.sha256(info.encode("utf-8")).hexdigest()[:16]
+
+
+class TokenCorpus:
+    """Memory-mapped token ids of a set of sentences.
+
+    Attributes:
+        path (:obj:`pathlib.Path`):
+            The directory of the corpus.
+        info (:obj:`Dict[str, Any]`):
+            The tokenizer the ids were produced with. See
+            :func:`tokenizer_info`.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        with open(self.path / "meta.json", encoding="utf-8") as f:
+            self.info: Dict[str, Any] = json.load(f)
+        self.ids = np.load(self.path / "ids.npy", mmap_mode="r")
+        self.offsets = np.load(self.path / "offsets.npy", mmap_mode="r")
+        self.hashes = np.load(self.path / "hashes.npy", mmap_mode="r")
+        self.rows = np.load(self.path / "rows.npy", mmap_mode="r")
+
+    @classmethod
+    def open(
+        cls,
+        directory: Union[str, Path],
+        tokenizer: Any,
+        max_length: int
+    ) -> Optional["TokenCorpus"]:
+        """Open the corpus of a tokenizer, if there is one.
+
+        Args:
+            directory (:obj:`Union[str, pathlib.Path]`):
+                The directory with the corpora of every tokenizer.
+            tokenizer (:obj:`PreTrainedTokenizerBase`):
+                The tokenizer.
+            max_length (:obj:`int`):
+                The length sentences are truncated to.
+
+        Returns:
+            :obj:`Optional[TokenCorpus]`: The corpus, or :obj:`None` if the
+            sentences have not been tokenized with this tokenizer yet.
+        """
+        path = Path(directory) / tokenizer_key(tokenizer, max_length)
+        return cls(path) if (path / "meta.json").exists() else None
+
+    @classmethod
+    def update(
+        cls,
+        directory: Union[str, Path],
+        sentences: Iterable[str],
+        tokenizer: Any,
+        max_length: int,
+        batch_size: int = TOKENIZE_BATCH_SIZE
+    ) -> "TokenCorpus":
+        """Add the sentences that are missing from the corpus of a tokenizer.
+
+        The ids of the sentences already in the corpus are kept, and the new
+        corpus replaces the old one atomically.
+
+        Args:
+            directory (:obj:`Union[str, pathlib.Path]`):
+                The directory with the corpora of every tokenizer.
+            sentences (:obj:`Iterable[str]`):
+                The sentences to tokenize.
+            tokenizer (:obj:`PreTrainedTokenizerBase`):
+                The tokenizer.
+            max_length (:obj:`int`):
+                The length sentences are truncated to.
+            batch_size (:obj:`int`, defaults to ``TOKENIZE_BATCH_SIZE``):
+                The number of sentences tokenized at a time.
+
+        Returns:
+            :obj:`TokenCorpus`: The updated corpus.
+        """
+        corpus = cls.open(directory, tokenizer, max_length)
+        missing = list(dict.fromkeys(sentences))
+        if corpus is not None:
+            rows = corpus.find(missing)
+            missing = [sentence for sentence, row in zip(missing, rows)
+                       if row < 0]
+            if not missing:
+                return corpus
+        new_ids: List[List[int]] = []
+        for i in range(0, len(missing), batch_size):
+            new_ids.extend(tokenizer(missing[i:i+batch_size], truncation=True,
+                                     max_length=max_length)["input_ids"])
+        new_lengths = np.fromiter(map(len, new_ids), dtype=np.int64,
+                                  count=len(new_ids))
+        flat_ids = np.fromiter((token for ids in new_ids for token in ids),
+                               dtype=np.int32, count=int(new_lengths.sum()))
+        hashes = _hashes(missing)
+        offsets = np.concatenate([[0], np.cumsum(new_lengths)])
+        if corpus is not None:
+            flat_ids = np.concatenate([corpus.ids, flat_ids])
+            offsets = np.concatenate([corpus.offsets,
+                                      corpus.offsets[-1] + offsets[1:]])
+            old_hashes = np.empty(len(corpus), dtype=np.uint64)
+            old_hashes[corpus.rows] = corpus.hashes
+            hashes = np.concatenate([old_hashes, hashes])
+        path = Path(directory) / tokenizer_key(tokenizer, max_length)
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        tmp_path.mkdir(parents=True, exist_ok=True)
+        order = np.argsort(hashes, kind="stable")
+        np.save(tmp_path / "ids.npy", flat_ids.astype(np.int32, copy=False))
+        np.save(tmp_path / "offsets.npy", offsets.astype(np.int64))
+        np.save(tmp_path / "hashes.npy", hashes[order])
+        np.save(tmp_path / "rows.npy", order.astype(np.int64))
+        with open(tmp_path / "meta.json", "w", encoding="utf-8") as f:
+            json.dump(tokenizer_info(tokenizer, max_length), f, indent=2)
+        del corpus  # release the memory maps before replacing the files
+        replace_atomically(tmp_path, path)
+        return cls(path)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def find(self, sentences: Sequence[str]) -> np.ndarray:
+        """Find the rows of sentences.
+
+        Args:
+            sentences (:obj:`Sequence[str]`):
+                The sentences.
+
+        Returns:
+            :obj:`np.ndarray`: The row of every sentence, or ``-1`` if it is
+            not in the corpus.
+        """
+        hashes = _hashes(sentences)
+        if not len(self):
+            return np.full(len(hashes), -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.hashes, hashes),
+                               len(self) - 1)
+        return np.where(self.hashes[positions] == hashes,
+                        self.rows[positions], -1)
+
+    def lengths(self, rows: np.ndarray) -> np.ndarray:
+        """Get the number of tokens of some rows.
+
+        Args:
+            rows (:obj:`np.ndarray`):
+                The rows.
+
+        Returns:
+            :obj:`np.ndarray`: The number of tokens of every row.
+        """
+        return self.offsets[rows + 1] - self.offsets[rows]
+
+    def token_ids(self, rows: Iterable[int]) -> List[np.ndarray]:
+        """Get the token ids of some rows.
+
+        Args:
+            rows (:obj:`Iterable[int]`):
+                The rows.
+
+        Returns:
+            :obj:`List[np.ndarray]`: The token ids of every row, as views of
+            the memory-mapped array.
+        """
+        return [self.ids[self.offsets[row]:self.offsets[row + 1]]
+                for row in rows]
+
+    def lookup(self, sentences: Sequence[str]) -> Optional[List[np.ndarray]]:
+        """Get the token ids of sentences.
+
+        Args:
+            sentences (:obj:`Sequence[str]`):
+                The sentences.
+
+        Returns:
+            :obj:`Optional[List[np.ndarray]]`: The token ids of every
+            sentence, or :obj:`None` if any of them is not in the corpus.
+        """
+        rows = self.find(sentences)
+        if (rows < 0).any():
+            return None
+        return self.token_ids(rows)
+
+
+def main(args: argparse.ArgumentParser):
+    """Pre-tokenize the premises of the datasets."""
+    from paraphrasis import load_tokenizer, MODEL_NAME, MAX_LENGTH
+
+    sentences: Dict[str, None] = {}
+    for path in expand_shards(args.datasets):
+        with open(path, "r", encoding="utf-8") as dataset:
+            next(dataset)  # header
+            sentences.update((parse_line(line)[0], None)
+                             for line in dataset if line.strip())
+    tokenizer = load_tokenizer(MODEL_NAME)
+    corpus = TokenCorpus.update(args.output, sentences, tokenizer, MAX_LENGTH,
+                                batch_size=args.batch_size)
+    print(f"✅ Done! {len(corpus)} sentences ({len(corpus.ids)} tokens, "
+          f"{type(tokenizer).__name__}) written to '{corpus.path}/'.")
+
+
+if __name__ == "__main__":
+    main(arg_parser.parse_args())
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+"""Re-tune the thresholds of the dataset processors.
+
+Applies every combination of the given thresholds to the pair features
+stored by the processors (run with ``--features``, see
+``feature_store.py``), and prints how many samples every source would
+contribute, e.g.::
+
+   ./tune_thresholds.py 'processed/*.features.npz' -j 0.5 0.55 0.6 -l 2 3 4
+
+Thresholds on features that a source does not have (e.g., the number of
+words for GLUE Diagnostic) do not apply to that source. The counts are those
+of the candidate pairs that pass the thresholds; later steps of a processor
+(e.g., sentences that cannot be negated) are not taken into account.
+"""
+
+import time
+import argparse
+import itertools
+from typing import Dict, List
+
+import numpy as np
+
+import tune_thresholds
+from feature_store import FeatureSet, Thresholds, passes, read_features
+from filters import JACCARD_THRESHOLD, MAX_LENGTH_DIFFERENCE, MAX_WORDS
+from sharding import expand_shards
+
+arg_parser = argparse.ArgumentParser(
+    formatter_class=argparse.RawTextHelpFormatter,
+    description=(tune_thresholds.__doc__)
+)
+arg_parser.add_argument("features", type=str, nargs="+",
+                        help="the feature files, or glob patterns matching "
+                             "them")
+arg_parser.add_argument("-j", "--jaccard-threshold", type=float, nargs="+",
+                        default=[JACCARD_THRESHOLD],
+                        help="minimum Jaccard indices to try. Defaults to "
+                            f"{JACCARD_THRESHOLD}.")
+arg_parser.add_argument("-l", "--max-length-diff", type=int, nargs="+",
+                        default=[MAX_LENGTH_DIFFERENCE],
+                        help="maximum differences in words to try. Defaults "
+                            f"to {MAX_LENGTH_DIFFERENCE}.")
+arg_parser.add_argument("-w", "--max-words", type=int, nargs="+",
+                        default=[MAX_WORDS],
+                        help="maximum numbers of words to try. Defaults to "
+                            f"{MAX_WORDS}.")
+arg_parser.add_argument("-e", "--entities", choices=["match", "ignore"],
+                        nargs="+", default=["match"],
+                        help="whether named entities must match ('match') "
+                             "or not\n('ignore'). Defaults to 'match'.")
+
+
+def load_sources(paths: List[str]) -> List[FeatureSet]:
+    """Read feature files, joining the shards of every source.
+
+    Args:
+        paths (:obj:`List[str]`):
+            The feature files, or glob patterns matching them.
+
+    Returns:
+        :obj:`List[FeatureSet]`: The features of every source, in the order
+        they were first found.
+    """
+    shards: Dict[str, List[FeatureSet]] = {}
+    for path in expand_shards(paths):
+        features = read_features(path)
+        shards.setdefault(features.source, []).append(features)
+    return [
+        FeatureSet(
+            source,
+            {name: np.concatenate([shard.columns[name] for shard in sets])
+             for name in sets[0].columns},
+            sum(shard.num_pairs for shard in sets)
+        )
+        for source, sets in shards.items()
+    ]
+
+
+def main(args: argparse.ArgumentParser):
+    """Count the samples of every source for every threshold combination."""
+    sources = load_sources(args.features)
+    combinations = [
+        Thresholds(jaccard, length_diff, entities == "match", words)
+        for jaccard, length_diff, entities, words in itertools.product(
+            args.jaccard_threshold, args.max_length_diff, args.entities,
+            args.max_words)
+    ]
+    start = time.perf_counter()
+    counts = [[int(passes(features, thresholds).sum())
+               for features in sources]
+              for thresholds in combinations]
+    elapsed = time.perf_counter() - start
+
+    header = ["jaccard ≥", "length diff ≤", "entities", "words ≤",
+              *(features.source for features in sources), "total"]
+    rows = [["", "", "", "",
+             *(str(features.num_pairs) for features in sources),
+             str(sum(features.num_pairs for features in sources))]]
+    rows.extend(
+        [f"{thresholds.jaccard:g}", str(thresholds.length_diff),
+         "match" if thresholds.entities_match else "ignore",
+         str(thresholds.words), *map(str, row), str(sum(row))]
+        for thresholds, row in zip(combinations, counts)
+    )
+    widths = [max(len(row[i]) for row in [header, *rows])
+              for i in range(len(header))]
+    print("  ".join(cell.rjust(width) for cell, width in zip(header, widths)))
+    for row in rows:
+        print("  ".join(cell.rjust(width) for cell, width in zip(row, widths)))
+    print(f"\n⏱  {len(combinations)} combinations evaluated in "
+          f"{elapsed * 1000:.1f}ms (first row: candidate pairs).")
+
+
+if __name__ == "__main__":
+    main(arg_parser.parse_args())
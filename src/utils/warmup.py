@@ -0,0 +1,77 @@
+"""Background warm-up.
+
+Loading a model takes seconds that are otherwise spent waiting. A
+:class:`BackgroundLoader` starts loading it in a background thread right
+away, so that the load overlaps with whatever the main thread does in the
+meantime (e.g., merging and deduplicating samples), and only blocks when the
+model is actually needed.
+"""
+
+import threading
+from typing import Callable, Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class BackgroundLoader(Generic[T]):
+    """Factory whose result is built in a background thread.
+
+    Calling the loader waits for the result and returns it, so it can be used
+    wherever the factory itself would be, e.g., as the
+    ``paraphraser_factory`` of a :class:`paraphrasis.CachedParaphraser`.
+    Every call returns the same object.
+
+    Attributes:
+        factory (:obj:`Callable[[], T]`):
+            The function that builds the result.
+    """
+
+    def __init__(self, factory: Callable[[], T], start: bool = True):
+        self.factory = factory
+        self._result: Optional[T] = None
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._load,
+                                        name="background-loader",
+                                        daemon=True)
+        if start:
+            self.start()
+
+    def _load(self):
+        try:
+            self._result = self.factory()
+        except BaseException as e:
+            self._error = e
+
+    def start(self):
+        """Start building the result, if not started yet."""
+        if not self._thread.is_alive() and self._thread.ident is None:
+            self._thread.start()
+
+    @property
+    def ready(self) -> bool:
+        """:obj:`bool`: Whether the result has been built (or failed)."""
+        return self._thread.ident is not None and not self._thread.is_alive()
+
+    def wait(self):
+        """Wait for the factory to finish, if it was started.
+
+        Unlike calling the loader, this does not raise what the factory
+        raised, e.g., when the result turned out not to be needed.
+        """
+        if self._thread.ident is not None:
+            self._thread.join()
+
+    def __call__(self) -> T:
+        """Wait for the result.
+
+        Returns:
+            :obj:`T`: The result of the factory.
+
+        Raises:
+            :obj:`BaseException`: Whatever the factory raised.
+        """
+        self.start()
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        return self._result
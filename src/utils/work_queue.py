@@ -0,0 +1,525 @@
+#!/usr/bin/env python3
+
+"""Cooperative paraphrase work queue over a shared directory.
+
+The coordinator (``produce_negation_dataset.py --work-queue <dir>``) splits
+the sentences to paraphrase into batch files in a directory that every node
+can reach, e.g., over NFS. Any number of workers, on any number of hosts,
+claim batches, paraphrase them and write the results back. The queue looks
+as follows::
+
+   queue.json                      settings and content address of every batch
+   pending/batch-00000.json        sentences waiting to be paraphrased
+   claimed/batch-00001.<worker>    sentences being paraphrased by a worker
+   done/<content address>.tsv      paraphrased samples
+
+Batches move from one directory to the next by renaming, which is atomic on
+POSIX file systems and on NFS, so every batch is claimed by a single worker.
+While paraphrasing a batch, the worker renews its lease by touching the
+claimed file. Batches whose lease has expired, e.g., because their worker
+died, are moved back to ``pending/`` by whichever process notices first. A
+batch whose worker was only slow may thus be paraphrased twice, but results
+are written atomically, so one of them simply replaces the other.
+
+Results are named after the content address of their batch (see
+:func:`paraphrase_shards.chunk_key`), so a restarted coordinator keeps the
+batches that are already done, as long as the sentences and settings did not
+change. If they did, the queue is replaced, and workers of the old queue stop
+instead of paraphrasing the new batches with the old settings. Once every
+batch is done, the coordinator reads the results in order and removes the
+queue.
+
+Workers can be started before or after the coordinator, with e.g.::
+
+   python src/utils/work_queue.py /shared/queue
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+import work_queue
+from dedup import Sample, format_sample, parse_line
+from paraphrase_shards import chunk_key
+from paraphrasis import (CachedParaphraser, Paraphraser, PegasusParaphraser,
+                         MODEL_NAME)
+from batching import TokenBudgetScheduler
+from inference_client import DEFAULT_ADDRESS, InferenceClient
+from paraphrase_cache import ParaphraseCache, DEFAULT_CACHE_PATH
+
+QUEUE_NAME: str = "queue.json"
+PENDING_DIR: str = "pending"
+CLAIMED_DIR: str = "claimed"
+DONE_DIR: str = "done"
+LEASE_SECONDS: float = 300.
+POLL_SECONDS: float = 5.
+MAX_TOKENS: int = 1024
+
+arg_parser = argparse.ArgumentParser(
+    formatter_class=argparse.RawTextHelpFormatter,
+    description=(work_queue.__doc__)
+)
+arg_parser.add_argument("queue", type=str,
+                        help="the shared directory of the work queue")
+arg_parser.add_argument("--worker-id", type=str, default=None,
+                        help="name of this worker, unique among all nodes. "
+                             "Defaults to\n'<host>-<pid>'.")
+arg_parser.add_argument("--lease", type=float, default=LEASE_SECONDS,
+                        help="seconds after which the batches of a worker "
+                             "that stopped\nrenewing its lease are "
+                             "reclaimed. Defaults to "
+                            f"{LEASE_SECONDS:g}.")
+arg_parser.add_argument("--poll", type=float, default=POLL_SECONDS,
+                        help="seconds to wait between checks when no batch "
+                             "is pending.\nDefaults to "
+                            f"{POLL_SECONDS:g}.")
+arg_parser.add_argument("-t", "--max-tokens", type=int, default=MAX_TOKENS,
+                        help="maximum number of padded tokens per paraphrasing "
+                             "batch.\nDefaults to "
+                            f"{MAX_TOKENS}.")
+arg_parser.add_argument("--token-corpus", type=str, default=None,
+                        help="shared directory of pre-tokenized sentences "
+                             "(see\n'token_corpus.py'), if any")
+arg_parser.add_argument("--service", type=str, default=DEFAULT_ADDRESS,
+                        help="address of the inference service to paraphrase "
+                             "with, if\none is running on this node with the "
+                             "same model and\nprecision. Defaults to "
+                            f"'{DEFAULT_ADDRESS}'.")
+arg_parser.add_argument("--no-service", action="store_true",
+                        help="always load the paraphrasing model in this "
+                             "process")
+arg_parser.add_argument("-c", "--cache", type=str, default=DEFAULT_CACHE_PATH,
+                        help="the SQLite file where generated paraphrases are "
+                             "cached on\nthis node. Defaults to "
+                            f"'{DEFAULT_CACHE_PATH}'.")
+arg_parser.add_argument("--no-cache", action="store_true",
+                        help="do not read from or write to the paraphrase "
+                             "cache")
+
+
+def default_worker_id() -> str:
+    """Name the worker after its host and process.
+
+    Returns:
+        :obj:`str`: The worker id, e.g., ``"node-3-4242"``.
+    """
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def _batch_name(index: int) -> str:
+    return f"batch-{index:05d}"
+
+
+def _lease_start(path: Path) -> float:
+    # Renaming a file updates its ctime, but not its mtime.
+    stat = path.stat()
+    return max(stat.st_mtime, stat.st_ctime)
+
+
+class _Lease:
+    """Context manager that renews the lease of a claimed batch."""
+
+    def __init__(self, path: Path, interval: float):
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._renew, name="lease",
+                                        daemon=True)
+
+    def _renew(self):
+        while not self._stop.wait(self.interval):
+            try:
+                os.utime(self.path)
+            except FileNotFoundError:
+                return  # reclaimed by another process
+
+    def __enter__(self) -> "_Lease":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+class WorkQueue:
+    """Paraphrase work queue in a shared directory.
+
+    Attributes:
+        path (:obj:`pathlib.Path`):
+            The directory of the queue.
+        settings (:obj:`Dict[str, Any]`):
+            The generation settings. See
+            :func:`paraphrasis.generation_settings`.
+        keys (:obj:`List[str]`):
+            The content address of every batch.
+        lease (:obj:`float`):
+            The seconds after which unrenewed claims expire.
+    """
+
+    def __init__(self, path: Union[str, Path], lease: float = LEASE_SECONDS):
+        """Open an existing queue.
+
+        Args:
+            path (:obj:`Union[str, pathlib.Path]`):
+                The directory of the queue.
+            lease (:obj:`float`, defaults to ``LEASE_SECONDS``):
+                The seconds after which unrenewed claims expire.
+
+        Raises:
+            :obj:`FileNotFoundError`: If the queue has not been created.
+        """
+        self.path = Path(path)
+        self.lease = lease
+        with open(self.path / QUEUE_NAME, encoding="utf-8") as f:
+            queue = json.load(f)
+        self.settings: Dict[str, Any] = queue["settings"]
+        self.keys: List[str] = queue["keys"]
+
+    @classmethod
+    def create(
+        cls,
+        path: Union[str, Path],
+        batches: List[List[str]],
+        settings: Dict[str, Any],
+        lease: float = LEASE_SECONDS
+    ) -> "WorkQueue":
+        """Create a queue, or reuse the one in the directory.
+
+        An existing queue is reused if it has the same batches and settings,
+        keeping the batches that are already done. Otherwise, it is replaced.
+
+        Args:
+            path (:obj:`Union[str, pathlib.Path]`):
+                The directory of the queue.
+            batches (:obj:`List[List[str]]`):
+                The sentences to paraphrase, in batches.
+            settings (:obj:`Dict[str, Any]`):
+                The generation settings. See
+                :func:`paraphrasis.generation_settings`.
+            lease (:obj:`float`, defaults to ``LEASE_SECONDS``):
+                The seconds after which unrenewed claims expire.
+
+        Returns:
+            :obj:`WorkQueue`: The queue.
+        """
+        path = Path(path)
+        queue = {"settings": settings,
+                 "keys": [chunk_key(batch, **settings) for batch in batches]}
+        try:
+            with open(path / QUEUE_NAME, encoding="utf-8") as f:
+                reuse = json.load(f) == queue
+        except FileNotFoundError:
+            reuse = False
+        if not reuse:
+            # Workers wait until the new queue is complete, and workers of
+            # the old queue stop.
+            _remove_queue(path)
+        for name in (PENDING_DIR, CLAIMED_DIR, DONE_DIR):
+            (path / name).mkdir(parents=True, exist_ok=True)
+        for index, (key, batch) in enumerate(zip(queue["keys"], batches)):
+            name = _batch_name(index)
+            if ((path / DONE_DIR / f"{key}.tsv").exists()
+                    or (path / PENDING_DIR / f"{name}.json").exists()
+                    or any((path / CLAIMED_DIR).glob(f"{name}.*"))):
+                continue
+            _write_atomically(path / PENDING_DIR / f"{name}.json",
+                              json.dumps({"key": key, "sentences": batch}))
+        _write_atomically(path / QUEUE_NAME, json.dumps(queue))
+        return cls(path, lease=lease)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _done_path(self, index: int) -> Path:
+        return self.path / DONE_DIR / f"{self.keys[index]}.tsv"
+
+    def is_current(self) -> bool:
+        """Determine whether the queue is still the one in the directory.
+
+        Returns:
+            :obj:`bool`: Whether the queue has been neither removed nor
+            replaced by a queue with other batches or settings.
+        """
+        try:
+            with open(self.path / QUEUE_NAME, encoding="utf-8") as f:
+                queue = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return False  # removed, or being replaced
+        return queue == {"settings": self.settings, "keys": self.keys}
+
+    def status(self) -> Dict[str, int]:
+        """Count the batches in every state.
+
+        Returns:
+            :obj:`Dict[str, int]`: The number of pending, claimed and done
+            batches.
+        """
+        status = {name: sum(1 for _ in (self.path / name).glob("batch-*"))
+                  for name in (PENDING_DIR, CLAIMED_DIR)}
+        status[DONE_DIR] = sum(1 for i in range(len(self))
+                               if self._done_path(i).exists())
+        return status
+
+    def finished(self) -> bool:
+        """Determine whether every batch is done.
+
+        Returns:
+            :obj:`bool`: Whether the results of every batch are written.
+        """
+        return all(self._done_path(i).exists() for i in range(len(self)))
+
+    def reclaim(self) -> int:
+        """Move the batches whose lease has expired back to pending.
+
+        Returns:
+            :obj:`int`: The number of batches reclaimed.
+        """
+        reclaimed = 0
+        now = time.time()
+        for claimed in (self.path / CLAIMED_DIR).glob("batch-*"):
+            name = claimed.name.split(".", 1)[0]
+            index = int(name.split("-")[1])
+            try:
+                if now - _lease_start(claimed) < self.lease:
+                    continue
+                if index < len(self) and self._done_path(index).exists():
+                    claimed.unlink()  # finished just before dying
+                else:
+                    os.rename(claimed,
+                              self.path / PENDING_DIR / f"{name}.json")
+                    reclaimed += 1
+            except FileNotFoundError:
+                continue  # reclaimed or finished by another process
+        return reclaimed
+
+    def claim(self, worker: str) -> Optional[Tuple[int, Path]]:
+        """Claim the first pending batch.
+
+        Args:
+            worker (:obj:`str`):
+                The id of the worker.
+
+        Returns:
+            :obj:`Optional[Tuple[int, pathlib.Path]]`: The index of the batch
+            and its claimed file, or :obj:`None` if no batch is pending.
+        """
+        for pending in sorted((self.path / PENDING_DIR).glob("batch-*")):
+            claimed = self.path / CLAIMED_DIR / f"{pending.stem}.{worker}"
+            try:
+                os.rename(pending, claimed)
+            except FileNotFoundError:
+                continue  # claimed by another worker
+            return int(pending.stem.split("-")[1]), claimed
+        return None
+
+    def release(self, index: int, claimed: Path):
+        """Put a claimed batch back to pending.
+
+        Args:
+            index (:obj:`int`):
+                The index of the batch.
+            claimed (:obj:`pathlib.Path`):
+                The claimed file of the batch.
+        """
+        try:
+            os.rename(claimed,
+                      self.path / PENDING_DIR / f"{_batch_name(index)}.json")
+        except FileNotFoundError:
+            pass  # reclaimed, or the queue was removed
+
+    def complete(self, index: int, claimed: Path, samples: List[Sample]):
+        """Write the results of a batch and release its claim.
+
+        Args:
+            index (:obj:`int`):
+                The index of the batch.
+            claimed (:obj:`pathlib.Path`):
+                The claimed file of the batch.
+            samples (:obj:`List[Sample]`):
+                The paraphrased samples of the batch.
+        """
+        _write_atomically(
+            self._done_path(index),
+            "".join(map(format_sample, samples)),
+            tmp_suffix=f".{claimed.name.split('.', 1)[1]}"
+        )
+        claimed.unlink(missing_ok=True)
+
+    def work(
+        self,
+        paraphraser: Paraphraser,
+        worker: Optional[str] = None,
+        poll: float = POLL_SECONDS
+    ) -> int:
+        """Paraphrase batches until every batch of the queue is done.
+
+        Returns once every batch is done, even if by other workers, so that
+        the batches of workers that die are reclaimed in the meantime. Also
+        returns if the queue is removed or replaced (see :meth:`is_current`),
+        without paraphrasing the batches of the new queue.
+
+        Args:
+            paraphraser (:obj:`Paraphraser`):
+                The paraphraser to use.
+            worker (:obj:`Optional[str]`, defaults to :obj:`None`):
+                The id of the worker. If :obj:`None`, it is derived from the
+                host and process.
+            poll (:obj:`float`, defaults to ``POLL_SECONDS``):
+                The seconds to wait between checks when no batch is pending.
+
+        Returns:
+            :obj:`int`: The number of batches paraphrased by this worker.
+        """
+        worker = worker or default_worker_id()
+        num_return = self.settings["num_return_sentences"]
+        done = 0
+        while self.is_current():
+            self.reclaim()
+            claim = self.claim(worker)
+            if claim is None:
+                if self.finished():
+                    break
+                time.sleep(poll)
+                continue
+            index, claimed = claim
+            try:
+                with open(claimed, encoding="utf-8") as f:
+                    pending = json.load(f)
+            except FileNotFoundError:
+                continue  # reclaimed right after being claimed
+            if index >= len(self) or pending["key"] != self.keys[index]:
+                # A batch of a queue that replaced this one.
+                self.release(index, claimed)
+                break
+            batch = pending["sentences"]
+            with _Lease(claimed, self.lease / 3):
+                paraphrased = paraphraser.paraphrase_batch(
+                    batch,
+                    num_return_sentences=num_return
+                )
+            try:
+                self.complete(index, claimed, [
+                    (batch[j], para_sent.strip(), "0")
+                    for j, paraphrased_sents in enumerate(paraphrased)
+                    for para_sent in paraphrased_sents
+                ])
+            except FileNotFoundError:
+                break  # the queue was removed
+            done += 1
+        return done
+
+    def samples(self, num_batches: Optional[int] = None) -> Iterator[Sample]:
+        """Stream the paraphrased samples of the first batches, in order.
+
+        Args:
+            num_batches (:obj:`Optional[int]`, defaults to :obj:`None`):
+                The number of batches to read. If :obj:`None`, every batch is
+                read.
+
+        Returns:
+            :obj:`Iterator[Sample]`: The paraphrased samples.
+
+        Raises:
+            :obj:`RuntimeError`: If a batch is not done, e.g., because the
+            queue was replaced.
+        """
+        for index in range(len(self) if num_batches is None else num_batches):
+            try:
+                with open(self._done_path(index), encoding="utf-8") as f:
+                    yield from (parse_line(line) for line in f if line.strip())
+            except FileNotFoundError as e:
+                raise RuntimeError(
+                    f"Batch {index} of the queue in '{self.path}' is not "
+                    "done. Was the queue replaced?"
+                ) from e
+
+    def remove(self):
+        """Delete the queue, which also stops the remaining workers.
+
+        Only the files of the queue are deleted. The directory itself is
+        only deleted if nothing else is left in it.
+        """
+        _remove_queue(self.path)
+        try:
+            self.path.rmdir()
+        except OSError:
+            pass  # not empty
+
+
+def _remove_queue(path: Path):
+    """Delete the files of a queue, starting with its description."""
+    (path / QUEUE_NAME).unlink(missing_ok=True)
+    (path / f".{QUEUE_NAME}.tmp").unlink(missing_ok=True)
+    for name in (PENDING_DIR, CLAIMED_DIR, DONE_DIR):
+        shutil.rmtree(path / name, ignore_errors=True)
+
+
+def _write_atomically(path: Path, content: str, tmp_suffix: str = ""):
+    """Write a file durably, replacing it in a single step.
+
+    Workers that may write the same file use different temporary files.
+    """
+    tmp_path = path.with_name(f".{path.name}{tmp_suffix}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def main(args: argparse.ArgumentParser):
+    """Work on a paraphrase queue."""
+    worker = args.worker_id or default_worker_id()
+    print(f"👷 Worker '{worker}' waiting for the queue in '{args.queue}'...")
+    while not (Path(args.queue) / QUEUE_NAME).exists():
+        time.sleep(args.poll)
+    queue = WorkQueue(args.queue, lease=args.lease)
+    if queue.settings["model_name"] != MODEL_NAME:
+        sys.exit(f"The queue was created for the model "
+                 f"'{queue.settings['model_name']}', not '{MODEL_NAME}'.")
+    precision = queue.settings["precision"]
+
+    def paraphraser_factory() -> Union[TokenBudgetScheduler, InferenceClient]:
+        client = InferenceClient.connect(
+            None if args.no_service else args.service)
+        if (client is not None
+                and client.info.get("model_name") == MODEL_NAME
+                and client.info.get("precision") == precision):
+            print(f"🔌 Paraphrasing with the service at {args.service}.")
+            return client
+        return TokenBudgetScheduler(
+            PegasusParaphraser(precision=precision,
+                               token_corpus=args.token_corpus),
+            max_tokens=args.max_tokens
+        )
+
+    cache = None
+    if args.no_cache:
+        paraphraser = paraphraser_factory()
+    else:
+        cache = ParaphraseCache(args.cache)
+        paraphraser = CachedParaphraser(
+            cache,
+            paraphraser_factory=paraphraser_factory,
+            precision=precision
+        )
+    print(f"⚙  {queue.status()}")
+    done = queue.work(paraphraser, worker=worker, poll=args.poll)
+    if cache is not None:
+        cache.close()
+    if (Path(args.queue) / QUEUE_NAME).exists() and not queue.is_current():
+        print("⚠️  The queue was replaced by another one. Start the worker "
+              "again to work on it.")
+    print(f"✅ Done! Paraphrased {done} of {len(queue)} batches.")
+
+
+if __name__ == "__main__":
+    main(arg_parser.parse_args())